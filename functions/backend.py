@@ -0,0 +1,231 @@
+import os
+import hashlib
+import threading
+from datetime import datetime
+import streamlit as st
+import pandas as pd
+from functions import currency, disk_cache, versions
+from functions.query import current_union, data_columns, data_path, data_sources, read_dataset, source_column
+
+## Pluggable compute backend for the report pages.
+## With BILLING_COMPUTE_BACKEND=duckdb the date range, customer segments, tenure buckets, filter options and the
+## filtered rows are computed in DuckDB over a columnar (Parquet) copy of the data, and metrics that have a SQL
+## version (functions/sql_metrics.py) aggregate there too. Only result frames come back into pandas; a metric
+## without a SQL version gets the filtered rows materialized once. The default backend is pandas.
+
+backends = ['pandas', 'duckdb']
+
+## CSV sources (and sources with amounts to convert) are written to Parquet once per source modification and kept here (git-ignored).
+columnar_cache_dir = 'data/cache'
+
+
+def compute_backend():
+    backend = os.environ.get('BILLING_COMPUTE_BACKEND', 'pandas').lower()
+    if backend not in backends:
+        raise ValueError(f"Unknown BILLING_COMPUTE_BACKEND '{backend}', expected one of {backends}")
+    if backend == 'duckdb':
+        try:
+            import duckdb  # noqa: F401
+        except ImportError:
+            st.warning("DuckDB is not installed, falling back to the pandas backend (pip install duckdb).")
+            return 'pandas'
+    return backend
+
+@st.cache_resource(show_spinner=False)
+def connection():
+    import duckdb
+
+    con = duckdb.connect()
+    con.execute(f"SET threads = {os.cpu_count() or 1}")
+    return con
+
+def run(sql, params=None):
+    # Each call gets its own cursor, so queries from the executor's worker threads can run side by side.
+    result = connection().cursor().execute(sql, params or []).df()
+    for column in result.columns:
+        if pd.api.types.is_datetime64_any_dtype(result[column]):
+            result[column] = result[column].astype('datetime64[ns]')
+    return result
+
+def source_token(path):
+    # Content fingerprint of the columnar source (functions.versions), the key of every cache over it
+    return f'{os.path.abspath(path)}:{versions.file_fingerprint(path)}'
+
+@st.cache_data(show_spinner=False)
+def _needs_conversion(path, token, fx_version):
+    return currency.needs_conversion(pd.read_parquet(path, columns=['currency'])['currency'])
+
+def columnar_source(path):
+    ## Parquet sources already in the reporting currency are read in place. Anything else (a CSV, or amounts that need
+    ## converting) is read once with the same parsing and currency conversion as the pandas backend and written to
+    ## Parquet next to the other cached copies; the copy is replaced atomically when the source or the rates change.
+    if path.endswith('.parquet') and not _needs_conversion(path, source_token(path), currency.fx_rates_version()):
+        return path
+
+    stat = os.stat(path)
+    name = os.path.splitext(os.path.basename(path))[0]
+    rates = hashlib.sha1(repr(currency.fx_rates_version()).encode()).hexdigest()[:12]
+    target = os.path.join(columnar_cache_dir, f'{name}-{stat.st_mtime_ns}-{stat.st_size}-{rates}.parquet')
+    if not os.path.exists(target):
+        os.makedirs(columnar_cache_dir, exist_ok=True)
+        temporary = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        data = pd.DataFrame(read_dataset(path), columns=data_columns)
+        data['created_at'] = pd.to_datetime(data['created_at'])
+        currency.normalize(data).to_parquet(temporary, index=False)
+        os.replace(temporary, target)
+    return target
+
+def data_source():
+    ## The columnar source of the configured data: that of the single source, or with several sources
+    ## (BILLING_DATA_SOURCES) a Parquet copy of their union (functions.query), written once per union version.
+    sources = data_sources()
+    if sources is None:
+        return columnar_source(data_path())
+
+    current = current_union(sources)
+    target = os.path.join(columnar_cache_dir, f"union-{current['version'][:16]}.parquet")
+    if not os.path.exists(target):
+        os.makedirs(columnar_cache_dir, exist_ok=True)
+        temporary = f'{target}.{os.getpid()}.{threading.get_ident()}.tmp'
+        union = current['data'][data_columns + [source_column]]
+        union.assign(created_at=pd.to_datetime(union['created_at'])).to_parquet(temporary, index=False)
+        os.replace(temporary, target)
+    return target
+
+@st.cache_data(show_spinner=False)
+def date_bounds(path, token):
+    bounds = run("SELECT min(CAST(created_at AS DATE)) AS min_date, max(CAST(created_at AS DATE)) AS max_date FROM read_parquet(?)", [path])
+    return bounds['min_date'][0].date(), bounds['max_date'][0].date()
+
+
+## Filtering. The CTEs reproduce functions.filters: the date filter on the order date, revenue segments from the
+## quartiles of company revenue in the date range, tenure buckets in 30-day months and the multiselect filters.
+
+tenure_months_sql = "CAST(trunc(date_diff('microsecond', customer_created_at, CAST(? AS TIMESTAMP)) / 2592000000000.0) AS BIGINT)"
+
+tenure_range_sql = """CASE
+        WHEN customer_tenure_months IS NULL THEN NULL
+        WHEN customer_tenure_months BETWEEN 0 AND 6 THEN '0-6 months'
+        WHEN customer_tenure_months BETWEEN 7 AND 12 THEN '7-12 months'
+        WHEN customer_tenure_months BETWEEN 13 AND 24 THEN '1-2 years'
+        WHEN customer_tenure_months BETWEEN 25 AND 36 THEN '2-3 years'
+        WHEN customer_tenure_months BETWEEN 37 AND 48 THEN '3-4 years'
+        WHEN customer_tenure_months BETWEEN 49 AND 60 THEN '4-5 years'
+        ELSE '5+ years'
+    END"""
+
+revenue_segment_sql = """CASE
+        WHEN company_revenue.revenue IS NULL THEN NULL
+        WHEN company_revenue.revenue < thresholds.low THEN 'Low Revenue'
+        WHEN company_revenue.revenue < thresholds.medium THEN 'Medium Revenue'
+        WHEN company_revenue.revenue < thresholds.high THEN 'High Revenue'
+        ELSE 'Very High Revenue'
+    END"""
+
+segmented_sql = f"""
+    dated AS (
+        SELECT * REPLACE (CAST(CAST(created_at AS DATE) AS TIMESTAMP) AS created_at)
+        FROM read_parquet(?, file_row_number = true)
+        WHERE CAST(created_at AS DATE) BETWEEN CAST(? AS DATE) AND CAST(? AS DATE)
+    ),
+    company_revenue AS (
+        SELECT customer_company, coalesce(sum(total_amount), 0) AS revenue
+        FROM dated WHERE customer_company IS NOT NULL GROUP BY customer_company
+    ),
+    thresholds AS (
+        SELECT quantile_cont(revenue, 0.25) AS low, quantile_cont(revenue, 0.5) AS medium, quantile_cont(revenue, 0.75) AS high
+        FROM company_revenue
+    ),
+    tenured AS (
+        SELECT *, CAST(customer_created_at AS TIMESTAMP) AS customer_created_date, {tenure_months_sql} AS customer_tenure_months
+        FROM dated
+    ),
+    segmented AS (
+        SELECT tenured.*,
+            {tenure_range_sql} AS customer_tenure_range,
+            {revenue_segment_sql} AS revenue_segment
+        FROM tenured
+        LEFT JOIN company_revenue USING (customer_company)
+        CROSS JOIN thresholds
+    )"""
+
+## All line items of the source, outside the date range too, with the segments and tenure of the date range
+## (functions.filters.history_mask). Follows segmented_sql, whose company revenue and thresholds it reads.
+history_sql = f"""
+    history_tenured AS (
+        SELECT *, {tenure_months_sql} AS customer_tenure_months
+        FROM read_parquet(?)
+    ),
+    history AS (
+        SELECT history_tenured.*,
+            {tenure_range_sql} AS customer_tenure_range,
+            {revenue_segment_sql} AS revenue_segment
+        FROM history_tenured
+        LEFT JOIN company_revenue USING (customer_company)
+        CROSS JOIN thresholds
+    )"""
+
+def _selection_sql(selections):
+    # selections is a sequence of (column, selected values); a value matches on its string form, like the options.
+    clauses = [f'list_contains(?, CAST({column} AS VARCHAR))' for column, _ in selections]
+    params = [list(values) for _, values in selections]
+    return (' AND '.join(clauses) if clauses else 'true'), params
+
+def _segmented_params(path, start, end, now):
+    return [path, start, end, now]
+
+class Relation:
+    # The filtered line items as a DuckDB query. Metrics query it with query(); to_pandas() materializes the rows
+    # (in source order, with the columns of the pandas backend) for metrics that only have a pandas version.
+
+    def __init__(self, path, token, start, end, selections, now):
+        self.path, self.token, self.start, self.end, self.selections, self.now = path, token, start, end, selections, now
+        where, where_params = _selection_sql(selections)
+        self.sql = f"WITH {segmented_sql}, filtered AS (SELECT * FROM segmented WHERE {where})"
+        self.params = _segmented_params(path, start, end, now) + where_params
+        self.history_sql = f"WITH {segmented_sql}, {history_sql}, selected AS (SELECT * FROM history WHERE {where})"
+        self.history_params = _segmented_params(path, start, end, now) + [now, path] + where_params
+        # Tenure buckets move in 30-day steps, so the clock takes part in the key at day resolution.
+        key = repr((token, self.sql, start, end, selections, now.date()))
+        self.fingerprint = 'duckdb:' + hashlib.sha1(key.encode()).hexdigest()
+        self._frame = None
+        self._lock = threading.Lock()
+
+    def query(self, select_sql, params=None):
+        return run(f"{self.sql} {select_sql}", self.params + list(params or []))
+
+    def history_query(self, select_sql, params=None):
+        # Queries the line items of the whole source that match the filter selections, as the `selected` CTE
+        return run(f"{self.history_sql} {select_sql}", self.history_params + list(params or []))
+
+    def record_batches(self, select_sql, rows):
+        # Streams the result as Arrow record batches of up to rows rows.
+        return connection().cursor().execute(f"{self.sql} {select_sql}", self.params).fetch_record_batch(rows)
+
+    def to_pandas(self):
+        with self._lock:
+            if self._frame is None:
+                self._frame = self.query("SELECT * EXCLUDE (file_row_number) FROM filtered ORDER BY file_row_number")
+            return self._frame
+
+def is_relation(data):
+    return isinstance(data, Relation)
+
+def filtered(path, token, start, end, selections):
+    return Relation(path, token, start, end, tuple(selections), datetime.now())
+
+@st.cache_data(show_spinner=False, max_entries=1024)
+def _filter_options(path, token, start, end, selections, column, today):
+    def query():
+        where, where_params = _selection_sql(selections)
+        options = run(
+            f"WITH {segmented_sql} SELECT DISTINCT CAST({column} AS VARCHAR) AS value FROM segmented WHERE {where} AND {column} IS NOT NULL",
+            _segmented_params(path, start, end, datetime.now()) + where_params
+        )
+        return sorted(options['value'])
+
+    return disk_cache.cached(('filter_options', segmented_sql, token, start, end, selections, column, today), query)
+
+def filter_options(path, token, start, end, selections, column):
+    # Distinct values of a filter column within the date range and the earlier filter selections, sorted like the pandas backend.
+    return _filter_options(path, token, start, end, tuple(selections), column, datetime.now().date())
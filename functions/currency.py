@@ -0,0 +1,82 @@
+import os
+import numpy as np
+import pandas as pd
+
+## Conversion of all amounts into a single reporting currency (BILLING_REPORTING_CURRENCY, USD by default).
+## Rates come from a local table (BILLING_FX_RATES_PATH) of dated rates against USD: one row per currency and date,
+## usd_per_unit being the USD value of one unit of the currency from that date on. Every line item is converted at the
+## rates in effect at its order date (an as-of join on created_at); orders before the first rate of a currency use its
+## first rate. The conversion runs once per loaded dataset version, so pages only ever read converted amounts. The
+## line item's own currency is kept in source_currency and the applied rate in fx_rate; data that is all in the
+## reporting currency is left as it is.
+
+FX_RATES_PATH = 'data/fx_rates.csv'
+base_currency = 'USD'
+amount_columns = ['unit_amount', 'discount_amount', 'tax_amount', 'total_amount', 'fee_amount', 'refund_amount']
+
+
+def reporting_currency():
+    return os.environ.get('BILLING_REPORTING_CURRENCY', base_currency).upper()
+
+def fx_rates_path():
+    return os.environ.get('BILLING_FX_RATES_PATH', FX_RATES_PATH)
+
+def fx_rates_version():
+    # Part of the dataset version: editing the rate table or switching currency reloads the data
+    path = fx_rates_path()
+    stat = os.stat(path) if os.path.exists(path) else None
+    return reporting_currency(), path, stat.st_mtime_ns if stat else None, stat.st_size if stat else None
+
+def load_fx_rates():
+    rates = pd.read_csv(fx_rates_path(), parse_dates=['date'])
+    rates['currency'] = rates['currency'].str.upper()
+    return rates.dropna().sort_values('date', kind='stable').reset_index(drop=True)
+
+def needs_conversion(currencies):
+    currencies = pd.Series(pd.unique(pd.Series(currencies).dropna())).astype(str).str.upper()
+    return bool((currencies != reporting_currency()).any())
+
+def rate_table(rates):
+    # One row per rate date and one column per currency (USD per unit), carried forward to the dates where only other
+    # currencies changed; before its first rate a currency uses that first rate.
+    wide = rates.pivot_table(index='date', columns='currency', values='usd_per_unit', aggfunc='last').sort_index()
+    wide = wide.ffill().bfill()
+    wide[base_currency] = 1.0
+    return wide
+
+def rate_positions(dates, wide):
+    ## Row of the rate table in effect at each date, as a vectorized as-of join (merge_asof needs both sides sorted on
+    ## the join key, so rows are joined in date order and put back in place afterwards).
+    rows = pd.DataFrame({'date': dates, 'row': np.arange(len(dates))}).sort_values('date', kind='stable')
+    table = pd.DataFrame({'date': wide.index, 'position': np.arange(len(wide))})
+    joined = pd.merge_asof(rows, table, on='date', direction='backward')
+    positions = np.empty(len(dates), dtype=np.int64)
+    positions[joined['row'].to_numpy()] = joined['position'].fillna(0).to_numpy(dtype=np.int64)
+    return positions
+
+def normalize(data):
+    ## Converts the amount columns of the line items (with created_at as datetimes) in place.
+    target = reporting_currency()
+    codes, currencies = pd.factorize(data['currency'].fillna(target))
+    currencies = pd.Index(currencies).astype(str).str.upper()
+    if not needs_conversion(currencies):
+        return data
+
+    wide = rate_table(load_fx_rates())
+    missing = sorted((set(currencies) | {target}) - set(wide.columns))
+    if missing:
+        raise ValueError(f"No FX rates for {', '.join(missing)} in {fx_rates_path()}")
+
+    # Rows without an order date are converted at the latest rates
+    dates = pd.to_datetime(data['created_at']).astype('datetime64[ns]')
+    positions = rate_positions(dates.fillna(wide.index.max()).to_numpy(), wide)
+    usd_per_unit = wide.to_numpy()
+    fx_rate = usd_per_unit[positions, wide.columns.get_indexer(currencies)[codes]] / usd_per_unit[positions, wide.columns.get_loc(target)]
+
+    for column in amount_columns:
+        if column in data.columns:
+            data[column] = data[column] * fx_rate
+    data['source_currency'] = currencies[codes]
+    data['currency'] = target
+    data['fx_rate'] = fx_rate
+    return data
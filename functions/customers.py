@@ -0,0 +1,127 @@
+import threading
+import numpy as np
+import pandas as pd
+import streamlit as st
+from functions import versions
+
+## Customer dimension.
+## The loader stores an int32 customer code (customer_code: the rank of customer_id, -1 when it is missing) on every
+## line item and builds, once per dataset version, a dimension table with one row per code: the customer's attributes,
+## first and last order, lifetime revenue, refunds and discounts and whether they have an active subscription. Tenure
+## buckets move daily and are derived from it on demand. Segmentation, the customer table and the retention and new
+## customer KPIs look customers up in it by code, and aggregate a frame per customer with bincounts over the codes,
+## instead of grouping the line items by customer_id.
+##
+## Customer attributes (name, email, company, created date, ...) are taken from the customer's first line item; the
+## billing model repeats them on all of a customer's line items.
+
+code_column = 'customer_code'
+missing_code = -1
+attribute_columns = ['customer_id', 'customer_name', 'customer_email', 'customer_city', 'customer_country', 'customer_company',
+                     'customer_level', 'customer_created_at']
+
+tenure_ranges = [
+    (0, 6, '0-6 months'),
+    (7, 12, '7-12 months'),
+    (13, 24, '1-2 years'),
+    (25, 36, '2-3 years'),
+    (37, 48, '3-4 years'),
+    (49, 60, '4-5 years')
+]
+longest_tenure = '5+ years'
+
+_dimensions = {}
+_lock = threading.Lock()
+
+
+def customer_codes(customer_ids):
+    codes, _ = pd.factorize(customer_ids, sort=True)
+    return codes.astype(np.int32)
+
+def code_values(data):
+    # The code column of a frame that is missing it (at load, or rows of the DuckDB backend)
+    if code_column in data.columns or 'customer_id' not in data.columns:
+        return {}
+    return {code_column: customer_codes(data['customer_id'])}
+
+def add_codes(data):
+    for name, values in code_values(data).items():
+        data[name] = values
+    return data
+
+def per_code(codes, size, weights=None):
+    # Sum of weights (or count of rows) per code (customer or company), 0 for codes without rows; rows with the
+    # missing code are left out
+    known = codes != missing_code
+    if weights is not None:
+        weights = np.nan_to_num(np.asarray(weights, dtype=np.float64)[known])
+    return np.bincount(codes[known], weights=weights, minlength=size)
+
+def lookup(values, codes):
+    # values[codes], with missing codes giving a missing value
+    values, codes = np.asarray(values), np.asarray(codes)
+    if (codes == missing_code).any():
+        return pd.Series(values).reindex(codes).to_numpy()
+    return values[codes]
+
+def build_dimension(data):
+    ## One row per customer code, indexed by code.
+    codes = data[code_column].to_numpy()
+    size = int(codes.max()) + 1 if len(codes) and codes.max() > missing_code else 0
+    known = codes != missing_code
+    present, first_rows = np.unique(codes[known], return_index=True)
+    rows = np.flatnonzero(known)[first_rows]
+
+    dimension = data[[column for column in attribute_columns if column in data.columns]].iloc[rows]
+    dimension = dimension.set_axis(present).reindex(pd.RangeIndex(size))
+    dimension['company_code'] = pd.factorize(dimension['customer_company'], sort=True)[0].astype(np.int32)
+
+    orders = pd.to_datetime(pd.Series(data['created_at'].to_numpy()[known]), errors='coerce').groupby(codes[known]).agg(['min', 'max'])
+    dimension['first_order_at'] = orders['min']
+    dimension['last_order_at'] = orders['max']
+    dimension['lifetime_revenue'] = per_code(codes, size, data['total_amount'])
+    dimension['lifetime_refunds'] = per_code(codes, size, data['refund_amount'])
+    dimension['lifetime_discounts'] = per_code(codes, size, data['discount_amount'])
+    active = (data['subscription_status'] == 'active').to_numpy()
+    dimension['active_subscription'] = per_code(np.where(active, codes, missing_code), size) > 0
+    return dimension
+
+def register(data):
+    ## Builds the dimension of a newly loaded dataset version; versions that are no longer loaded are dropped.
+    dimension = build_dimension(data)
+    live = {key for key, step, _ in versions.live_frames() if step == 'dataset'}
+    with _lock:
+        for version in [version for version in _dimensions if version not in live]:
+            del _dimensions[version]
+        _dimensions[versions.key_of(data)] = dimension
+    return data
+
+def registered():
+    # (dataset version, dimension) of every loaded dataset version (functions.memory)
+    with _lock:
+        return list(_dimensions.items())
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _frame_dimension(key, _data):
+    return build_dimension(_data)
+
+def dimension(data):
+    ## The dimension of the dataset a frame was derived from. Frames outside the page flow get a dimension of their
+    ## own rows.
+    with _lock:
+        found = _dimensions.get(versions.dataset_of(data))
+    if found is not None:
+        return found
+    from functions.metrics import fingerprint
+
+    return _frame_dimension(fingerprint(data), data)
+
+def tenure(dimension, today):
+    ## (tenure in 30-day months, tenure bucket) of every customer on a day. Customers without a created date have
+    ## neither (NaN and None).
+    created = pd.to_datetime(dimension['customer_created_at'])
+    months = np.trunc(((today - created) / pd.Timedelta(days=30)).to_numpy(dtype=float))
+    labels = np.where(np.isnan(months), None, longest_tenure).astype(object)
+    for start, end, label in reversed(tenure_ranges):
+        labels[(months >= start) & (months <= end)] = label
+    return months, labels
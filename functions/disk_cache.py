@@ -0,0 +1,152 @@
+import os
+import functools
+import glob
+import hashlib
+import logging
+import pickle
+import tempfile
+import threading
+
+## Persistent result cache underneath the in-memory st.cache_data caches.
+## Page aggregates and the DuckDB filter options are also stored as pickle files in
+## BILLING_DISK_CACHE_DIR, so a restarted process (or another replica sharing the directory) reads them from disk
+## instead of recomputing them. Entries are keyed on everything the result depends on: the function, the fingerprint
+## of the filtered input (which covers the dataset and the filter selections), the remaining arguments and the source
+## of the functions package, so a deploy with changed code never reads the entries of the previous one. Files are
+## written to a temporary name and renamed into place, so readers never see a partial entry. The directory is bounded
+## to BILLING_DISK_CACHE_MB (0 turns the tier off); past that, the least recently used entries are removed (a hit
+## touches its file's modification time). The total size is scanned once per process and then tracked as entries are
+## written; the directory is only listed again to evict, which also picks up the entries of other processes.
+
+DISK_CACHE_DIR = 'data/cache/results'
+max_bytes = int(float(os.environ.get('BILLING_DISK_CACHE_MB', 512)) * 2 ** 20)
+
+_evict_lock = threading.Lock()
+# Tracked size of the entries, by directory
+_total_bytes = {}
+
+logger = logging.getLogger(__name__)
+
+
+def cache_dir():
+    return os.environ.get('BILLING_DISK_CACHE_DIR', DISK_CACHE_DIR)
+
+def enabled():
+    return max_bytes > 0
+
+@functools.lru_cache(maxsize=1)
+def code_version():
+    hasher = hashlib.sha1()
+    for path in sorted(glob.glob(os.path.join(os.path.dirname(os.path.abspath(__file__)), '*.py'))):
+        with open(path, 'rb') as f:
+            hasher.update(f.read())
+    return hasher.hexdigest()
+
+def entry_key(parts):
+    # None when the key parts cannot be pickled; such results are only cached in memory
+    try:
+        return hashlib.sha1(pickle.dumps((code_version(), parts), protocol=4)).hexdigest()
+    except Exception:
+        return None
+
+def entry_path(key):
+    return os.path.join(cache_dir(), f'{key}.pkl')
+
+def load(key):
+    ## Returns (True, value) on a hit, (False, None) otherwise. Unreadable entries are dropped.
+    path = entry_path(key)
+    try:
+        with open(path, 'rb') as f:
+            value = pickle.load(f)
+    except FileNotFoundError:
+        return False, None
+    except Exception:
+        logger.warning("Dropping unreadable disk cache entry %s", path, exc_info=True)
+        _remove(path)
+        return False, None
+    try:
+        os.utime(path)
+    except OSError:
+        pass
+    return True, value
+
+def store(key, value):
+    directory = cache_dir()
+    path = entry_path(key)
+    try:
+        os.makedirs(directory, exist_ok=True)
+        fd, temp_path = tempfile.mkstemp(dir=directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(value, f, protocol=pickle.HIGHEST_PROTOCOL)
+                size = f.tell()
+            replaced = _size(path)
+            os.replace(temp_path, path)
+        except BaseException:
+            _remove(temp_path)
+            raise
+    except Exception:
+        # A full or read-only disk only costs the persistence, never the page
+        logger.warning("Could not write disk cache entry %s", key, exc_info=True)
+        return
+    if _grow(directory, size - replaced) > max_bytes:
+        evict()
+
+def _grow(directory, change):
+    # Adds change to the tracked size of the directory's entries and returns it
+    with _evict_lock:
+        if directory in _total_bytes:
+            _total_bytes[directory] += change
+        else:
+            _total_bytes[directory] = sum(size for _, size, _ in _entries(directory))
+        return _total_bytes[directory]
+
+def _size(path):
+    try:
+        return os.path.getsize(path)
+    except FileNotFoundError:
+        return 0
+
+def _entries(directory):
+    # (modification time, size, path) of every entry in the directory
+    entries = []
+    with os.scandir(directory) as scan:
+        for entry in scan:
+            if entry.name.endswith('.pkl'):
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                entries.append((stat.st_mtime_ns, stat.st_size, entry.path))
+    return entries
+
+def evict():
+    ## Removes the least recently used entries until the directory fits in max_bytes.
+    directory = cache_dir()
+    with _evict_lock:
+        entries = _entries(directory)
+        total = sum(size for _, size, _ in entries)
+        for _, size, path in sorted(entries):
+            if total <= max_bytes:
+                break
+            _remove(path)
+            total -= size
+        _total_bytes[directory] = total
+
+def _remove(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+def cached(parts, compute):
+    ## Result of compute() for the key parts, read from disk if another process (or an earlier run) stored it.
+    key = entry_key(parts) if enabled() else None
+    if key is None:
+        return compute()
+    hit, value = load(key)
+    if hit:
+        return value
+    value = compute()
+    store(key, value)
+    return value
@@ -0,0 +1,60 @@
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from streamlit.runtime.scriptrunner import add_script_run_ctx, get_script_run_ctx
+
+## Runs independent page computations concurrently on a shared thread pool and gathers the results before rendering.
+## Many NumPy/pandas kernels (groupby, sorting, hashing, arithmetic) release the GIL, so metrics overlap on multi-core hosts.
+
+## Worker threads per page. Override with BILLING_WORKERS (all pages) or BILLING_WORKERS_<PAGE> (e.g. BILLING_WORKERS_CHURN_ANALYSIS=1).
+## A value of 1 runs the computations sequentially in the script thread.
+page_workers = {
+    'orders_and_revenue': 4,
+    'subscriptions_report': 4,
+    'churn_analysis': 6,
+}
+
+_pools = {}
+_pools_lock = threading.Lock()
+
+
+def workers_for(page):
+    # Explicit overrides are used as given; the defaults never exceed the number of cores.
+    value = os.environ.get(f'BILLING_WORKERS_{page.upper()}') or os.environ.get('BILLING_WORKERS')
+    if value:
+        return max(1, int(value))
+    return max(1, min(page_workers.get(page, 1), os.cpu_count() or 1))
+
+def _pool(workers):
+    with _pools_lock:
+        if workers not in _pools:
+            _pools[workers] = ThreadPoolExecutor(max_workers=workers, thread_name_prefix='billing-metrics')
+        return _pools[workers]
+
+def _run_with_context(ctx, func, args):
+    # Worker threads inherit the calling script's context so st.cache_data behaves as it does in the script thread.
+    # Pooled threads outlive the script run, so the thread attributes that attaching the context set are put back
+    # afterwards (add_script_run_ctx(thread, None) keeps the attached context instead of detaching it).
+    thread = threading.current_thread()
+    previous = vars(thread).copy()
+    add_script_run_ctx(thread, ctx)
+    attached = [name for name, value in vars(thread).items() if name not in previous or previous[name] is not value]
+    try:
+        return func(*args)
+    finally:
+        for name in attached:
+            if name in previous:
+                setattr(thread, name, previous[name])
+            else:
+                delattr(thread, name)
+
+def run_concurrently(tasks, page=None, max_workers=None):
+    # tasks maps a name to (function, *args); returns a dict of name -> result.
+    workers = max_workers or (workers_for(page) if page else 1)
+    if workers <= 1 or len(tasks) <= 1:
+        return {name: func(*args) for name, (func, *args) in tasks.items()}
+
+    ctx = get_script_run_ctx(suppress_warning=True)
+    pool = _pool(min(workers, len(tasks)))
+    futures = {name: pool.submit(_run_with_context, ctx, func, args) for name, (func, *args) in tasks.items()}
+    return {name: future.result() for name, future in futures.items()}
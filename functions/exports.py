@@ -0,0 +1,87 @@
+import os
+import tempfile
+import streamlit as st
+from functions import backend, customers, periods, sketches
+
+## CSV and Parquet exports of the current filter state.
+## Exports are written chunk by chunk (Arrow record batches of BILLING_EXPORT_CHUNK_ROWS rows) into a temporary file,
+## so a multi-million-row export never holds more than one chunk besides the file itself. The file is only generated
+## when the download button is clicked, on Streamlit's download thread rather than in the page script.
+
+export_chunk_rows = int(os.environ.get('BILLING_EXPORT_CHUNK_ROWS', 100_000))
+
+export_formats = {
+    'CSV': ('csv', 'text/csv'),
+    'Parquet': ('parquet', 'application/vnd.apache.parquet'),
+}
+
+
+def _chunk(frame, start):
+    # Arrow needs string column names (the churn matrix has month offsets as columns); identifier hashes, period keys
+    # and customer codes stay internal
+    chunk = frame.iloc[start:start + export_chunk_rows]
+    internal = [sketches.hash_column(column) for column in sketches.hashed_columns]
+    internal += [periods.key_column(column, granularity) for column in periods.date_columns for granularity in periods.key_granularities]
+    internal += [customers.code_column]
+    chunk = chunk.drop(columns=internal, errors='ignore')
+    return chunk.set_axis([str(column) for column in chunk.columns], axis=1)
+
+def frame_schema(frame):
+    # Arrow schema of a frame, inferred from its first chunk; columns that are empty there are exported as strings.
+    import pyarrow as pa
+
+    schema = pa.Schema.from_pandas(_chunk(frame, 0), preserve_index=False)
+    for i, field in enumerate(schema):
+        if pa.types.is_null(field.type):
+            schema = schema.set(i, field.with_type(pa.string()))
+    return schema
+
+def frame_batches(frame):
+    import pyarrow as pa
+
+    schema = frame_schema(frame)
+
+    def batches():
+        for start in range(0, len(frame), export_chunk_rows):
+            yield pa.RecordBatch.from_pandas(_chunk(frame, start), schema=schema, preserve_index=False)
+
+    return schema, batches()
+
+def relation_batches(relation):
+    # The filtered rows straight from DuckDB, in source order, without materializing them as a frame.
+    reader = relation.record_batches("SELECT * EXCLUDE (file_row_number) FROM filtered ORDER BY file_row_number", export_chunk_rows)
+    return reader.schema, iter(reader)
+
+def data_batches(data):
+    if backend.is_relation(data):
+        return relation_batches(data)
+    return frame_batches(data)
+
+def write_export(schema, batches, file_format, sink):
+    import pyarrow.csv as pa_csv
+    import pyarrow.parquet as pq
+
+    writer = pa_csv.CSVWriter(sink, schema) if file_format == 'csv' else pq.ParquetWriter(sink, schema)
+    with writer:
+        for batch in batches:
+            writer.write_batch(batch)
+
+def export_file(data, file_format):
+    # Anonymous temporary file, removed as soon as the download has read and closed it.
+    sink = tempfile.TemporaryFile()
+    write_export(*data_batches(data), file_format, sink)
+    sink.seek(0)
+    return sink
+
+def download_buttons(data, file_name, key):
+    ## One download button per export format. data is a frame or a functions.backend.Relation.
+    for col, (label, (file_format, mime)) in zip(st.columns(len(export_formats)), export_formats.items()):
+        with col:
+            st.download_button(
+                label=f"Download {label}",
+                data=lambda file_format=file_format: export_file(data, file_format),
+                file_name=f'{file_name}.{file_format}',
+                mime=mime,
+                key=f'{key}_{file_format}',
+                on_click='ignore',
+            )
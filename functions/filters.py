@@ -1,18 +1,25 @@
 import streamlit as st
 from datetime import datetime, timedelta
 from functions.query import query_results
+from functions import backend, customers, metrics, versions
 import pandas as pd
+import numpy as np
 
 def date_filter():
     data = query_results()
-    min_created_at = data['created_at'].min()
-    max_created_at = data['created_at'].max()
+    return data, date_range_input(data['created_at'].min(), data['created_at'].max())
+
+def sql_date_filter():
+    ## The DuckDB backend only reads the date bounds here; the rows stay in the columnar source until they are aggregated.
+    path = backend.data_source()
+    token = backend.source_token(path)
+    return (path, token), date_range_input(*backend.date_bounds(path, token))
+
+def date_range_input(min_created_at, max_created_at):
     default_start_date = max_created_at - timedelta(days=365)
 
     if default_start_date < min_created_at:
         default_start_date = min_created_at
-    if max_created_at > max_created_at:
-        max_created_at = max_created_at
 
     if 'start_date' not in st.session_state:
         st.session_state.start_date = default_start_date
@@ -36,12 +43,25 @@ def date_filter():
     elif start_date > end_date:
         st.warning("The start date cannot be after the end date. Please select a valid date range.")
 
-    return data, (start_date, end_date)
+    return start_date, end_date
+
+def granularity_input(min_date, max_date):
+    ## Page-level time granularity of the chart series. A granularity that would plot more than
+    ## metrics.max_chart_points periods over the date range falls back to the next coarser one.
+    options = list(metrics.granularities)
+    selected = st.radio("Time granularity", options, index=options.index(metrics.default_granularity), horizontal=True, key='granularity')
+    granularity = metrics.effective_granularity(selected, min_date, max_date)
+    if granularity != selected:
+        st.caption(f"The date range is too long to plot by {selected.lower()}, showing one point per {granularity.lower()}.")
+    return granularity
+
+def date_mask(data, start, end):
+    return data.eval("`created_at` >= @start and `created_at` <= @end").to_numpy()
 
 def filter_data(start, end, data_ref):
-    data_date_filtered = data_ref.query("`created_at` >= @start and `created_at` <= @end")
+    data_date_filtered = data_ref[date_mask(data_ref, start, end)]
 
-    return data_date_filtered
+    return versions.derive(data_date_filtered, data_ref, 'dates', start, end)
 
 def create_filter(column_name, filter_type='selectbox', options=None, selected_options=None, min_value=None, max_value=None):
     if filter_type == 'multiselect':
@@ -51,22 +71,6 @@ def create_filter(column_name, filter_type='selectbox', options=None, selected_o
         return st.date_input(column_name, value=selected_options)
     return None
 
-def calculate_tenure_range(tenure_in_months):
-    ranges = [
-        (0, 6, '0-6 months'),
-        (7, 12, '7-12 months'),
-        (13, 24, '1-2 years'),
-        (25, 36, '2-3 years'),
-        (37, 48, '3-4 years'),
-        (49, 60, '4-5 years')
-    ]
-    
-    for start, end, label in ranges:
-        if start <= tenure_in_months <= end:
-            return label
-    
-    return '5+ years'
-
 def apply_filters(data, filter_values, columns):
     for display_name, column_name, filter_type in columns:
         if display_name in filter_values:
@@ -86,70 +90,219 @@ def categorize_revenue_dynamic(revenue, low_threshold, medium_threshold, high_th
     else:
         return 'Very High Revenue'
 
+filter_columns = [
+    ("Subscription Plan", 'subscription_plan', 'multiselect'),
+    ("Customer Segment", 'revenue_segment', 'multiselect'),
+    ("Purchase Location", 'customer_city', 'multiselect'),
+    ("Payment Method", 'payment_method', 'multiselect'),
+    ("Billing Source", 'billing_type', 'multiselect'),
+    ("Customer Tenure", 'customer_tenure_range', 'multiselect'),
+    ("Product Name", 'product_name', 'multiselect'),
+    ("Subscription Status", 'subscription_status', 'multiselect')
+]
+
+def customer_segments(date_filtered_data, current_date):
+    ## Tenure (in 30-day months and as a bucket) and revenue segment of every customer of the customer dimension
+    ## (functions/customers.py), by customer code. The segment is that of the customer's company by its revenue in the date range.
+    dimension = customers.dimension(date_filtered_data)
+    codes = date_filtered_data[customers.code_column].to_numpy()
+    tenure_months, tenure_ranges = customers.tenure(dimension, current_date)
+
+    # Calculate total revenue by company in the date range, over company codes
+    customer_companies = dimension['company_code'].to_numpy()
+    company_codes = np.append(customer_companies, customers.missing_code)[codes]
+    n_companies = int(customer_companies.max()) + 1 if len(dimension) else 0
+    revenue = customers.per_code(company_codes, n_companies, date_filtered_data['total_amount'])
+    revenue_by_company = pd.Series(revenue)[customers.per_code(company_codes, n_companies) > 0]
+
+    # Calculate dynamic thresholds based on percentiles
+    low_threshold = revenue_by_company.quantile(0.25)
+    medium_threshold = revenue_by_company.quantile(0.50)
+    high_threshold = revenue_by_company.quantile(0.75)
+
+    # Categorize revenue dynamically
+    segments = revenue_by_company.apply(categorize_revenue_dynamic, args=(low_threshold, medium_threshold, high_threshold))
+    segments = segments.reindex(pd.RangeIndex(n_companies)).to_numpy()
+
+    return {
+        'customer_tenure_months': tenure_months,
+        'customer_tenure_range': tenure_ranges,
+        'revenue_segment': np.append(segments, np.nan)[customer_companies],
+    }
+
+def add_segments(date_filtered_data, segments, current_date):
+    # Looks the customer values up for every line item; the input is shared, so the columns go on a copy
+    codes = date_filtered_data[customers.code_column].to_numpy()
+    segmented_data = date_filtered_data.copy(deep=False)
+    segmented_data['customer_created_date'] = pd.to_datetime(date_filtered_data['customer_created_at'])
+    for column, missing in [('customer_tenure_months', np.nan), ('customer_tenure_range', None), ('revenue_segment', np.nan)]:
+        segmented_data[column] = np.append(segments[column], missing)[codes]
+    # Tenure buckets move in 30-day steps, so the version key changes daily
+    return versions.derive(segmented_data, date_filtered_data, 'segments', current_date.date())
+
+def segment(date_filtered_data):
+    ## (frame with the segment and tenure columns, option catalog of those columns by customer code)
+    current_date = pd.Timestamp(datetime.now())
+    segments = customer_segments(date_filtered_data, current_date)
+    catalog = {column: encode(segments[column]) for column in customer_filter_columns}
+    return add_segments(date_filtered_data, segments, current_date), catalog
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _shared_segments(version_key, today, _date_filtered_data):
+    return segment(_date_filtered_data)
+
+def segments_of(date_filtered_data):
+    ## The derived segment and tenure columns are computed once per version key of the date-filtered data (and day)
+    ## and the frame is shared by all sessions, so it must not be modified in place.
+    version_key = versions.key_of(date_filtered_data)
+    if version_key is None:
+        return segment(date_filtered_data)
+    return _shared_segments(version_key, datetime.now().date(), date_filtered_data)
+
+def segmented(date_filtered_data):
+    return segments_of(date_filtered_data)[0]
+
+def filter_widgets(options_for):
+    ## Lays out the eight multiselect filters. options_for(column_field, filter_values) returns the options of a filter
+    ## given the selections made in the filters before it, so each option list cascades from the previous ones.
+    col1, col2, col3, col4 = st.columns(4)
+    row1 = [col1, col2, col3, col4]
+    col6, col7, col8, col9 = st.columns(4)
+    row2 = [col6, col7, col8, col9]
+
+    filter_values = {}
+
+    if 'filter_values' not in st.session_state:
+        st.session_state.filter_values = {}
+
+    def update_filter(column_name, filter_type, options):
+        if column_name not in st.session_state.filter_values:
+            st.session_state.filter_values[column_name] = [] if filter_type == 'multiselect' else None
+        selected_options = create_filter(column_name, filter_type, options, selected_options=st.session_state.filter_values[column_name])
+        st.session_state.filter_values[column_name] = selected_options
+        return selected_options
+
+    for i, (column_name, column_field, filter_type) in enumerate(filter_columns):
+        if i < 4:
+            col = row1[i % 4]
+        else:
+            col = row2[(i - 4) % 4]
+        with col:
+            distinct_values = options_for(column_field, filter_values)
+            selected_options = update_filter(column_name, filter_type, distinct_values)
+            filter_values[column_name] = selected_options
+
+    return filter_values
+
+## Option catalog of the filter columns: a column's sorted distinct values as shown in the filter and the code of
+## every row into them (-1 for missing values). The line item columns are dictionary-encoded once per dataset version
+## and shared by all sessions; the segment and tenure columns are customer values of a date range and day, encoded
+## by customer code along with the segments. The catalog of a date range takes the codes of its rows from both, and
+## the cascading option lists are histograms of the codes under the mask of the selections made so far, instead of
+## string conversions of the filtered frame.
+
+customer_filter_columns = ['revenue_segment', 'customer_tenure_range']
+
+def code_dtype(n_values):
+    return np.int8 if n_values < 2 ** 7 else np.int16 if n_values < 2 ** 15 else np.int32
+
+def encode(column):
+    codes, uniques = pd.factorize(column)
+    values, inverse = np.unique(np.asarray(uniques).astype(str), return_inverse=True)
+    # Missing values (code -1) pick the appended -1
+    return values, np.append(inverse, -1)[codes].astype(code_dtype(len(values)))
+
+def build_catalog(data):
+    return {column_field: encode(data[column_field]) for _, column_field, _ in filter_columns if column_field not in customer_filter_columns}
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _dataset_catalog(version, _data):
+    return build_catalog(_data)
+
+def dataset_catalog(data):
+    # Catalog of the line item columns over all rows of a loaded dataset (of the frame's own rows outside the page flow)
+    version = versions.key_of(data)
+    return build_catalog(data) if version is None else _dataset_catalog(version, data)
+
+def with_customer_columns(catalog, customer_catalog, customer_codes):
+    # Adds the customer columns to a catalog, with the codes of the rows' customers
+    catalog = dict(catalog)
+    for column_field, (values, codes) in customer_catalog.items():
+        catalog[column_field] = (values, np.append(codes, codes.dtype.type(-1))[customer_codes])
+    return catalog
+
+def row_catalog(date_filtered_data, customer_catalog):
+    ## Catalog of the rows of a date range, in their order: the dataset's codes at the rows' positions in the loaded
+    ## dataset and the customer codes' entries of the customer columns.
+    dataset = versions.dataset_frame(date_filtered_data)
+    if dataset is None:
+        dataset, rows = date_filtered_data, slice(None)
+    else:
+        rows = dataset.index.get_indexer(date_filtered_data.index)
+    catalog = {column_field: (values, codes[rows]) for column_field, (values, codes) in dataset_catalog(dataset).items()}
+    return with_customer_columns(catalog, customer_catalog, date_filtered_data[customers.code_column].to_numpy())
+
+def option_catalog(date_filtered_data):
+    return row_catalog(date_filtered_data, segments_of(date_filtered_data)[1])
+
+def selections_mask(catalog, selections):
+    # Rows matching every (column, selected values) of selections, or None when nothing is selected
+    mask = None
+    for column_field, selected in selections:
+        values, codes = catalog[column_field]
+        allowed = np.append(np.isin(values, [str(option) for option in selected]), False)
+        mask = allowed[codes] if mask is None else mask & allowed[codes]
+    return mask
+
+def selection_mask(catalog, filter_values):
+    # Rows matching every selection made so far, or None when nothing is selected
+    return selections_mask(catalog, selections_for(filter_values))
+
+def history_mask(dataset, selections, start, end):
+    ## Line items of a whole loaded dataset, outside the date range too, matching the selections made over a date
+    ## range: the segment and tenure columns take the customers' values in that range.
+    catalog = dataset_catalog(dataset)
+    if any(column_field in customer_filter_columns for column_field, _ in selections):
+        customer_catalog = segments_of(filter_data(start, end, dataset))[1]
+        catalog = with_customer_columns(catalog, customer_catalog, dataset[customers.code_column].to_numpy())
+    return selections_mask(catalog, selections)
+
+def catalog_options(catalog, column_field, mask):
+    values, codes = catalog[column_field]
+    if mask is not None:
+        codes = codes[mask]
+    return values[np.bincount(codes[codes >= 0], minlength=len(values)) > 0].tolist()
+
 def setting_filters(data):
     with st.container():
-        date_filtered_data = data
-        col1, col2, col3, col4 = st.columns(4)
-        row1 = [col1, col2, col3, col4]
-        col6, col7, col8, col9 = st.columns(4)
-        row2 = [col6, col7, col8, col9]
-
-        filter_values = {}
-
-        current_date = pd.Timestamp(datetime.now())
-        date_filtered_data['customer_created_date'] = pd.to_datetime(date_filtered_data['customer_created_at'])
-        date_filtered_data['customer_tenure_months'] = ((current_date - date_filtered_data['customer_created_date']) / pd.Timedelta(days=30)).astype(int)
-        date_filtered_data['customer_tenure_range'] = date_filtered_data['customer_tenure_months'].apply(calculate_tenure_range)
-
-        # Calculate total lifetime revenue by company
-        revenue_by_company = date_filtered_data.groupby('customer_company')['total_amount'].sum().reset_index()
-
-        # Calculate dynamic thresholds based on percentiles
-        low_threshold = revenue_by_company['total_amount'].quantile(0.25)
-        medium_threshold = revenue_by_company['total_amount'].quantile(0.50)
-        high_threshold = revenue_by_company['total_amount'].quantile(0.75)
-
-        # Categorize revenue dynamically
-        revenue_by_company['revenue_segment'] = revenue_by_company['total_amount'].apply(categorize_revenue_dynamic, args=(low_threshold, medium_threshold, high_threshold))
-
-        # Merge the segment data back into the main dataset
-        date_filtered_data = pd.merge(date_filtered_data, revenue_by_company[['customer_company', 'revenue_segment']], on='customer_company', how='left')
-
-        def get_distinct_values(data, column_name):
-            return sorted(set(data[column_name].dropna().astype(str)))
-
-        if 'filter_values' not in st.session_state:
-            st.session_state.filter_values = {}
-
-        def update_filter(column_name, filter_type, options):
-            if column_name not in st.session_state.filter_values:
-                st.session_state.filter_values[column_name] = [] if filter_type == 'multiselect' else None
-            selected_options = create_filter(column_name, filter_type, options, selected_options=st.session_state.filter_values[column_name])
-            st.session_state.filter_values[column_name] = selected_options
-            return selected_options
-
-        columns = [
-            ("Subscription Plan", 'subscription_plan', 'multiselect'),
-            ("Customer Segment", 'revenue_segment', 'multiselect'),
-            ("Purchase Location", 'customer_city', 'multiselect'),
-            ("Payment Method", 'payment_method', 'multiselect'),
-            ("Billing Source", 'billing_type', 'multiselect'),
-            ("Customer Tenure", 'customer_tenure_range', 'multiselect'),
-            ("Product Name", 'product_name', 'multiselect'),
-            ("Subscription Status", 'subscription_status', 'multiselect')
-        ]
-
-        for i, (column_name, column_field, filter_type) in enumerate(columns):
-            if i < 4:
-                col = row1[i % 4]
-            else:
-                col = row2[(i - 4) % 4]
-            with col:
-                distinct_values = get_distinct_values(date_filtered_data, column_field)
-                selected_options = update_filter(column_name, filter_type, distinct_values)
-                filter_values[column_name] = selected_options
-                date_filtered_data = apply_filters(date_filtered_data, filter_values, columns)
-
-        filtered_data = date_filtered_data
-
-    return filtered_data
\ No newline at end of file
+        date_filtered_data = segmented(data)
+        catalog = option_catalog(data)
+
+        def options_for(column_field, filter_values):
+            return catalog_options(catalog, column_field, selection_mask(catalog, filter_values))
+
+        filter_values = filter_widgets(options_for)
+        mask = selection_mask(catalog, filter_values)
+        if mask is None:
+            filtered_data = date_filtered_data
+        else:
+            filtered_data = versions.derive(date_filtered_data[mask], date_filtered_data, 'filters', selections_for(filter_values))
+
+    return filtered_data
+
+def selections_for(filter_values):
+    return tuple(
+        (column_field, tuple(filter_values[column_name]))
+        for column_name, column_field, _ in filter_columns
+        if filter_values.get(column_name)
+    )
+
+def sql_setting_filters(source, start, end):
+    path, token = source
+    with st.container():
+        def options_for(column_field, filter_values):
+            return backend.filter_options(path, token, start, end, selections_for(filter_values), column_field)
+
+        filter_values = filter_widgets(options_for)
+
+    return backend.filtered(path, token, start, end, selections_for(filter_values))
@@ -0,0 +1,51 @@
+import numpy as np
+import pandas as pd
+
+## Interval index over half-open [start, end) periods for point-in-time "how many were active at T?" questions.
+## Periods are coalesced per key first, so a key is counted once however many overlapping periods it has. The index
+## is a pair of independently sorted start and end arrays: the number of keys active at t is the number of starts
+## at or before t minus the number of ends at or before t, two binary searches per date.
+##
+## The periods are sorted once into a table (period_table); an index of any subset of the input rows is coalesced
+## from the table with a row mask, without sorting the periods again.
+
+
+def period_table(keys, starts, ends):
+    # The valid periods (ending after they start) sorted by key and start: the input position of each period, and its
+    # key code, start and end (as datetime64[ns] integers)
+    codes = pd.factorize(pd.Series(keys), sort=True)[0]
+    starts = pd.DatetimeIndex(starts).as_unit('ns')
+    ends = pd.DatetimeIndex(ends).as_unit('ns')
+    rows = np.flatnonzero((codes >= 0) & starts.notna() & ends.notna() & (ends > starts))
+    rows = rows[np.lexsort((starts.asi8[rows], codes[rows]))]
+    return {'rows': rows, 'keys': codes[rows], 'starts': starts.asi8[rows], 'ends': ends.asi8[rows]}
+
+def coalesce_table(table, mask=None):
+    # Merges overlapping or touching periods of the same key, over the periods of the rows in mask (all without one).
+    # Returns the merged starts and ends as datetime64[ns] integers.
+    keep = slice(None) if mask is None else mask[table['rows']]
+    keys, starts, ends = table['keys'][keep], table['starts'][keep], table['ends'][keep]
+    running_end = pd.Series(ends).groupby(keys).cummax().to_numpy()
+    first = np.ones(len(keys), dtype=bool)
+    first[1:] = (keys[1:] != keys[:-1]) | (starts[1:] > running_end[:-1])
+    blocks = np.flatnonzero(first)
+    return starts[blocks], np.maximum.reduceat(ends, blocks) if len(blocks) else ends[blocks]
+
+def coalesce(keys, starts, ends):
+    # Merges overlapping or touching periods of the same key. Returns the merged starts and ends as datetime64 arrays.
+    starts, ends = coalesce_table(period_table(keys, starts, ends))
+    return starts.astype('datetime64[ns]'), ends.astype('datetime64[ns]')
+
+def table_index(table, mask=None):
+    starts, ends = coalesce_table(table, mask)
+    return {'starts': np.sort(starts), 'ends': np.sort(ends)}
+
+def build_index(keys, starts, ends):
+    return table_index(period_table(keys, starts, ends))
+
+def active_counts(index, dates):
+    # Number of keys whose period contains each date; O(k log n) for k dates over n periods.
+    points = pd.DatetimeIndex(dates).as_unit('ns').asi8
+    started = np.searchsorted(index['starts'], points, side='right')
+    ended = np.searchsorted(index['ends'], points, side='right')
+    return started - ended
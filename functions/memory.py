@@ -0,0 +1,241 @@
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import numpy as np
+import pandas as pd
+from functions import customers, shared_dataset, versions
+
+## Memory accounting of the server process: what the loaded datasets, the frames derived from them, every
+## st.cache_data / st.cache_resource entry and the session state of each connected session take, with the largest
+## consumers first. Shown on the Diagnostics page (only with BILLING_DIAGNOSTICS=1, as it lists every session of the
+## server) and, every BILLING_MEMORY_LOG_SECONDS (0, the default, turns it off), written as one JSON log line (logger
+## functions.memory) so cache sizes can be tuned and regressions spotted.
+##
+## Frames are measured like DataFrame.memory_usage(deep=True), except that object (string) columns longer than
+## memory_sample_rows are estimated from a fixed sample of their rows; deep sizing of a million-row frame takes
+## seconds. The size of a frame with a version key is computed once. Frames share buffers (a date-filtered frame with
+## its segmented copy, the Arrow store with every process on the host), so the categories are not additive; the
+## process RSS is the ground truth.
+
+memory_sample_rows = 10_000
+top_consumers = int(os.environ.get('BILLING_MEMORY_TOP', 20))
+log_seconds = float(os.environ.get('BILLING_MEMORY_LOG_SECONDS', 0))
+
+_frame_sizes = {}
+_sizes_lock = threading.Lock()
+_log_thread = None
+_log_lock = threading.Lock()
+
+logger = logging.getLogger(__name__)
+
+
+def diagnostics_enabled():
+    return os.environ.get('BILLING_DIAGNOSTICS', '0') == '1'
+
+def column_bytes(column):
+    if column.dtype != object or len(column) <= memory_sample_rows:
+        return int(column.memory_usage(index=False, deep=True))
+    sample = column.sample(n=memory_sample_rows, random_state=0)
+    return int(sample.memory_usage(index=False, deep=True) * len(column) / memory_sample_rows)
+
+def measure_frame(frame):
+    if isinstance(frame, pd.Series):
+        return column_bytes(frame) + int(frame.index.memory_usage(deep=True))
+    return sum(column_bytes(frame.iloc[:, i]) for i in range(frame.shape[1])) + int(frame.index.memory_usage(deep=True))
+
+def frame_bytes(frame):
+    # Frames with a version key are immutable, so their size is remembered under the key
+    key = versions.key_of(frame)
+    if key is None:
+        return measure_frame(frame)
+    with _sizes_lock:
+        size = _frame_sizes.get(key)
+    if size is None:
+        size = measure_frame(frame)
+        with _sizes_lock:
+            _frame_sizes[key] = size
+    return size
+
+def object_bytes(value, depth=0):
+    ## Approximate deep size of a cached value or session state entry.
+    if isinstance(value, (pd.DataFrame, pd.Series)):
+        return frame_bytes(value)
+    if isinstance(value, pd.Index):
+        return int(value.memory_usage(deep=True))
+    if isinstance(value, np.ndarray):
+        return value.nbytes
+    if depth < 4 and isinstance(value, dict):
+        return sys.getsizeof(value) + sum(object_bytes(k, depth + 1) + object_bytes(v, depth + 1) for k, v in value.items())
+    if depth < 4 and isinstance(value, (list, tuple, set, frozenset)):
+        return sys.getsizeof(value) + sum(object_bytes(item, depth + 1) for item in value)
+    if hasattr(value, 'nbytes') and isinstance(value.nbytes, int):
+        # Arrow tables and arrays
+        return value.nbytes
+    return sys.getsizeof(value)
+
+def process_rss():
+    # Resident set size of this process (peak RSS where /proc is not available)
+    try:
+        with open('/proc/self/status') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except OSError:
+        pass
+    import resource
+
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * (1 if sys.platform == 'darwin' else 1024)
+
+def dataset_usage():
+    from functions.query import loaded_datasets
+
+    return [
+        {'path': path, 'version': version[:12], 'rows': len(data), 'columns': data.shape[1], 'bytes': frame_bytes(data)}
+        for path, version, data in loaded_datasets()
+    ]
+
+def frame_usage():
+    # Live frames derived from the datasets (date range, segments, filters, prepared, customer dimension), grouped by
+    # the step that produced them; they are held by running scripts, session state and the caches
+    live_frames = versions.live_frames()
+    frames = [(key, step, frame) for key, step, frame in live_frames if step != 'dataset']
+    frames += [(version, 'customer dimension', dimension) for version, dimension in customers.registered()]
+    live = {key for key, _, _ in live_frames}
+    with _sizes_lock:
+        for key in [key for key in _frame_sizes if key not in live]:
+            del _frame_sizes[key]
+
+    steps = {}
+    for key, step, frame in frames:
+        entry = steps.setdefault(step, {'step': step, 'frames': 0, 'rows': 0, 'bytes': 0, 'largest_bytes': 0})
+        size = frame_bytes(frame)
+        entry['frames'] += 1
+        entry['rows'] += len(frame)
+        entry['bytes'] += size
+        entry['largest_bytes'] = max(entry['largest_bytes'], size)
+    return sorted(steps.values(), key=lambda entry: -entry['bytes'])
+
+def cache_usage():
+    ## Entries and bytes of every st.cache_data and st.cache_resource function. cache_data keeps its entries pickled,
+    ## so their size is exact; cache_resource entries are live objects measured with object_bytes. Streamlit has no
+    ## public API for this, so the caches are read from its internals; None (shown as unavailable) when a Streamlit
+    ## version has changed them.
+    try:
+        from streamlit.runtime.caching import cache_data_api, cache_resource_api
+
+        caches = []
+        for function_caches in list(cache_data_api._data_caches._function_caches.values()):
+            for cache in list(function_caches.values()):
+                sizes = [stat.byte_length for stats in cache.get_stats().values() for stat in stats]
+                caches.append({'kind': 'cache_data', 'name': cache.display_name, 'entries': len(sizes), 'bytes': sum(sizes),
+                               'largest_bytes': max(sizes, default=0)})
+        for function_caches in list(cache_resource_api._resource_caches._function_caches.values()):
+            for cache in list(function_caches.values()):
+                with cache._mem_cache_lock:
+                    values = [result.value for result in cache._mem_cache.values()]
+                sizes = [object_bytes(value) for value in values]
+                caches.append({'kind': 'cache_resource', 'name': cache.display_name, 'entries': len(sizes), 'bytes': sum(sizes),
+                               'largest_bytes': max(sizes, default=0)})
+    except Exception:
+        logger.warning("Cache sizes are unavailable with streamlit %s", _streamlit_version(), exc_info=True)
+        return None
+    return sorted(caches, key=lambda cache: -cache['bytes'])
+
+def session_usage():
+    ## Bytes of the st.session_state values of every connected session (date range, filter selections, granularity,
+    ## widget values), by key. Empty outside a running server; None (shown as unavailable) when the Streamlit
+    ## internals it reads have changed, like cache_usage.
+    try:
+        from streamlit.runtime import Runtime
+
+        session_mgr = getattr(Runtime.instance(), '_session_mgr', None) if Runtime.exists() else None
+        if session_mgr is None:
+            # Not served (e.g. AppTest or a bare script)
+            return []
+        active = session_mgr.list_active_sessions()
+    except Exception:
+        logger.warning("Session sizes are unavailable with streamlit %s", _streamlit_version(), exc_info=True)
+        return None
+    sessions = []
+    for info in active:
+        try:
+            state = info.session.session_state.filtered_state
+            session, script_runs = info.session.id[:8], info.script_run_count
+        except Exception:
+            # The session's script is changing its state right now; it is measured on the next report
+            continue
+        keys = {str(key): object_bytes(value) for key, value in state.items()}
+        sessions.append({'session': session, 'keys': keys, 'bytes': sum(keys.values()), 'script_runs': script_runs})
+    return sorted(sessions, key=lambda session: -session['bytes'])
+
+def _streamlit_version():
+    import streamlit
+
+    return getattr(streamlit, '__version__', 'unknown')
+
+def top(datasets, frames, caches, sessions, count):
+    # Unavailable caches or sessions (None) are left out
+    caches, sessions = caches or [], sessions or []
+    consumers = [{'kind': 'dataset', 'name': dataset['path'], 'bytes': dataset['bytes']} for dataset in datasets]
+    consumers += [{'kind': 'frames', 'name': frame['step'], 'bytes': frame['bytes']} for frame in frames]
+    consumers += [{'kind': cache['kind'], 'name': cache['name'], 'bytes': cache['bytes']} for cache in caches]
+    consumers += [
+        {'kind': 'session_state', 'name': f"{session['session']}.{key}", 'bytes': size}
+        for session in sessions for key, size in session['keys'].items()
+    ]
+    return sorted(consumers, key=lambda consumer: -consumer['bytes'])[:count]
+
+def memory_report(count=None):
+    ## The memory accounting of this process as a JSON-serializable dict.
+    started = time.perf_counter()
+    datasets, frames, caches, sessions = dataset_usage(), frame_usage(), cache_usage(), session_usage()
+    return {
+        'event': 'memory_report',
+        'pid': os.getpid(),
+        'rss_bytes': process_rss(),
+        'dataset_store': shared_dataset.dataset_store(),
+        'datasets': datasets,
+        'frames': frames,
+        'caches': caches,
+        'sessions': None if sessions is None else {'count': len(sessions), 'bytes': sum(session['bytes'] for session in sessions), 'sessions': sessions},
+        'top': top(datasets, frames, caches, sessions, count or top_consumers),
+        'seconds': round(time.perf_counter() - started, 3),
+    }
+
+def log_report(report):
+    # One line per report; per-session key sizes are left to the top consumers
+    sessions = report['sessions'] and {key: value for key, value in report['sessions'].items() if key != 'sessions'}
+    logger.info(json.dumps(dict(report, sessions=sessions)))
+
+def _log_periodically():
+    while True:
+        time.sleep(log_seconds)
+        try:
+            log_report(memory_report())
+        except Exception:
+            logger.exception("Memory report failed")
+
+def schedule_logging():
+    ## Starts the periodic memory log once per process when BILLING_MEMORY_LOG_SECONDS is set.
+    global _log_thread
+    if log_seconds <= 0 or _log_thread is not None:
+        return
+    with _log_lock:
+        if _log_thread is None:
+            if not logger.hasHandlers():
+                logger.addHandler(logging.StreamHandler())
+            logger.setLevel(logging.INFO)
+            _log_thread = threading.Thread(target=_log_periodically, name='billing-memory-log', daemon=True)
+            _log_thread.start()
+
+def format_bytes(size):
+    if size is None:
+        return 'unavailable'
+    for unit in ['B', 'KiB', 'MiB']:
+        if abs(size) < 1024:
+            return f'{size:,.0f} {unit}' if unit == 'B' else f'{size:,.1f} {unit}'
+        size /= 1024
+    return f'{size:,.2f} GiB'
@@ -0,0 +1,914 @@
+import os
+import functools
+import hashlib
+import inspect
+import threading
+import weakref
+import streamlit as st
+import pandas as pd
+import numpy as np
+from functions import sharding
+from functions import backend
+from functions import intervals
+from functions import sketches
+from functions import disk_cache
+from functions import periods
+from functions import customers
+from functions import versions
+
+## Pure KPI and chart computations used by the report pages.
+## Every public metric takes the filtered (and prepared) line item frame and returns a dict of KPIs or a small result frame.
+## Results are memoized on the content of the input frame, so identical inputs are never recomputed across reruns or sessions.
+## Frames passed to the metrics are treated as immutable: build new frames rather than mutating them in place.
+## With the DuckDB backend the input is a functions.backend.Relation instead of a frame; metrics with a SQL version in
+## functions/sql_metrics.py run there, the others get the rows materialized as a frame.
+
+date_columns = ['created_at', 'customer_created_at', 'payment_at', 'subscription_period_started_at', 'subscription_period_ended_at']
+subscription_billing_types = ['subscription', 'recurring']
+one_time_billing_types = ['one-time', 'invoiceitem']
+
+## Time granularities of the chart series, finest first, with their pandas period frequency. A chart plots at most
+## BILLING_MAX_CHART_POINTS periods; longer ranges fall back to the next coarser granularity.
+granularities = {'Day': 'D', 'Week': 'W', 'Month': 'M', 'Quarter': 'Q'}
+default_granularity = 'Month'
+max_chart_points = int(os.environ.get('BILLING_MAX_CHART_POINTS', 100))
+
+## In-memory entries kept per memoized metric (BILLING_MEMO_ENTRIES); the results are small aggregates, the large
+## intermediates (MRR ledger, option catalog, segments) are kept once per version in st.cache_resource.
+memo_entries = int(os.environ.get('BILLING_MEMO_ENTRIES', 32))
+
+## Like st.cache_data, frames above this size are fingerprinted from a fixed sample of their rows.
+fingerprint_sample_rows = 100_000
+
+_fingerprints = {}
+_fingerprints_lock = threading.Lock()
+
+
+def fingerprint(frame):
+    # Cache key of a frame: its version key when it was derived from a loaded dataset (functions.versions), otherwise a
+    # content hash. The hash is remembered per frame object, so a page pays for hashing once per rerun no matter how
+    # many metrics it computes.
+    if backend.is_relation(frame):
+        return frame.fingerprint
+    version_key = versions.key_of(frame)
+    if version_key is not None:
+        return version_key
+
+    key = id(frame)
+    with _fingerprints_lock:
+        entry = _fingerprints.get(key)
+        if entry is not None and entry[0]() is frame:
+            return entry[1]
+
+        hasher = hashlib.sha1()
+        hasher.update(repr((frame.shape, list(zip(frame.columns, frame.dtypes.astype(str))))).encode())
+        sample = frame.sample(n=fingerprint_sample_rows, random_state=0) if len(frame) > fingerprint_sample_rows else frame
+        hasher.update(pd.util.hash_pandas_object(sample, index=True).to_numpy().tobytes())
+        digest = hasher.hexdigest()
+        _fingerprints[key] = (weakref.ref(frame, lambda _, key=key: _fingerprints.pop(key, None)), digest)
+        return digest
+
+def memoized(func):
+    # Wraps a metric in st.cache_data keyed on (metric source, input fingerprint, distinct count settings, remaining
+    # arguments), backed by functions.disk_cache under the same key. The frame itself is passed as an unhashed
+    # argument; only its fingerprint takes part in the key.
+    source_hash = hashlib.sha1(inspect.getsource(func).encode()).hexdigest()
+
+    def compute(_frame, *args, **kwargs):
+        if backend.is_relation(_frame):
+            from functions import sql_metrics
+
+            sql_version = sql_metrics.sql_versions.get(func.__name__)
+            if sql_version is not None:
+                return sql_version(_frame, *args, **kwargs)
+            _frame = prepare(_frame.to_pandas())
+        return func(_frame, *args, **kwargs)
+
+    def cached(source_hash, frame_fingerprint, distinct_counts, _frame, *args, **kwargs):
+        # Misses of the in-memory cache try the persistent tier before computing
+        key = (func.__module__, func.__qualname__, source_hash, frame_fingerprint, distinct_counts, args, sorted(kwargs.items()))
+        return disk_cache.cached(key, lambda: compute(_frame, *args, **kwargs))
+
+    cached.__module__ = func.__module__
+    cached.__qualname__ = func.__qualname__
+    cached = st.cache_data(show_spinner=False, max_entries=memo_entries)(cached)
+
+    @functools.wraps(func)
+    def wrapper(frame, *args, **kwargs):
+        return cached(source_hash, fingerprint(frame), sketches.settings(), frame, *args, **kwargs)
+
+    wrapper.uncached = func
+    return wrapper
+
+def prepare(data):
+    if backend.is_relation(data):
+        return data
+
+    ## Ensure all date columns are in datetime format
+    converted = {col: pd.to_datetime(data[col], errors='coerce') for col in date_columns if col in data.columns and not pd.api.types.is_datetime64_any_dtype(data[col])}
+    # Month and quarter keys and customer codes of frames not loaded by functions.query (e.g. rows of the DuckDB backend)
+    keys = {**periods.key_values(data), **customers.code_values(data)}
+    # A shallow copy shares the other columns with the input instead of copying the whole frame
+    prepared = data.copy(deep=False)
+    for column, values in {**converted, **keys}.items():
+        prepared[column] = values
+    return versions.derive(prepared, data, 'prepared')
+
+def percentage_change(current, previous):
+    return ((current - previous) / previous * 100) if previous != 0 else float('inf')
+
+def percentage_change_or_new(current, previous):
+    if previous == 0:
+        return "New" if current > 0 else 0
+    return ((current - previous) / previous) * 100
+
+def period_start(dates, granularity):
+    # Start of the day, week (from Monday), month or quarter of each date. The period is computed once per distinct
+    # day and mapped back onto the rows; missing dates stay missing.
+    codes, days = pd.factorize(dates.dt.normalize())
+    starts = pd.DatetimeIndex(days).to_period(granularities[granularity]).start_time
+    return pd.Series(np.append(starts.to_numpy(), np.datetime64('NaT'))[codes], index=dates.index, name=dates.name)
+
+def period_keys(data, column, granularity):
+    # Group keys of the period of each row's date: the stored integer keys for months and quarters
+    # (functions/periods.py), the period start for days and weeks
+    if granularity in periods.key_granularities:
+        return data[periods.key_column(column, granularity)]
+    return period_start(data[column], granularity)
+
+def period_starts(keys, granularity):
+    # Start timestamps of period_keys values, e.g. of the few periods of a chart series
+    if granularity in periods.key_granularities:
+        return periods.timestamps(keys)
+    return keys
+
+def effective_granularity(granularity, start, end):
+    # The given granularity, or the first coarser one with no more than max_chart_points periods from start to end
+    names = list(granularities)
+    for name in names[names.index(granularity):]:
+        if pd.isna(start) or pd.isna(end) or len(pd.period_range(start, end, freq=granularities[name])) <= max_chart_points:
+            return name
+    return names[-1]
+
+## Distinct counts in approximate mode (functions/sketches.py) are unions of sketches stored once per loaded dataset
+## version: one per order month and value of the dimension columns (the column of a filter selection and the columns a
+## chart groups by), over the line items of a subset (sketch_subsets). The months a date range covers completely are
+## read from the stored sketches and only the rows of the one or two months at its ends are sketched. Selections on
+## several filter columns or on the customer segment and tenure, samples and periods finer than a month are counted
+## exactly.
+sketch_subsets = {
+    'line_items': lambda data: np.ones(len(data), dtype=bool),
+    'subscribed': lambda data: data['subscription_id'].notna().to_numpy(),
+    'inactive': lambda data: (data['subscription_id'].notna() & (data['subscription_status'] == 'inactive')).to_numpy(),
+}
+sketch_periods = ['Month', 'Quarter', 'Year']
+
+def month_periods(months, period):
+    # Key of the month, quarter (functions/periods.py) or calendar year of every month key
+    if period == 'Year':
+        return periods.years(months)
+    return periods.quarter_keys(months) if period == 'Quarter' else np.asarray(months)
+
+def complete_months(start, end):
+    # (first, last) month key of the months the order dates from start to end cover completely
+    keys = periods.month_keys(pd.Series([pd.Timestamp(start) - pd.Timedelta(1), pd.Timestamp(end) + pd.Timedelta(1)]))
+    return keys[0] + 1, keys[1] - 1
+
+@st.cache_resource(show_spinner=False, max_entries=16)
+def _dataset_sketches(version, column, subset, dimensions, _dataset):
+    # (cells, sparse sketches of the cells) of a column over the line items of a subset of a whole loaded dataset,
+    # with a cell per order month and option catalog code (functions/filters.py) of every dimension column
+    from functions import filters
+
+    catalog = filters.dataset_catalog(_dataset)
+    keys = {'month': _dataset[created_month].to_numpy(), **{dimension: catalog[dimension][1] for dimension in dimensions}}
+    keep = sketch_subsets[subset](_dataset) & (keys['month'] != periods.missing_key)
+    for dimension in dimensions:
+        keep &= keys[dimension] >= 0
+    grouped = pd.DataFrame({name: values[keep] for name, values in keys.items()}).groupby(list(keys))
+    cells = np.full(len(_dataset), -1, dtype=np.int64)
+    cells[keep] = grouped.ngroup().to_numpy()
+    return grouped.size().index.to_frame(index=False), sketches.sparse_sketch(sketches.column_hashes(_dataset, column), cells)
+
+def stored_sketches(rows, column, source, subset, period, columns):
+    ## (group index, sketch of every group) of a column over rows, the line items of a subset of the page input source,
+    ## grouped by columns and the period of the order date. None when the stored sketches can not answer.
+    from functions import filters
+
+    dataset = versions.dataset_frame(source)
+    steps = {step[0]: step[1:] for step in versions.lineage(source)}
+    selections = steps['filters'][0] if 'filters' in steps else ()
+    if (period not in sketch_periods or dataset is None or not set(steps) <= {'dates', 'segments', 'filters', 'prepared'}
+            or len(selections) > 1 or any(column_field in filters.customer_filter_columns for column_field, _ in selections)):
+        return None
+
+    dimensions = tuple(dict.fromkeys([column_field for column_field, _ in selections] + list(columns)))
+    cells, sparse = _dataset_sketches(versions.key_of(dataset), column, subset, dimensions, dataset)
+    catalog = filters.dataset_catalog(dataset)
+    first, last = complete_months(*steps['dates']) if 'dates' in steps else (np.iinfo(np.int32).min, np.iinfo(np.int32).max)
+    months = cells['month'].to_numpy()
+    stored = (months >= first) & (months <= last)
+    for column_field, selected in selections:
+        values = catalog[column_field][0]
+        stored &= np.isin(values, [str(option) for option in selected])[cells[column_field].to_numpy()]
+
+    # Groups of the stored cells and of the rows of the months at the ends of the date range
+    row_months = rows[created_month].to_numpy()
+    edges = rows[(row_months < first) | (row_months > last)]
+    keys = pd.concat([
+        pd.DataFrame({**{name: catalog[name][0][cells[name].to_numpy()[stored]] for name in columns}, 'period': month_periods(months[stored], period)}),
+        pd.DataFrame({**{name: edges[name].astype(str).where(edges[name].notna()).to_numpy() for name in columns}, 'period': month_periods(edges[created_month].to_numpy(), period)}),
+    ], ignore_index=True)
+    grouped = keys.groupby(list(keys.columns))
+    groups = grouped.ngroup().fillna(-1).to_numpy(dtype=np.int64)
+    cell_groups = np.full(len(cells), -1, dtype=np.int64)
+    cell_groups[stored] = groups[:stored.sum()]
+    merged = sketches.densify(sparse, cell_groups, grouped.ngroups)
+    edge_sketches = sketches.sketch(sketches.column_hashes(edges, column), groups[stored.sum():], grouped.ngroups)
+    return grouped.size().index, np.maximum(merged, edge_sketches)
+
+def distinct_counts(data, column, keys, stored=None):
+    ## Number of distinct values of a column per group of keys: exact (nunique) or, in approximate mode on large
+    ## inputs, estimated from the stored sketches. stored = (page input, subset, period, columns) says what data and
+    ## keys are: the line items of a subset (sketch_subsets) of the page input, grouped by columns and the period of
+    ## the order date. Groupings without it and inputs the stored sketches can not answer are counted exactly.
+    merged = stored_sketches(data, column, *stored) if stored is not None and sketches.approximate(stored[0]) else None
+    if merged is None:
+        return data.groupby(keys)[column].nunique()
+    index, by_group = merged
+    names = [key if isinstance(key, str) else key.name for key in (keys if isinstance(keys, list) else [keys])]
+    return pd.Series(sketches.estimate(by_group), index=index.set_names(names), name=column)
+
+def yearly_distinct_counts(data, column, years, year):
+    # Distinct values of a column in total, in the given year and in the year before. With sketches the total is the
+    # union of the per-year sketches (the filtered line items all have an order date).
+    merged = stored_sketches(data, column, data, 'line_items', 'Year', ()) if sketches.approximate(data) else None
+    if merged is None:
+        return data[column].nunique(), data[years == year][column].nunique(), data[years == year - 1][column].nunique()
+    index, by_year = merged
+    count = lambda selected: sketches.estimate(sketches.merge(by_year[selected]))
+    return count(np.ones(len(index), dtype=bool)), count(index == year), count(index == year - 1)
+
+@memoized
+def date_range(data):
+    return data['created_at'].min(), data['created_at'].max()
+
+def reporting_months(data):
+    # (first, last) month of the orders as month keys (functions/periods.py), or None without orders
+    min_created_at, max_created_at = date_range(data)
+    if pd.isna(max_created_at):
+        return None
+    return min_created_at.year * 12 + min_created_at.month, max_created_at.year * 12 + max_created_at.month
+
+
+## Orders and revenue
+
+@memoized
+def order_kpis(data):
+    current_year = data['created_at'].dt.year.max()
+    previous_year = current_year - 1
+    min_created_at = data['created_at'].min()
+    max_created_at = data['created_at'].max()
+
+    created_year = data['created_at'].dt.year
+    current = data[created_year == current_year]
+    previous = data[created_year == previous_year]
+    orders, current_orders, previous_orders = yearly_distinct_counts(data, 'header_id', created_year, current_year)
+    number_of_customers, current_customers, previous_customers = yearly_distinct_counts(data, 'customer_id', created_year, current_year)
+
+    # Line items of customers created in the order range and in either year, from the customers' created dates
+    dimension = customers.dimension(data)
+    rows = customers.per_code(data[customers.code_column].to_numpy(), len(dimension))
+    customer_created_at = dimension['customer_created_at']
+    customer_created_year = customer_created_at.dt.year
+
+    return {
+        'current_year': current_year,
+        'min_created_at': min_created_at,
+        'max_created_at': max_created_at,
+        'total_revenue': data['total_amount'].sum(),
+        'number_of_orders': orders,
+        'number_of_customers': number_of_customers,
+        'new_customers': int(rows[((customer_created_at >= min_created_at) & (customer_created_at <= max_created_at)).to_numpy()].sum()),
+        'total_revenue_yoy': percentage_change(current['total_amount'].sum(), previous['total_amount'].sum()),
+        'number_of_orders_yoy': percentage_change(current_orders, previous_orders),
+        'number_of_customers_yoy': percentage_change(current_customers, previous_customers),
+        'new_customers_yoy': percentage_change(
+            int(rows[(customer_created_year == current_year).to_numpy()].sum()),
+            int(rows[(customer_created_year == previous_year).to_numpy()].sum())
+        ),
+    }
+
+@memoized
+def revenue_and_orders_over_time(data, granularity=default_granularity):
+    month = period_keys(data, 'created_at', granularity)
+    revenue_over_time = data.groupby(month)['total_amount'].sum().rename_axis('month').reset_index()
+    orders_over_time = distinct_counts(data, 'header_id', month, (data, 'line_items', granularity, ())).rename_axis('month').reset_index()
+    over_time = revenue_over_time.merge(orders_over_time, on='month')
+    return over_time.assign(month=period_starts(over_time['month'], granularity))
+
+@memoized
+def revenue_by_product(data):
+    product_revenue = data.groupby('product_name')['total_amount'].sum().reset_index()
+    return product_revenue.sort_values(by='total_amount', ascending=False)
+
+@memoized
+def new_customers_over_time(data, granularity=default_granularity):
+    min_created_at = data['created_at'].min()
+    max_created_at = data['created_at'].max()
+    new_customers = data[(data['customer_created_at'] >= min_created_at) & (data['customer_created_at'] <= max_created_at)]
+    customer_created_month = period_keys(new_customers, 'customer_created_at', granularity).rename('customer_created_month')
+    new_customers = distinct_counts(new_customers, 'customer_id', customer_created_month).reset_index()
+    return new_customers.assign(customer_created_month=period_starts(new_customers['customer_created_month'], granularity))
+
+@memoized
+def revenue_by_country(data):
+    location_performance = data.groupby('customer_country')['total_amount'].sum().reset_index()
+    return location_performance.sort_values(by='total_amount', ascending=False)
+
+# customer_id partitions the shards (functions/sharding.py)
+customer_fact_columns = ['customer_id', customers.code_column, 'total_amount', 'header_id', 'refund_amount', 'discount_amount', 'created_at']
+
+def customer_facts(data):
+    # Facts of the customers with line items in data, by customer code in order of their first line item
+    codes = data[customers.code_column].to_numpy()
+    present = pd.unique(codes[codes != customers.missing_code])
+    size = int(present.max()) + 1 if len(present) else 0
+    by_customer = data.groupby(codes)
+    return pd.DataFrame({
+        'total_amount': customers.per_code(codes, size, data['total_amount'])[present],
+        'total_orders': by_customer['header_id'].nunique().reindex(present).to_numpy(),
+        'refund_amount': customers.per_code(codes, size, data['refund_amount'])[present],
+        'discount_amount': customers.per_code(codes, size, data['discount_amount'])[present],
+        'created_at': by_customer['created_at'].max().reindex(present).to_numpy(),
+    }, index=pd.Index(present, name=customers.code_column))
+
+@memoized
+def customer_table(data):
+    ## The customers' attributes and created date come from the customer dimension; spend, orders and last order
+    ## are those of the input.
+    codes = data[customers.code_column].to_numpy()
+    # Sharded facts come back shard by shard; the table lists customers in order of their first line item
+    facts = sharding.by_customer(customer_facts, data, customer_fact_columns).reindex(pd.unique(codes[codes != customers.missing_code]))
+    attributes = customers.dimension(data).reindex(facts.index)
+    table = pd.concat([
+        attributes[['customer_id', 'customer_name', 'customer_email', 'customer_city', 'customer_country']],
+        facts,
+        attributes[['customer_created_at']],
+    ], axis=1).reset_index(drop=True)
+
+    return table.rename(columns={
+        'customer_id': 'ID',
+        'customer_name': 'Name',
+        'customer_email': 'Email',
+        'customer_city': 'City',
+        'customer_country': 'Country',
+        'total_amount': 'Total Spend',
+        'refund_amount': 'Total Refunds',
+        'discount_amount': 'Total Discounts',
+        'created_at': 'Last Order Date',
+        'customer_created_at': 'Created Date',
+    })
+
+
+## Subscriptions
+
+created_month = periods.key_column('created_at')
+payment_month = periods.key_column('payment_at')
+started_month = periods.key_column('subscription_period_started_at')
+
+def _subscription_frames(data):
+    # Subscription line items, and the first and last order month of the input (as month keys), which bound the
+    # monthly series and KPIs.
+    min_date = data[created_month].min()
+    max_date = data[created_month].max()
+
+    sales = data['transaction_type'] == 'sale'
+    subscriptions = data[data['billing_type'].isin(subscription_billing_types) & sales]
+    subscriptions = subscriptions.assign(
+        subscription_length_weeks=(subscriptions['subscription_period_ended_at'] - subscriptions['subscription_period_started_at']).dt.days / 7
+    )
+    starts = subscriptions[
+        (subscriptions[started_month] >= min_date) &
+        (subscriptions[started_month] <= max_date)
+    ]
+
+    return {
+        'min_date': min_date,
+        'max_date': max_date,
+        'subscriptions': subscriptions,
+        'one_time': data[data['billing_type'].isin(one_time_billing_types) & sales],
+        'active': subscriptions[subscriptions['subscription_status'] == 'active'],
+        'starts': starts,
+        'new': starts[starts['subscription_status'] == 'active'],
+    }
+
+def _in_payment_range(frame, min_date, max_date):
+    return frame[(frame[payment_month] >= min_date) & (frame[payment_month] <= max_date)]
+
+def _monthly_revenue(frame, min_date, max_date):
+    monthly = frame.groupby(frame[payment_month])['total_amount'].sum().sort_index()
+    return monthly[(monthly.index >= min_date) & (monthly.index <= max_date)]
+
+def _revenue_over_time(frame, min_date, max_date, granularity):
+    # Revenue per payment period, for payments within the order months of the input
+    in_range = _in_payment_range(frame, min_date, max_date)
+    return in_range.groupby(period_keys(in_range, 'payment_at', granularity))['total_amount'].sum().sort_index()
+
+@memoized
+def subscription_kpis(data):
+    frames = _subscription_frames(data)
+    max_date = frames['max_date']
+    subscriptions = frames['subscriptions']
+    active = frames['active']
+    new = frames['new']
+    # Year before the last order month (NaN without orders, which matches no payment)
+    last_year = (max_date - 1) // 12 - 1
+    payment_year = lambda frame: periods.years(frame[payment_month])
+
+    total_revenue = subscriptions['total_amount'].sum()
+    last_year_total_revenue = subscriptions[payment_year(subscriptions) == last_year]['total_amount'].sum()
+
+    active_subscriptions = active['subscription_status'].count()
+    last_year_active_subscriptions = active[payment_year(active) == last_year]['subscription_status'].count()
+
+    new_subscriptions = new['subscription_status'].count()
+    last_year_new_subscriptions = new[payment_year(new) == last_year]['subscription_status'].count()
+
+    avg_subscription_length_weeks = frames['starts']['subscription_length_weeks'].mean()
+    # Subscriptions from before last year, including those without a payment date
+    earlier_subscriptions = subscriptions[~(payment_year(subscriptions) >= last_year)]
+    last_year_avg_subscription_length_weeks = earlier_subscriptions['subscription_length_weeks'].mean() if not earlier_subscriptions.empty else np.nan
+
+    mrr = _monthly_revenue(subscriptions, frames['min_date'], max_date)
+    most_recent_mrr = mrr.iloc[-1] if not mrr.empty else 0
+    last_year_mrr = mrr.shift(12).iloc[-1] if not mrr.empty else np.nan
+
+    return {
+        'total_revenue': total_revenue,
+        'total_revenue_yoy': total_revenue - last_year_total_revenue,
+        'active_subscriptions': active_subscriptions,
+        'active_subscriptions_yoy': active_subscriptions - last_year_active_subscriptions,
+        'new_subscriptions': new_subscriptions,
+        'new_subscriptions_yoy': new_subscriptions - last_year_new_subscriptions,
+        'avg_subscription_length_weeks': avg_subscription_length_weeks,
+        'avg_subscription_length_weeks_yoy': avg_subscription_length_weeks - last_year_avg_subscription_length_weeks,
+        'most_recent_mrr': most_recent_mrr,
+        'most_recent_mrr_yoy': most_recent_mrr - last_year_mrr,
+    }
+
+## The subscription series count the subscriptions started and the payments made within the order months of the
+## input, whatever the granularity, so the periods of every granularity add up to the same totals.
+
+@memoized
+def new_subscriptions_over_time(data, granularity=default_granularity):
+    new = _subscription_frames(data)['new']
+    started = period_keys(new, 'subscription_period_started_at', granularity).rename('subscription_started_month')
+    counts = new.groupby(started).size().reset_index(name='count')
+    return counts.assign(subscription_started_month=period_starts(counts['subscription_started_month'], granularity))
+
+@memoized
+def new_subscriptions_by_plan(data, granularity=default_granularity):
+    new = _subscription_frames(data)['new']
+    started = period_keys(new, 'subscription_period_started_at', granularity).rename('subscription_started_month')
+    subscription_by_plan = new.groupby([started, 'subscription_plan']).size().unstack(fill_value=0)
+    subscription_by_plan.index = period_starts(subscription_by_plan.index, granularity).rename('subscription_started_month')
+    return pd.melt(subscription_by_plan.reset_index(), id_vars=['subscription_started_month'], var_name='subscription_plan', value_name='count')
+
+@memoized
+def subscription_revenue_by_product_type(data, granularity=default_granularity):
+    frames = _subscription_frames(data)
+    in_range = _in_payment_range(frames['subscriptions'], frames['min_date'], frames['max_date'])
+    paid = period_keys(in_range, 'payment_at', granularity).rename('payment_month')
+    revenue_by_product_type = in_range.groupby([paid, 'product_type'])['total_amount'].sum().unstack(fill_value=0)
+    revenue_by_product_type.index = period_starts(revenue_by_product_type.index, granularity).rename('payment_month')
+    return pd.melt(revenue_by_product_type.reset_index(), id_vars=['payment_month'], var_name='product_type', value_name='total_amount')
+
+@memoized
+def subscription_vs_single_order_revenue(data, granularity=default_granularity):
+    frames = _subscription_frames(data)
+    mrr = _revenue_over_time(frames['subscriptions'], frames['min_date'], frames['max_date'], granularity)
+    single_order = _revenue_over_time(frames['one_time'], frames['min_date'], frames['max_date'], granularity)
+
+    # Align the data by reindexing both Series to have the same index
+    combined_index = mrr.index.union(single_order.index)
+    revenue_data = pd.DataFrame({
+        'Date': period_starts(combined_index, granularity),
+        'Subscription Revenue': mrr.reindex(combined_index, fill_value=0).values,
+        'Single Order Revenue': single_order.reindex(combined_index, fill_value=0).values,
+    })
+    return pd.melt(revenue_data, id_vars=['Date'], var_name='Revenue Type', value_name='Amount')
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _dataset_intervals(version, _dataset):
+    prepared = prepare(_dataset)
+    return intervals.period_table(prepared['subscription_id'], prepared['subscription_period_started_at'], prepared['subscription_period_ended_at'])
+
+def lineage_rows(data, dataset):
+    # Mask over the dataset rows kept by the steps that derived data from the dataset, or None for steps it can not
+    # replay
+    from functions import filters
+
+    steps = {step[0]: step[1:] for step in versions.lineage(data)}
+    if not set(steps) <= {'dates', 'segments', 'filters', 'prepared', 'sample'}:
+        return None
+    rows = filters.date_mask(dataset, *steps['dates']) if 'dates' in steps else np.ones(len(dataset), dtype=bool)
+    selections = steps['filters'][0] if 'filters' in steps else ()
+    if selections:
+        rows &= filters.history_mask(dataset, selections, *steps['dates'])
+    if 'sample' in steps:
+        codes = dataset[customers.code_column].to_numpy()
+        sampled = customers.per_code(data[customers.code_column].to_numpy(), int(codes.max(initial=-1)) + 1) > 0
+        rows &= np.append(sampled, False)[codes]
+    return rows
+
+@memoized
+def subscription_intervals(data):
+    ## Interval index of the subscription periods, for active counts at any set of dates. The periods of a loaded
+    ## dataset are sorted once per version (st.cache_resource); the index of a frame derived from it is coalesced
+    ## from the periods of its rows.
+    dataset = versions.dataset_frame(data)
+    rows = None if dataset is None else lineage_rows(data, dataset)
+    if rows is None:
+        # Frames outside the page flow are sorted on their own
+        return intervals.build_index(data['subscription_id'], data['subscription_period_started_at'], data['subscription_period_ended_at'])
+    return intervals.table_index(_dataset_intervals(versions.key_of(dataset), dataset), rows)
+
+@memoized
+def active_subscriptions_over_time(data, granularity=default_granularity):
+    # Subscriptions with a period covering the end of each period (the latest period is counted at the last order)
+    min_created_at, max_created_at = date_range(data)
+    if pd.isna(max_created_at):
+        return pd.DataFrame({'month': pd.to_datetime([]), 'active_subscriptions': np.array([], dtype=np.int64)})
+    periods = pd.period_range(min_created_at, max_created_at, freq=granularities[granularity])
+    period_ends = periods.end_time.to_series(index=range(len(periods)))
+    period_ends.iloc[-1] = min(period_ends.iloc[-1], max_created_at)
+    return pd.DataFrame({
+        'month': periods.start_time,
+        'active_subscriptions': intervals.active_counts(subscription_intervals(data), period_ends),
+    })
+
+
+## Churn and retention
+
+def with_mrr(data):
+    # Monthly recurring revenue of a line item: its amount spread over the length of its subscription period.
+    period_days = (data['subscription_period_ended_at'] - data['subscription_period_started_at']).dt.days
+    return data.assign(mrr=data['total_amount'] / (period_days / 30))
+
+def current_month(data):
+    return periods.timestamps([data[created_month].max()])[0] if len(data) else pd.NaT
+
+@memoized
+def customer_activity(data):
+    # Created date of every customer with line items in the input, and the date of their first order with an active
+    # subscription status (NaT without one)
+    dimension = customers.dimension(data)
+    codes = data[customers.code_column].to_numpy()
+    active = (data['subscription_status'] == 'active').to_numpy()
+    present = np.flatnonzero(customers.per_code(codes, len(dimension)))
+    first_active = data['created_at'][active].groupby(codes[active]).min()
+    return pd.DataFrame({
+        'customer_created_at': dimension['customer_created_at'].to_numpy()[present],
+        'first_active_order_at': first_active.reindex(present).to_numpy(),
+    }, index=present)
+
+@memoized
+def retention_rate(data, period_start, period_end):
+    # Customers created by period_start with an active order by period_end, among all customers created by period_start
+    activity = customer_activity(data)
+    existing = activity[activity['customer_created_at'] <= period_start]
+    customers_at_start = len(existing)
+    customers_retained = int((existing['first_active_order_at'] <= period_end).sum())
+    return (customers_retained / customers_at_start) * 100 if customers_at_start > 0 else 0
+
+retention_windows = {
+    '30_day': pd.DateOffset(days=30),
+    '90_day': pd.DateOffset(days=90),
+    '1_year': pd.DateOffset(years=1),
+}
+
+def retention_periods(month):
+    # (current period, same period one year earlier) for every retention window, as (start, end) pairs.
+    year = pd.DateOffset(years=1)
+    return {
+        name: ((month - window, month), (month - year - window, month - year))
+        for name, window in retention_windows.items()
+    }
+
+@memoized
+def retention_kpis(data):
+    kpis = {}
+    for name, (current, previous) in retention_periods(current_month(data)).items():
+        rate = retention_rate(data, *current)
+        kpis[f'retention_{name}'] = rate
+        kpis[f'retention_{name}_yoy'] = percentage_change_or_new(rate, retention_rate(data, *previous))
+    return kpis
+
+def _inactive_customer_share(data, columns):
+    # Share of customers with a subscription per group (columns and order month) whose subscription is inactive
+    subscribed = data[data['subscription_id'].notna()]
+    keys = [*columns, created_month]
+    customer_counts = distinct_counts(subscribed, 'customer_id', keys, (data, 'subscribed', 'Month', columns))
+    inactive = subscribed[subscribed['subscription_status'] == 'inactive']
+    inactive_customers = distinct_counts(inactive, 'customer_id', keys, (data, 'inactive', 'Month', columns))
+    return inactive_customers.reindex(customer_counts.index, fill_value=0) / customer_counts
+
+@memoized
+def churn_rate_by_month(data):
+    churn_rate = _inactive_customer_share(data, []).reset_index()
+    churn_rate.columns = ['Month', 'Overall Churn Rate']
+    return churn_rate.assign(Month=periods.timestamps(churn_rate['Month']))
+
+@memoized
+def churn_rate_by_plan(data):
+    churn_rate = _inactive_customer_share(data, ['subscription_plan']).reset_index()
+    churn_rate.columns = ['Subscription Plan', 'Month', 'Churn Rate']
+    return churn_rate.assign(Month=periods.timestamps(churn_rate['Month']))
+
+## MRR ledger
+## Every subscription's MRR in every month its billed periods cover, with the month-over-month change classified as
+## new, expansion, contraction, churn or reactivation. A subscription churns in the month after its last billed one,
+## which often lies before the date range, so the ledger is built once per dataset version over the whole history.
+## A report reads the ledger rows of its reporting months for the subscriptions its filters select: those with a line
+## item (at any time) matching all the filter selections, and on a sample those of the sampled customers. The MRR KPIs
+## and charts read from it.
+
+ledger_movements = ['new', 'expansion', 'contraction', 'churn', 'reactivation']
+ledger_columns = ['subscription_id', 'month', 'product_type', 'subscription_plan', 'previous_mrr', 'mrr', 'change', 'movement']
+
+def monthly_subscription_mrr(data):
+    # A sale spreads its MRR over the months from its period start up to the month before its period end
+    # (at least the start month). Months are month keys (functions/periods.py).
+    sales = data[data['subscription_id'].notna() & data['billing_type'].isin(subscription_billing_types) & (data['transaction_type'] == 'sale')]
+    sales = with_mrr(sales)
+    sales = sales[np.isfinite(sales['mrr'])]
+
+    first = sales[started_month].to_numpy(dtype=np.int64)
+    last = np.maximum(sales[periods.key_column('subscription_period_ended_at')].to_numpy(dtype=np.int64) - 1, first)
+    months_covered = last - first + 1
+    rows = np.repeat(np.arange(len(sales)), months_covered)
+    offsets = np.arange(len(rows)) - np.repeat(np.cumsum(months_covered) - months_covered, months_covered)
+
+    expanded = pd.DataFrame({
+        'subscription_id': sales['subscription_id'].to_numpy()[rows],
+        'month': first[rows] + offsets,
+        'mrr': sales['mrr'].to_numpy()[rows],
+    })
+    monthly = expanded.groupby(['subscription_id', 'month'])['mrr'].sum().reset_index()
+    attributes = sales.groupby('subscription_id')[['product_type', 'subscription_plan']].first()
+    return monthly.join(attributes, on='subscription_id')
+
+def classify_movements(monthly):
+    # monthly holds subscription_id, month (month number), mrr and the subscription attributes. A month after an
+    # active month without MRR is a churn month. Months stay month keys.
+    active = monthly[monthly['mrr'] > 0]
+    attributes = active.groupby('subscription_id')[['product_type', 'subscription_plan']].first()
+    following = active[['subscription_id', 'month', 'mrr']].assign(month=active['month'] + 1).rename(columns={'mrr': 'previous_mrr'})
+    ledger = active[['subscription_id', 'month', 'mrr']].merge(following, on=['subscription_id', 'month'], how='outer')
+    ledger[['mrr', 'previous_mrr']] = ledger[['mrr', 'previous_mrr']].fillna(0)
+    ledger = ledger.join(attributes, on='subscription_id')
+
+    first_month = ledger['subscription_id'].map(active.groupby('subscription_id')['month'].min())
+    ledger['change'] = ledger['mrr'] - ledger['previous_mrr']
+    ledger['movement'] = np.select(
+        [
+            (ledger['previous_mrr'] == 0) & (ledger['month'] == first_month),
+            ledger['previous_mrr'] == 0,
+            ledger['mrr'] == 0,
+            ledger['change'] > 0,
+            ledger['change'] < 0,
+        ],
+        ['new', 'reactivation', 'churn', 'expansion', 'contraction'],
+        default='unchanged'
+    )
+    return ledger.sort_values(['subscription_id', 'month'], ignore_index=True)[ledger_columns]
+
+def ledger_window(ledger, months, selected=None):
+    # Rows of the reporting months (month keys, None without orders) of the selected subscriptions (a mask over the
+    # ledger rows, None for all), with the months as timestamps
+    keep = np.zeros(len(ledger), dtype=bool) if months is None else ledger['month'].between(*months).to_numpy()
+    if selected is not None:
+        keep &= selected
+    window = ledger.loc[keep, ledger_columns].reset_index(drop=True)
+    window['month'] = periods.timestamps(window['month'])
+    return window
+
+def build_ledger(data):
+    ## (ledger, subscription code of every line item, customer code of every subscription), the codes indexing the
+    ## ledger's subscriptions in sorted order.
+    ledger = classify_movements(monthly_subscription_mrr(data))
+    row_subscriptions, subscriptions = pd.factorize(data['subscription_id'], sort=True)
+    known = row_subscriptions >= 0
+    _, first_rows = np.unique(row_subscriptions[known], return_index=True)
+    subscription_customers = data[customers.code_column].to_numpy()[np.flatnonzero(known)[first_rows]]
+    ledger['subscription_code'] = subscriptions.get_indexer(ledger['subscription_id'])
+    return ledger, row_subscriptions, subscription_customers
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _dataset_ledger(version, _dataset):
+    return build_ledger(prepare(_dataset))
+
+def selected_subscriptions(data, dataset, row_subscriptions, subscription_customers):
+    # Mask over the subscription codes selected by the steps that derived data from the dataset, or None for all
+    steps = {step[0]: step[1:] for step in versions.lineage(data)}
+    selected = None
+    selections = steps['filters'][0] if 'filters' in steps else ()
+    if selections:
+        from functions import filters
+
+        rows = filters.history_mask(dataset, selections, *steps['dates'])
+        selected = np.bincount(row_subscriptions[rows & (row_subscriptions >= 0)], minlength=len(subscription_customers)) > 0
+    if 'sample' in steps:
+        sampled = customers.per_code(data[customers.code_column].to_numpy(), int(subscription_customers.max(initial=-1)) + 1) > 0
+        in_sample = np.append(sampled, False)[subscription_customers]
+        selected = in_sample if selected is None else selected & in_sample
+    return selected
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _ledger_view(key, _data):
+    dataset = versions.dataset_frame(_data)
+    if dataset is None:
+        # Frames outside the page flow are their own history
+        ledger, _, _ = build_ledger(prepare(_data))
+        return ledger_window(ledger, reporting_months(_data))
+    ledger, row_subscriptions, subscription_customers = _dataset_ledger(versions.key_of(dataset), dataset)
+    selected = selected_subscriptions(_data, dataset, row_subscriptions, subscription_customers)
+    selected = None if selected is None else selected[ledger['subscription_code'].to_numpy()]
+    return ledger_window(ledger, reporting_months(_data), selected)
+
+def mrr_ledger(data):
+    ## The ledger rows of an input. Ledgers are large, so they are kept (once per dataset version, and per input)
+    ## in st.cache_resource instead of the pickling caches of the metrics, and must not be modified in place.
+    if backend.is_relation(data):
+        from functions import sql_metrics
+
+        return sql_metrics.mrr_ledger(data)
+    return _ledger_view(fingerprint(data), data)
+
+def _movement_total(ledger, month, movement=None):
+    in_month = ledger[ledger['month'] == month]
+    if movement is None:
+        return in_month['mrr'].sum()
+    return in_month.loc[in_month['movement'] == movement, 'change'].sum()
+
+@memoized
+def mrr_kpis(data):
+    # MRR, New MRR and Churned MRR of the latest month, each compared with the same month a year earlier
+    ledger = mrr_ledger(data)
+    months = reporting_months(data)
+    if months is None:
+        return {name: 0 for name in ['current_mrr', 'current_mrr_yoy', 'new_mrr', 'new_mrr_yoy', 'churned_mrr', 'churned_mrr_yoy']}
+    month = periods.timestamps([months[1]])[0]
+    year_ago = month - pd.DateOffset(years=1)
+
+    current_mrr = _movement_total(ledger, month)
+    new_mrr = _movement_total(ledger, month, 'new')
+    churned_mrr = -_movement_total(ledger, month, 'churn')
+    return {
+        'current_mrr': current_mrr,
+        'current_mrr_yoy': percentage_change_or_new(current_mrr, _movement_total(ledger, year_ago)),
+        'new_mrr': new_mrr,
+        'new_mrr_yoy': percentage_change_or_new(new_mrr, _movement_total(ledger, year_ago, 'new')),
+        'churned_mrr': churned_mrr,
+        'churned_mrr_yoy': percentage_change_or_new(churned_mrr, -_movement_total(ledger, year_ago, 'churn')),
+    }
+
+@memoized
+def new_mrr_by_product_type(data):
+    new = mrr_ledger(data)
+    new = new[new['movement'] == 'new']
+    return new.groupby(['month', 'product_type'])['change'].sum().reset_index().rename(columns={'month': 'created_at', 'change': 'mrr'})
+
+@memoized
+def mrr_movements_by_month(data):
+    ledger = mrr_ledger(data)
+    moved = ledger[ledger['movement'].isin(ledger_movements)]
+    movements = moved.groupby(['month', 'movement'])['change'].sum().unstack(fill_value=0)
+    movements = movements.reindex(columns=ledger_movements, fill_value=0).rename_axis(columns=None).reset_index()
+    return pd.melt(movements, id_vars=['month'], var_name='movement', value_name='mrr')
+
+cohort_columns = ['customer_id', 'subscription_id', 'customer_created_at', 'subscription_period_started_at', 'subscription_status']
+
+def subscription_cohort(subscribed):
+    return subscribed.groupby('subscription_id').agg({
+        'customer_created_at': 'first',
+        'subscription_period_started_at': 'first',
+        'subscription_status': 'last'
+    })
+
+def cohort_matrix(cohort):
+    # Churn matrix of a per-subscription cohort frame (subscription_id, customer_created_at, subscription_period_started_at, subscription_status)
+    cohort = cohort.copy()
+
+    # Months since customer creation, counted in whole calendar months and never negative
+    start_month = periods.month_keys(cohort['subscription_period_started_at'])
+    cohort['months_since_customer_creation'] = np.maximum(start_month - periods.month_keys(cohort['customer_created_at']), 0).astype(int)
+    cohort['start_month'] = start_month
+
+    total_subs = cohort.groupby(['start_month', 'months_since_customer_creation'])['subscription_id'].nunique().unstack(fill_value=0)
+    churned = cohort[cohort['subscription_status'] == 'inactive']
+    churned_subs = churned.groupby(['start_month', 'months_since_customer_creation'])['subscription_id'].nunique().unstack(fill_value=0)
+
+    # Ensure both dataframes have the same index and columns
+    common_index = total_subs.index.intersection(churned_subs.index)
+    common_columns = total_subs.columns.intersection(churned_subs.columns)
+    total_subs = total_subs.loc[common_index, common_columns].sort_index()
+    churned_subs = churned_subs.loc[common_index, common_columns].sort_index()
+
+    churn_rate = (churned_subs / total_subs).fillna(0).replace([np.inf, -np.inf], 0)
+    churn_rate = churn_rate.reindex(sorted(churn_rate.columns), axis=1)
+
+    for frame in (churn_rate, churned_subs, total_subs):
+        frame.index = periods.labels(frame.index)
+        frame.index.name = 'Subscription Start Month'
+        frame.columns.name = "Months Since Customer Creation"
+
+    return {
+        'churn_rate': churn_rate,
+        'matrix': churn_rate.loc[(churn_rate != 0).any(axis=1)],
+        'churned_subscriptions': churned_subs,
+        'total_subscriptions': total_subs,
+    }
+
+@memoized
+def cohort_churn(data, start_date, end_date):
+    subscribed = data[(data['subscription_id'].notna()) &
+                      (data['subscription_period_started_at'] >= start_date) &
+                      (data['subscription_period_started_at'] <= end_date)]
+
+    cohort = sharding.by_customer(subscription_cohort, subscribed, cohort_columns, data).reset_index()
+    return cohort_matrix(cohort)
+
+
+## Page metric sets
+## The computations behind each report page as run_concurrently tasks (name -> (metric, *args)), shared by the pages
+## and the cache warm-up so both compute exactly the same entries. The churn analysis is monthly by definition; the
+## other pages plot their series at the given granularity.
+
+def page_tasks(page, data, cohort_range=None, granularity=default_granularity):
+    if page == 'orders_and_revenue':
+        return {
+            'kpis': (order_kpis, data),
+            'revenue_and_orders': (revenue_and_orders_over_time, data, granularity),
+            'product_revenue': (revenue_by_product, data),
+            'new_customers': (new_customers_over_time, data, granularity),
+            'location_performance': (revenue_by_country, data),
+            'customer_table': (customer_table, data),
+        }
+    if page == 'subscriptions_report':
+        return {
+            'kpis': (subscription_kpis, data),
+            'new_subscriptions': (new_subscriptions_over_time, data, granularity),
+            'new_subscriptions_by_plan': (new_subscriptions_by_plan, data, granularity),
+            'revenue_by_product_type': (subscription_revenue_by_product_type, data, granularity),
+            'revenue_by_type': (subscription_vs_single_order_revenue, data, granularity),
+            'active_subscriptions': (active_subscriptions_over_time, data, granularity),
+        }
+    if page == 'churn_analysis':
+        # The cohort matrix covers the whole filtered date range unless a range is given
+        start_date, end_date = cohort_range or date_range(data)
+        return {
+            'mrr_kpis': (mrr_kpis, data),
+            'retention_kpis': (retention_kpis, data),
+            'churn_rate': (churn_rate_by_month, data),
+            'churn_rate_by_plan': (churn_rate_by_plan, data),
+            'new_mrr_by_type': (new_mrr_by_product_type, data),
+            'mrr_movements': (mrr_movements_by_month, data),
+            'cohort': (cohort_churn, data, start_date, end_date),
+        }
+    raise ValueError(f"Unknown page '{page}'")
+
+## The page task outputs that add up over line items (sums and counts), as KPI names or value columns per task.
+## Computed on a sample they are scaled up to the full input (functions/progressive.py); ratios, averages and dates are
+## not. Those in distinct_totals count distinct values of a column that is not nested in customers (an order can span
+## several customers) and are scaled by that column's ratio of distinct values instead.
+page_totals = {
+    'orders_and_revenue': {
+        'kpis': ['total_revenue', 'number_of_orders', 'number_of_customers', 'new_customers'],
+        'revenue_and_orders': ['total_amount', 'header_id'],
+        'product_revenue': ['total_amount'],
+        'new_customers': ['customer_id'],
+        'location_performance': ['total_amount'],
+    },
+    'subscriptions_report': {
+        'kpis': ['total_revenue', 'total_revenue_yoy', 'active_subscriptions', 'active_subscriptions_yoy', 'new_subscriptions',
+                 'new_subscriptions_yoy', 'most_recent_mrr', 'most_recent_mrr_yoy'],
+        'new_subscriptions': ['count'],
+        'new_subscriptions_by_plan': ['count'],
+        'revenue_by_product_type': ['total_amount'],
+        'revenue_by_type': ['Amount'],
+        'active_subscriptions': ['active_subscriptions'],
+    },
+    'churn_analysis': {
+        'mrr_kpis': ['current_mrr', 'new_mrr', 'churned_mrr'],
+        'new_mrr_by_type': ['mrr'],
+        'mrr_movements': ['mrr'],
+        'cohort': ['churned_subscriptions', 'total_subscriptions'],
+    },
+}
+
+distinct_totals = {'number_of_orders': 'header_id', 'header_id': 'header_id'}
+
+report_pages = ['orders_and_revenue', 'subscriptions_report', 'churn_analysis']
+granularity_pages = ['orders_and_revenue', 'subscriptions_report']
@@ -0,0 +1,59 @@
+import numpy as np
+import pandas as pd
+
+## Integer month and quarter keys of the date columns.
+## The loader stores, next to every date column, an int32 month key (year * 12 + month, as <column>_month_key) and
+## quarter key (the month key of the quarter's first month, as <column>_quarter_key), computed once per dataset
+## version. Range filters and groupbys by month or quarter compare and group these integers instead of converting the
+## dates to periods on every rerun; keys become timestamps only for the few periods a chart plots. Missing dates have
+## the key 0, below every real key, so lower-bounded ranges leave them out.
+
+date_columns = ['created_at', 'customer_created_at', 'payment_at', 'subscription_period_started_at', 'subscription_period_ended_at']
+key_granularities = ['Month', 'Quarter']
+missing_key = 0
+
+## Month key of 1970-01, the epoch of numpy's datetime64[M]
+epoch_key = 1970 * 12 + 1
+
+
+def key_column(column, granularity='Month'):
+    return f'{column}_{granularity.lower()}_key'
+
+def month_keys(dates):
+    months = pd.to_datetime(dates, errors='coerce').to_numpy(dtype='datetime64[M]')
+    keys = months.astype(np.int64) + epoch_key
+    return np.where(np.isnat(months), missing_key, keys).astype(np.int32)
+
+def quarter_keys(month_keys):
+    month_keys = np.asarray(month_keys)
+    return np.where(month_keys == missing_key, missing_key, month_keys - (month_keys - 1) % 3).astype(np.int32)
+
+def key_values(data):
+    # The key columns a frame is missing (all of them at load; none for frames derived from a loaded dataset)
+    values = {}
+    for column in date_columns:
+        if column in data.columns and key_column(column) not in data.columns:
+            months = month_keys(data[column])
+            values[key_column(column, 'Month')] = months
+            values[key_column(column, 'Quarter')] = quarter_keys(months)
+    return values
+
+def add_keys(data):
+    for name, values in key_values(data).items():
+        data[name] = values
+    return data
+
+def years(keys):
+    # Calendar year of each key (-1 for missing dates)
+    return (np.asarray(keys, dtype=np.int64) - 1) // 12
+
+def timestamps(keys):
+    ## Start of the month of each key, as a DatetimeIndex (NaT for missing dates).
+    keys = np.asarray(keys, dtype=np.int64)
+    months = np.where(keys == missing_key, np.datetime64('NaT'), (keys - epoch_key).astype('datetime64[M]'))
+    return pd.DatetimeIndex(months.astype('datetime64[ns]'))
+
+def labels(keys):
+    # 'YYYY-MM' of each key
+    keys = np.asarray(keys, dtype=np.int64)
+    return [f'{(key - 1) // 12:04d}-{(key - 1) % 12 + 1:02d}' for key in keys]
@@ -0,0 +1,166 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+import numpy as np
+import pandas as pd
+import streamlit as st
+from functions import backend, customers, metrics, periods, sketches, versions
+from functions.executor import run_concurrently
+
+## Progressive rendering of the report pages (BILLING_RENDER_MODE=progressive).
+## On inputs of at least BILLING_PROGRESSIVE_MIN_ROWS line items a page is first computed on a stratified sample of
+## about BILLING_SAMPLE_ROWS rows and rendered at once under an "Approximate" badge; then the exact results are
+## computed on a background thread (BILLING_EXACT_WORKERS of them, shared by all sessions) and the page reruns to show
+## them. The sample goes first so that it does not compete with the exact computation for the cores. Inputs whose exact
+## results a session has already had are shown exactly straight away.
+##
+## The sample keeps whole customers (picked by a hash of customer_id, so the same filters give the same sample), which
+## keeps their orders, subscriptions and MRR movements intact, and at least one customer of every order month and
+## subscription plan. Sums and counts (metrics.page_totals) are scaled up by the ratio of input to sampled customers
+## (distinct order counts by that of orders); ratios, averages and dates are shown as measured on the sample, and the
+## customer table lists the sampled customers. The default mode ('exact') and the DuckDB backend always compute on the
+## full input.
+
+render_modes = ['exact', 'progressive']
+progressive_min_rows = int(os.environ.get('BILLING_PROGRESSIVE_MIN_ROWS', 1_000_000))
+sample_rows = int(os.environ.get('BILLING_SAMPLE_ROWS', 100_000))
+exact_workers = int(os.environ.get('BILLING_EXACT_WORKERS', 1))
+refine_poll_seconds = 1.0
+max_jobs = 32
+
+_jobs = OrderedDict()
+_jobs_lock = threading.Lock()
+_pool = None
+
+
+def render_mode():
+    mode = os.environ.get('BILLING_RENDER_MODE', 'exact').lower()
+    if mode not in render_modes:
+        raise ValueError(f"Unknown BILLING_RENDER_MODE '{mode}', expected one of {render_modes}")
+    return mode
+
+def progressive(data):
+    # Whether a page over this input is rendered from a sample first
+    return render_mode() == 'progressive' and not backend.is_relation(data) and len(data) >= max(progressive_min_rows, 2 * sample_rows)
+
+def stratified_sample(data, rows):
+    ## Whole customers with a hash below rows / len(data), plus the customer of the lowest hash in every
+    ## (order month, subscription plan) stratum the pick missed.
+    unit = sketches.column_hashes(data, 'customer_id') / np.float64(2 ** 64)
+    keep = unit < rows / len(data)
+    strata = data.groupby([data[periods.key_column('created_at')], data['subscription_plan']], dropna=False, sort=False).ngroup().to_numpy()
+    covered = pd.Series(keep).groupby(strata).transform('any').to_numpy()
+    lowest = pd.Series(unit).groupby(strata).transform('min').to_numpy()
+    keep |= np.isin(unit, unit[~covered & (unit == lowest)])
+    return data[keep]
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _shared_sample(key, rows, _data):
+    sampled = versions.derive(stratified_sample(_data, rows), _data, 'sample', rows)
+    return sampled, scale_factors(_data, sampled)
+
+def sample(data):
+    ## The stratified sample of an input and its scale factors, drawn once per input and shared by all sessions.
+    return _shared_sample(metrics.fingerprint(data), sample_rows, data)
+
+def _scale(value, factor):
+    # Counts stay whole numbers
+    if isinstance(value, pd.DataFrame):
+        return value.apply(_scale, args=(factor,))
+    if isinstance(value, pd.Series):
+        scaled = value * factor
+        return scaled.round().astype(value.dtype) if pd.api.types.is_integer_dtype(value.dtype) else scaled
+    if isinstance(value, (int, np.integer)) and not isinstance(value, bool):
+        return int(round(value * factor))
+    if isinstance(value, (float, np.floating)):
+        return value * factor
+    # e.g. "New" year-over-year changes
+    return value
+
+def scale_factors(data, sampled):
+    # Whole customers are sampled, so totals scale by the ratio of input to sampled customers, and the distinct
+    # counts of metrics.distinct_totals by the ratio of their distinct values
+    def ratio(column):
+        return data[column].nunique() / max(sampled[column].nunique(), 1)
+
+    factors = {column: ratio(column) for column in set(metrics.distinct_totals.values())}
+    factors[None] = ratio(customers.code_column)
+    return factors
+
+def scale_results(page, results, factors):
+    # Page results computed on a sample, with their sums and counts scaled up to the full input
+    results = dict(results)
+    for task, names in metrics.page_totals[page].items():
+        result = results[task]
+        scaled = {name: _scale(result[name], factors[metrics.distinct_totals.get(name)]) for name in names}
+        results[task] = result.assign(**scaled) if isinstance(result, pd.DataFrame) else dict(result, **scaled)
+    return results
+
+def _exact_pool():
+    global _pool
+    with _jobs_lock:
+        if _pool is None:
+            _pool = ThreadPoolExecutor(max_workers=exact_workers, thread_name_prefix='billing-exact')
+        return _pool
+
+def job_key(page, data, kwargs):
+    return page, metrics.fingerprint(data), repr(sorted(kwargs.items()))
+
+def finished_job(page, data, **kwargs):
+    # The exact results of an input if they have been computed, else None
+    with _jobs_lock:
+        job = _jobs.get(job_key(page, data, kwargs))
+    return job if job is not None and job.done() and not job.cancelled() and job.exception() is None else None
+
+def failed(job):
+    return job.done() and not job.cancelled() and job.exception() is not None
+
+def exact_job(page, data, **kwargs):
+    ## The background computation of a page's exact results, shared by all sessions showing the same input. A job that
+    ## failed stays recorded, so its input is not computed again until the job is evicted.
+    key = job_key(page, data, kwargs)
+    pool = _exact_pool()
+    with _jobs_lock:
+        job = _jobs.get(key)
+        if job is None or job.cancelled():
+            job = _jobs[key] = pool.submit(run_concurrently, metrics.page_tasks(page, data, **kwargs), page)
+        _jobs.move_to_end(key)
+        for stale in [stale for stale, other in _jobs.items() if other.done()][:max(0, len(_jobs) - max_jobs)]:
+            del _jobs[stale]
+
+    # A session only waits for its latest input: the exact job of its previous one is dropped if it has not started
+    previous = st.session_state.get('exact_job')
+    if previous is not None and previous is not job:
+        previous.cancel()
+    st.session_state.exact_job = job
+    return job
+
+@st.fragment(run_every=refine_poll_seconds)
+def _refine(job):
+    # Reruns the page once the exact results are ready (or have failed)
+    if job.done():
+        st.rerun()
+
+def page_results(page, data, **kwargs):
+    ## The results of a page's metric tasks (metrics.page_tasks): exact, or in progressive mode at first from a
+    ## sample, with a badge and a rerun once the exact results are ready. If the exact computation fails, the page
+    ## keeps the estimates and shows the error.
+    if not progressive(data):
+        return run_concurrently(metrics.page_tasks(page, data, **kwargs), page=page)
+
+    job = finished_job(page, data, **kwargs)
+    if job is not None:
+        st.session_state.exact_job = None
+        return job.result()
+
+    sampled, factors = sample(data)
+    results = run_concurrently(metrics.page_tasks(page, sampled, **kwargs), page=page)
+    job = exact_job(page, data, **kwargs)
+    st.badge("Approximate", icon=":material/timelapse:", color="orange")
+    if failed(job):
+        st.error(f"The exact figures could not be computed ({job.exception()}), the estimates from a sample of {len(sampled):,} of {len(data):,} line items are shown.")
+    else:
+        st.caption(f"Estimated from a sample of {len(sampled):,} of {len(data):,} line items; the exact figures replace them when ready.")
+        _refine(job)
+    return scale_results(page, results, factors)
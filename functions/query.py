@@ -1,5 +1,13 @@
+import os
+import time
+import hashlib
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
 import streamlit as st
+import numpy as np
 import pandas as pd
+from functions import currency, customers, memory, periods, sketches, shared_dataset, versions
 
 data_columns = ['header_id',
                 'line_item_id',
@@ -39,18 +47,222 @@ data_columns = ['header_id',
                 'customer_country'
                 ]
 
-@st.cache_data(ttl=600)
+DATA_PATH = 'data/example__line_item_enhanced.csv'
+date_columns = ['created_at', 'customer_created_at', 'payment_at', 'subscription_period_started_at', 'subscription_period_ended_at']
 
-def query_results():
-    ## Currently we are only pulling from the dummy sample data. However, this could be expanded for direct table in warehouse connection.
-    query = pd.read_csv('data/example__line_item_enhanced.csv', parse_dates=['created_at', 'customer_created_at', 'payment_at', 'subscription_period_started_at', 'subscription_period_ended_at'])
+def data_path():
+    ## The sample data can be swapped for another *__line_item_enhanced export (e.g. a generated benchmark dataset) with BILLING_DATA_PATH.
+    return os.environ.get('BILLING_DATA_PATH', DATA_PATH)
+
+def source_name(path):
+    name = os.path.basename(path)
+    return name.split('__line_item_enhanced')[0] if '__line_item_enhanced' in name else os.path.splitext(name)[0]
+
+def data_sources():
+    # (name, path) of every source in BILLING_DATA_SOURCES, or None when the app reads the single source at data_path()
+    sources = []
+    for entry in os.environ.get('BILLING_DATA_SOURCES', '').split(','):
+        name, path = entry.split('=', 1) if '=' in entry else ('', entry)
+        if path.strip():
+            sources.append((name.strip() or source_name(path.strip()), path.strip()))
+    names = [name for name, _ in sources]
+    if len(set(names)) < len(names):
+        raise ValueError(f"Duplicate source names in BILLING_DATA_SOURCES: {names}")
+    return sources or None
+
+def read_dataset(path):
+    if path.endswith('.parquet'):
+        return pd.read_parquet(path, columns=data_columns)
+    return pd.read_csv(path, parse_dates=date_columns)
+
+## How the dataset is kept fresh (BILLING_REFRESH_MODE):
+## - 'version' (default): every request probes the dataset version (functions.versions.dataset_version, a content
+##   fingerprint of the source) and the data is reloaded only when it changed; requests arriving meanwhile wait for it.
+## - 'background': the current version is always served; once it is older than BILLING_REFRESH_SECONDS a background
+##   thread reloads it (only if the source changed) and swaps the new version in. Only one load per source runs at a time.
+## Either way the loaded frame is shared by all sessions and tagged with its version, which every downstream cache
+## (derived columns, filter options, page aggregates) is keyed on.
+refresh_modes = ['version', 'background']
+refresh_seconds = float(os.environ.get('BILLING_REFRESH_SECONDS', 600))
+
+## Several *__line_item_enhanced exports, e.g. one per billing platform (Stripe, Shopify, Recurly, Recharge, Zuora), are
+## combined with BILLING_DATA_SOURCES: a comma-separated list of paths, each optionally named as name=path (by default
+## the file name before '__line_item_enhanced'). Every source is loaded, versioned and refreshed on its own as above, on
+## a pool of BILLING_SOURCE_WORKERS threads, so a new version of one source reads that source only. The sources are
+## aligned to data_columns, tagged with a categorical source column and unioned; the union is rebuilt when a source's
+## version changes, and its version (that of its sources) keys the caches downstream.
+source_workers = int(os.environ.get('BILLING_SOURCE_WORKERS', 4))
+source_column = 'source'
+
+_datasets = {}
+_unions = {}
+_datasets_lock = threading.Lock()
+_source_pool = None
+
+logger = logging.getLogger(__name__)
+
+
+def refresh_mode():
+    mode = os.environ.get('BILLING_REFRESH_MODE', 'version').lower()
+    if mode not in refresh_modes:
+        raise ValueError(f"Unknown BILLING_REFRESH_MODE '{mode}', expected one of {refresh_modes}")
+    return mode
+
+def read_source(path):
+    query = read_dataset(path)
     data = pd.DataFrame(query, columns=data_columns)
 
     if 'created_at' in data.columns and not pd.api.types.is_datetime64_any_dtype(data['created_at']):
         data['created_at'] = pd.to_datetime(data['created_at'])
-        
-    data_load_state = st.text('Loading data...')
+
+    # Amounts in the reporting currency, converted at the rates of the order date
+    data = currency.normalize(data)
+    # Identifier hashes for approximate distinct counts (only in that mode)
+    data = sketches.add_hashes(data)
+    # Integer month and quarter keys of the date columns
+    data = periods.add_keys(data)
+    # Integer customer codes (functions/customers.py)
+    data = customers.add_codes(data)
+
     data['created_at'] = data['created_at'].dt.date
-    data_load_state.text("Done! (using st.cache_data)")
+    return data
+
+def read_version(path, version):
+    # The frame of a dataset version, read from the source or mapped from the host's shared copy (functions.shared_dataset)
+    if shared_dataset.dataset_store() == 'arrow':
+        return shared_dataset.load(path, version, read_source)
+    return read_source(path)
+
+def _load_version(path, current=None, dimension=True):
+    # Reads the source unless its version is unchanged since the current version was loaded
+    version = versions.dataset_version(path)
+    if current is not None and current['version'] == version:
+        data = current['data']
+    else:
+        data = versions.tag(read_version(path, version), version)
+        if dimension:
+            # The customer dimension is built with the version, before sessions see it (sources of a union only
+            # get one with the union)
+            data = customers.register(data)
+    return {'data': data, 'version': version, 'loaded_at': time.monotonic()}
+
+def _dataset_state(path, dimension=True):
+    with _datasets_lock:
+        return _datasets.setdefault(path, {'lock': threading.Lock(), 'current': None, 'refreshing': False, 'dimension': dimension})
+
+def _refresh(path, state):
+    try:
+        with state['lock']:
+            state['current'] = _load_version(path, state['current'], state['dimension'])
+    except Exception:
+        # Keep serving the current version and try again after the next interval
+        logger.exception("Background refresh of %s failed", path)
+        state['current'] = dict(state['current'], loaded_at=time.monotonic())
+    finally:
+        state['refreshing'] = False
 
-    return data
\ No newline at end of file
+def probed_version(path, dimension=True):
+    # The current version of the dataset, reloaded only when the version probe shows a change
+    state = _dataset_state(path, dimension)
+    current = state['current']
+    if current is None or current['version'] != versions.dataset_version(path):
+        with state['lock']:
+            state['current'] = _load_version(path, state['current'], state['dimension'])
+        current = state['current']
+    return current
+
+def load_data(path):
+    ## The current version of the dataset, reloaded only when the version probe shows a change.
+    ## The frame is shared by all sessions, so it must not be modified in place.
+    data_load_state = st.text('Loading data...')
+    current = probed_version(path)
+    data_load_state.text(f"Done! (dataset version {current['version'][:12]})")
+
+    return current['data']
+
+def clear_datasets():
+    # Forgets the loaded versions, so the next request loads the data again (cold runs of tools.benchmark)
+    with _datasets_lock:
+        _datasets.clear()
+        _unions.clear()
+
+def loaded_datasets():
+    # (path, version, frame) of every dataset and union of sources loaded in this process (functions.memory)
+    with _datasets_lock:
+        states = list(_datasets.items())
+        states += [('+'.join(name for name, _ in sources), state) for sources, state in _unions.items()]
+    return [(path, state['current']['version'], state['current']['data']) for path, state in states if state['current'] is not None]
+
+def served_version(path, dimension=True):
+    # Stale-while-revalidate: the current version at once, with at most one background reload scheduled
+    state = _dataset_state(path, dimension)
+    if state['current'] is None:
+        # First load: concurrent sessions wait for the one in flight instead of loading in parallel
+        with state['lock']:
+            if state['current'] is None:
+                state['current'] = _load_version(path, dimension=state['dimension'])
+
+    current = state['current']
+    if time.monotonic() - current['loaded_at'] >= refresh_seconds:
+        with _datasets_lock:
+            start_refresh = not state['refreshing']
+            state['refreshing'] = True
+        if start_refresh:
+            threading.Thread(target=_refresh, args=(path, state), name='billing-refresh', daemon=True).start()
+    return current
+
+def load_current(path):
+    ## Stale-while-revalidate: returns the current version at once and schedules at most one background reload.
+    ## The frame is shared by all sessions, so it must not be modified in place.
+    return served_version(path)['data']
+
+def _sources_pool():
+    global _source_pool
+    with _datasets_lock:
+        if _source_pool is None:
+            _source_pool = ThreadPoolExecutor(max_workers=source_workers, thread_name_prefix='billing-source')
+        return _source_pool
+
+def union_sources(sources, frames):
+    ## The frames of the sources as one frame with a categorical source column. Customer codes are assigned over the
+    ## union, so a customer_id found in several sources is one customer.
+    union = pd.concat(frames, ignore_index=True)
+    del union[customers.code_column]
+    codes = np.repeat(np.arange(len(frames), dtype=np.int8 if len(frames) < 2 ** 7 else np.int32), [len(frame) for frame in frames])
+    union[source_column] = pd.Categorical.from_codes(codes, categories=[name for name, _ in sources])
+    return customers.add_codes(union)
+
+def current_union(sources):
+    ## The current union of the sources: every source is probed (or served, in the background refresh mode) on the
+    ## source pool and the union is rebuilt once when any of their versions changed.
+    load = served_version if refresh_mode() == 'background' else probed_version
+    currents = list(_sources_pool().map(lambda source: load(source[1], dimension=False), sources))
+    version = hashlib.sha1(repr([(name, current['version']) for (name, _), current in zip(sources, currents)]).encode()).hexdigest()
+
+    with _datasets_lock:
+        state = _unions.setdefault(tuple(sources), {'lock': threading.Lock(), 'current': None})
+    if state['current'] is None or state['current']['version'] != version:
+        with state['lock']:
+            if state['current'] is None or state['current']['version'] != version:
+                union = versions.tag(union_sources(sources, [current['data'] for current in currents]), version)
+                state['current'] = {'data': customers.register(union), 'version': version,
+                                    'sources': {name: current['version'] for (name, _), current in zip(sources, currents)}}
+    return state['current']
+
+def load_sources(sources):
+    ## The current union of several sources. The frame is shared by all sessions, so it must not be modified in place.
+    data_load_state = st.text('Loading data...')
+    current = current_union(sources)
+    data_load_state.text(f"Done! ({len(sources)} sources, dataset version {current['version'][:12]})")
+
+    return current['data']
+
+def query_results():
+    ## Currently we are only pulling from the dummy sample data. However, this could be expanded for direct table in warehouse connection.
+    memory.schedule_logging()
+    sources = data_sources()
+    if sources is not None:
+        return load_sources(sources)
+    if refresh_mode() == 'background':
+        return load_current(data_path())
+    return load_data(data_path())
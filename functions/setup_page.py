@@ -1,19 +1,28 @@
 import streamlit as st
-import plost
-import pandas as pd
-import numpy as np
-from datetime import datetime
-from functions.filters import date_filter, filter_data, setting_filters
-from functions.query import query_results
+from functions.filters import date_filter, filter_data, setting_filters, sql_date_filter, sql_setting_filters
+from functions.backend import compute_backend
+from functions.exports import download_buttons
 
 def page_creation():
-    billing_data, d = date_filter()
+    ## With the DuckDB backend the filtered data is returned as a query (functions.backend.Relation) rather than a frame.
+    sql_backend = compute_backend() == 'duckdb'
+    if sql_backend:
+        source, d = sql_date_filter()
+    else:
+        billing_data, d = date_filter()
 
     ## Only generate the tiles if date range is populated
     if d is not None and len(d) == 2:
         start_date, end_date = d
         if start_date is not None:
-            data_date_filtered = filter_data(start=start_date, end=end_date, data_ref=billing_data)
-            fully_filtered_data = setting_filters(data=data_date_filtered)
+            if sql_backend:
+                fully_filtered_data = sql_setting_filters(source, start_date, end_date)
+            else:
+                data_date_filtered = filter_data(start=start_date, end=end_date, data_ref=billing_data)
+                fully_filtered_data = setting_filters(data=data_date_filtered)
 
-    return fully_filtered_data
\ No newline at end of file
+            ## Export the line items behind the report as they are currently filtered
+            with st.expander("Export filtered line items"):
+                download_buttons(fully_filtered_data, 'filtered_line_items', 'export_line_items')
+
+    return fully_filtered_data
@@ -0,0 +1,190 @@
+import os
+import sys
+import atexit
+import types
+import threading
+from contextlib import contextmanager
+import numpy as np
+import pandas as pd
+from functions import versions
+
+## Sharded execution of per-customer and per-subscription aggregations for very large datasets.
+## A loaded dataset is partitioned by a hash of customer_id into shared-memory shards (Arrow IPC) once per dataset
+## version and column set, and the shards stay in shared memory until that version is no longer loaded. Every shard
+## has a worker process of its own, which decodes it once and keeps the frame. An aggregation sends each worker the
+## positions of the input's rows in its shard, the workers aggregate those rows and the partial results are
+## concatenated. Every customer lands in exactly one shard, and so does every subscription (a subscription belongs to
+## a single customer), so per-customer and per-subscription results from different shards never overlap and merge by
+## concatenation. Inputs that are not rows of a loaded dataset (e.g. the rows of the DuckDB backend) are aggregated
+## in-process.
+
+## Sharding kicks in at this many rows (BILLING_SHARD_ROWS) with BILLING_SHARD_WORKERS processes (defaults to the core count).
+shard_row_threshold = int(os.environ.get('BILLING_SHARD_ROWS', 20_000_000))
+
+_workers = []
+_workers_lock = threading.Lock()
+_shard_sets = {}
+_shard_sets_lock = threading.Lock()
+
+# Shard frames decoded by a worker process, by shared memory name
+_frames = {}
+
+
+def shard_workers():
+    return max(1, int(os.environ.get('BILLING_SHARD_WORKERS', os.cpu_count() or 1)))
+
+def sharding_enabled(data):
+    return len(data) >= shard_row_threshold and shard_workers() > 1
+
+@contextmanager
+def _plain_main():
+    # Streamlit runs each page as sys.modules['__main__'], and spawned children re-import the main module.
+    # Hiding it while the workers start keeps them from re-running the page script.
+    main = sys.modules['__main__']
+    sys.modules['__main__'] = types.ModuleType('__main__')
+    try:
+        yield
+    finally:
+        sys.modules['__main__'] = main
+
+def _shard_workers():
+    # One single-process executor per shard, shared by all sessions, so that a shard's frame stays decoded in one
+    # process. The processes start up front, so the page module only has to be hidden once; forkserver keeps worker
+    # start-up away from the server's threads.
+    import multiprocessing
+    from concurrent.futures import ProcessPoolExecutor
+
+    with _workers_lock:
+        if not _workers:
+            method = 'forkserver' if 'forkserver' in multiprocessing.get_all_start_methods() else 'spawn'
+            context = multiprocessing.get_context(method)
+            with _plain_main():
+                for _ in range(shard_workers()):
+                    worker = ProcessPoolExecutor(max_workers=1, mp_context=context)
+                    worker.submit(os.getpid).result()
+                    _workers.append(worker)
+            atexit.register(_shutdown)
+        return _workers
+
+def _shutdown():
+    with _shard_sets_lock:
+        for shard_set in _shard_sets.values():
+            for segment, _ in shard_set['segments']:
+                segment.close()
+                segment.unlink()
+        _shard_sets.clear()
+    for worker in _workers:
+        worker.shutdown(wait=False, cancel_futures=True)
+
+def shard_codes(customer_ids, n_shards):
+    return (pd.util.hash_pandas_object(customer_ids, index=False).to_numpy() % n_shards).astype(np.int64)
+
+def partition(data, n_shards):
+    ## (shard of every row, position of every row in its shard, row order of the shards). A stable sort on the shard
+    ## code keeps the original row order inside each shard, so 'first'/'last' aggregations see rows in the same order
+    ## as on the unsharded frame.
+    codes = shard_codes(data['customer_id'], n_shards)
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(n_shards + 1))
+    positions = np.empty(len(data), dtype=np.int64)
+    positions[order] = np.arange(len(data)) - bounds[codes[order]]
+    return codes, positions, [order[bounds[i]:bounds[i + 1]] for i in range(n_shards)]
+
+def _write_shard(frame):
+    import pyarrow as pa
+    from multiprocessing import shared_memory
+
+    table = pa.Table.from_pandas(frame, preserve_index=False)
+    sizer = pa.MockOutputStream()
+    with pa.ipc.new_stream(sizer, table.schema) as writer:
+        writer.write_table(table)
+    size = sizer.size()
+
+    segment = shared_memory.SharedMemory(create=True, size=max(size, 1))
+    with pa.ipc.new_stream(pa.FixedSizeBufferWriter(pa.py_buffer(segment.buf)), table.schema) as writer:
+        writer.write_table(table)
+    return segment, size
+
+def _attach(name):
+    # Workers only read the segment; the parent owns and unlinks it. Pool workers share the parent's resource
+    # tracker, so attaching never hands ownership to the child.
+    from multiprocessing import shared_memory
+
+    try:
+        return shared_memory.SharedMemory(name=name, track=False)
+    except TypeError:
+        return shared_memory.SharedMemory(name=name)
+
+def _shard_frame(name, size):
+    # The decoded frame of a shard, kept by the worker (with the segment it reads from) until it is released
+    import pyarrow as pa
+
+    if name not in _frames:
+        segment = _attach(name)
+        view = segment.buf[:size]
+        _frames[name] = (segment, view, pa.ipc.open_stream(pa.py_buffer(view)).read_all().to_pandas())
+    return _frames[name][2]
+
+def _release_shard(name):
+    segment, view, frame = _frames.pop(name, (None, None, None))
+    if segment is not None:
+        del frame
+        try:
+            view.release()
+            segment.close()
+        except BufferError:
+            # Arrow still holds a buffer of the segment; the mapping goes when it is collected
+            pass
+
+def _aggregate_shard(func, name, size, rows):
+    return func(_shard_frame(name, size).take(rows))
+
+def _live_datasets():
+    return {key for key, step, _ in versions.live_frames() if step == 'dataset'}
+
+def _free(shard_set, workers):
+    for worker, (segment, _) in zip(workers, shard_set['segments']):
+        worker.submit(_release_shard, segment.name)
+        segment.close()
+        segment.unlink()
+
+def shard_set(dataset, columns):
+    ## The shards of dataset[columns] (the prepared rows, as the metrics see them), written once per dataset version
+    ## and column set. Shards of versions that are no longer loaded are freed.
+    from functions.metrics import prepare
+
+    workers = _shard_workers()
+    key = (versions.key_of(dataset), tuple(columns))
+    with _shard_sets_lock:
+        live = _live_datasets()
+        for stale in [stale for stale in _shard_sets if stale[0] not in live]:
+            _free(_shard_sets.pop(stale), workers)
+        if key not in _shard_sets:
+            frame = prepare(dataset)[list(columns)]
+            codes, positions, orders = partition(frame, len(workers))
+            _shard_sets[key] = {'codes': codes, 'positions': positions, 'segments': [_write_shard(frame.take(order)) for order in orders]}
+        return _shard_sets[key]
+
+def map_customer_shards(func, shards, rows):
+    # Runs func (a module-level function taking a frame) on the given rows (positions in the dataset, in order) of
+    # every shard in the shard's worker and concatenates the results.
+    workers = _shard_workers()
+    codes, positions = shards['codes'][rows], shards['positions'][rows]
+    order = np.argsort(codes, kind='stable')
+    bounds = np.searchsorted(codes[order], np.arange(len(workers) + 1))
+    partials = [
+        worker.submit(_aggregate_shard, func, segment.name, size, positions[order[bounds[i]:bounds[i + 1]]])
+        for i, (worker, (segment, size)) in enumerate(zip(workers, shards['segments'])) if bounds[i + 1] > bounds[i]
+    ]
+    return pd.concat([partial.result() for partial in partials])
+
+def by_customer(func, data, columns, source=None):
+    # func(data) computed in-process, or sharded by customer in the worker processes once the data is large enough.
+    # data is a frame derived from a loaded dataset, or rows (with their index) selected from source, which is.
+    dataset = versions.dataset_frame(data if source is None else source)
+    if dataset is None or not sharding_enabled(data):
+        return func(data)
+    rows = dataset.index.get_indexer(data.index)
+    if (rows < 0).any():
+        return func(data)
+    return map_customer_shards(func, shard_set(dataset, columns), rows)
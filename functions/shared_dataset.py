@@ -0,0 +1,94 @@
+import os
+import hashlib
+import logging
+import re
+import numpy as np
+import pandas as pd
+
+## Dataset store shared by the server processes of one (POSIX) host (BILLING_DATASET_STORE=arrow).
+## By default ('memory') every process reads the source into its own frame. In 'arrow' mode the first process to load
+## a dataset version writes it once as an uncompressed Arrow IPC file in BILLING_SHARED_DATASET_DIR, and every process
+## memory-maps that file instead of reading the source. The numeric, timestamp and string columns of the frame are
+## views of the mapped pages (strings as pandas' pyarrow-backed str dtype with NaN semantics), so the operating system
+## keeps one copy of them for all processes; only the order dates (Python date objects) and columns with missing
+## numbers are materialized per process.
+##
+## Version swap: each version has its own file, named after the source (its file name and a hash of its absolute path,
+## so sources with the same file name in different directories keep apart) and the dataset version. A new version is
+## written next to the old one and renamed into place, and the files of the source's older versions are then deleted;
+## processes still mapping an old file keep their mapping until they load the new version themselves.
+
+dataset_stores = ['memory', 'arrow']
+SHARED_DATASET_DIR = 'data/cache/datasets'
+
+logger = logging.getLogger(__name__)
+
+
+def dataset_store():
+    store = os.environ.get('BILLING_DATASET_STORE', 'memory').lower()
+    if store not in dataset_stores:
+        raise ValueError(f"Unknown BILLING_DATASET_STORE '{store}', expected one of {dataset_stores}")
+    return store
+
+def shared_dataset_dir():
+    return os.environ.get('BILLING_SHARED_DATASET_DIR', SHARED_DATASET_DIR)
+
+def source_name(path):
+    name = os.path.splitext(os.path.basename(path))[0]
+    return f"{name}-{hashlib.sha1(os.path.abspath(path).encode()).hexdigest()[:16]}"
+
+def arrow_path(path, version):
+    return os.path.join(shared_dataset_dir(), f'{source_name(path)}-{version}.arrow')
+
+def write_arrow(data, target):
+    import pyarrow as pa
+
+    table = pa.Table.from_pandas(data, preserve_index=False)
+    temporary = f'{target}.{os.getpid()}.tmp'
+    with pa.OSFile(temporary, 'wb') as sink:
+        with pa.ipc.new_file(sink, table.schema) as writer:
+            writer.write_table(table)
+    os.replace(temporary, target)
+
+def map_arrow(target):
+    import pyarrow as pa
+
+    table = pa.ipc.open_file(pa.memory_map(target, 'r')).read_all()
+    strings = pd.StringDtype('pyarrow', na_value=np.nan)
+    return table.to_pandas(
+        types_mapper=lambda arrow_type: strings if arrow_type in (pa.string(), pa.large_string()) else None,
+        split_blocks=True,
+    )
+
+def _writer_lock(target):
+    # Only one process per host writes a version; the others wait for it and then map its file
+    import fcntl
+
+    lock = open(f'{target}.lock', 'w')
+    fcntl.flock(lock, fcntl.LOCK_EX)
+    return lock
+
+def remove_stale(path, current):
+    # The files of the source's other versions
+    versions = re.compile(rf'{re.escape(source_name(path))}-[0-9a-f]+\.arrow')
+    for name in os.listdir(shared_dataset_dir()):
+        stale = os.path.join(shared_dataset_dir(), name)
+        if versions.fullmatch(name) and stale != current:
+            for stale_file in [stale, f'{stale}.lock']:
+                try:
+                    os.remove(stale_file)
+                except FileNotFoundError:
+                    pass
+
+def load(path, version, read_source):
+    ## The dataset version at path as a frame over the shared Arrow file, written from read_source(path) if no
+    ## process has written it yet.
+    target = arrow_path(path, version)
+    if not os.path.exists(target):
+        os.makedirs(shared_dataset_dir(), exist_ok=True)
+        with _writer_lock(target):
+            if not os.path.exists(target):
+                write_arrow(read_source(path), target)
+                logger.info("Wrote shared dataset %s", target)
+                remove_stale(path, target)
+    return map_arrow(target)
@@ -0,0 +1,119 @@
+import os
+import numpy as np
+import pandas as pd
+
+## HyperLogLog sketches for approximate distinct counts (BILLING_DISTINCT_COUNTS=approximate).
+## A sketch is a row of 2^p one-byte registers (p = BILLING_HLL_PRECISION, 14 by default: 16 KiB per sketch). Values
+## are hashed to 64 bits once; the first p bits pick a register, which keeps the longest run of leading zeros seen in
+## the remaining bits. The sketch of a union of groups is the register-wise maximum of their sketches, so the metrics
+## store sketches per dataset version and (order month, dimension value) and take the counts of a date range and a
+## selection from unions of those instead of from the rows. Stored sketches are sparse: the non-empty registers of a
+## cell, at most one per distinct value (and 2^p), so the many small cells of month x dimension take little memory.
+##
+## Error bound: the relative standard error of an estimate is 1.04 / sqrt(2^p), 0.81% at p=14 (1.63% at p=12, 0.41%
+## at p=16); about 99.7% of estimates are within three times that. Small cardinalities (below 2.5 * 2^p) are
+## counted by linear counting over the empty registers and are close to exact. Inputs below BILLING_APPROX_DISTINCT_ROWS
+## rows are always counted exactly, as is everything in the default exact mode and with the DuckDB backend (whose
+## count(DISTINCT) is a parallel hash aggregate already, while its approx_count_distinct is far less precise).
+##
+## Hashing the identifier strings costs more than an exact count, so in approximate mode the loader stores the hashes
+## of hashed_columns alongside the data (as <column>_hash) once per dataset version.
+
+distinct_count_modes = ['exact', 'approximate']
+precision = int(os.environ.get('BILLING_HLL_PRECISION', 14))
+approximate_min_rows = int(os.environ.get('BILLING_APPROX_DISTINCT_ROWS', 1_000_000))
+
+hashed_columns = ['header_id', 'customer_id']
+
+registers = 1 << precision
+relative_error = 1.04 / np.sqrt(registers)
+
+
+def distinct_count_mode():
+    mode = os.environ.get('BILLING_DISTINCT_COUNTS', 'exact').lower()
+    if mode not in distinct_count_modes:
+        raise ValueError(f"Unknown BILLING_DISTINCT_COUNTS '{mode}', expected one of {distinct_count_modes}")
+    return mode
+
+def settings():
+    # Everything an approximate count depends on, for cache keys
+    return distinct_count_mode(), precision, approximate_min_rows
+
+def approximate(data):
+    # Whether distinct counts over this frame are estimated
+    return distinct_count_mode() == 'approximate' and isinstance(data, pd.DataFrame) and len(data) >= approximate_min_rows
+
+def hash_column(column):
+    return f'{column}_hash'
+
+def hash_values(values):
+    # 64-bit hashes of a column; missing values hash to 0 and are left out of the sketches.
+    hashes = pd.util.hash_pandas_object(values, index=False).to_numpy()
+    return np.where(values.notna().to_numpy(), hashes, np.uint64(0))
+
+def add_hashes(data):
+    if distinct_count_mode() == 'approximate':
+        for column in hashed_columns:
+            data[hash_column(column)] = hash_values(data[column])
+    return data
+
+def column_hashes(data, column):
+    stored = hash_column(column)
+    return data[stored].to_numpy() if stored in data.columns else hash_values(data[column])
+
+def _registers(hashes):
+    # Register of every hash and the rank it sets: the position of the first 1-bit in the remaining 64 - p bits
+    # (frexp gives the bit length of the remainder)
+    index = (hashes >> np.uint64(64 - precision)).astype(np.int64)
+    rest = hashes & np.uint64((1 << (64 - precision)) - 1)
+    _, bit_length = np.frexp(rest.astype(np.float64))
+    return index, (64 - precision - bit_length + 1).astype(np.uint8)
+
+def _register_maxima(hashes, groups):
+    # (group * 2^p + register, highest rank) of every non-empty register of every group, sorted; rows with a negative
+    # group (or a zero hash) are skipped
+    hashes = np.asarray(hashes, dtype=np.uint64)
+    groups = np.asarray(groups, dtype=np.int64)
+    keep = (hashes != 0) & (groups >= 0)
+    index, rank = _registers(hashes[keep])
+    cells = pd.Series(rank).groupby(groups[keep] * registers + index).max()
+    return cells.index.to_numpy(), cells.to_numpy()
+
+def sketch(hashes, groups=None, n_groups=1):
+    ## Sketches of the hashed values per group: a (n_groups, 2^p) uint8 array. groups are integer codes in
+    ## [0, n_groups); rows with a negative code (or a zero hash) are skipped.
+    groups = np.zeros(len(hashes), dtype=np.int64) if groups is None else groups
+    cells, ranks = _register_maxima(hashes, groups)
+    result = np.zeros((n_groups, registers), dtype=np.uint8)
+    result.reshape(-1)[cells] = ranks
+    return result
+
+def sparse_sketch(hashes, cells):
+    ## Sparse sketches of the hashed values per cell (integer codes, negative to skip a row): the (cell * 2^p + register)
+    ## and rank of every non-empty register, the form the metrics store per dataset version.
+    return _register_maxima(hashes, cells)
+
+def densify(sparse, groups, n_groups):
+    ## Dense sketches (n_groups, 2^p) of the unions of sparse cell sketches: groups maps every cell to a group in
+    ## [0, n_groups), or to a negative code to leave the cell out.
+    entries, ranks = sparse
+    entry_groups = np.asarray(groups, dtype=np.int64)[entries // registers]
+    keep = entry_groups >= 0
+    result = np.zeros((n_groups, registers), dtype=np.uint8)
+    np.maximum.at(result.reshape(-1), entry_groups[keep] * registers + entries[keep] % registers, ranks[keep])
+    return result
+
+def merge(sketches):
+    # Sketch of the union of the given sketches (rows of a 2D array)
+    return np.asarray(sketches).max(axis=0, initial=0)
+
+def estimate(sketches):
+    ## Estimated distinct count of every sketch in a 2D array, or of a single sketch.
+    sketches = np.asarray(sketches)
+    rows = np.atleast_2d(sketches)
+    alpha = 0.7213 / (1 + 1.079 / registers)
+    raw = alpha * registers ** 2 / np.ldexp(1.0, -rows.astype(np.int64)).sum(axis=1)
+    zeros = (rows == 0).sum(axis=1)
+    linear = registers * np.log(registers / np.maximum(zeros, 1))
+    counts = np.rint(np.where((raw <= 2.5 * registers) & (zeros > 0), linear, raw)).astype(np.int64)
+    return counts if sketches.ndim > 1 else int(counts[0])
@@ -0,0 +1,262 @@
+import pandas as pd
+import streamlit as st
+from functions import metrics
+from functions.backend import run
+from functions.intervals import build_index
+from functions.metrics import default_granularity, percentage_change, percentage_change_or_new, retention_periods, cohort_matrix, classify_movements, ledger_window, reporting_months
+
+## SQL versions of the metrics in functions/metrics.py for the DuckDB backend. Each takes a functions.backend.Relation
+## (whose rows are exposed as the `filtered` CTE) and returns the same dict or frame as the pandas version.
+## pandas skips missing values in sums and groupings, so sums are coalesced to 0 and rows with a missing group key
+## are dropped.
+
+## Monthly recurring revenue of a line item, as in metrics.with_mrr (Timedelta.days floors to whole days).
+mrr_sql = "total_amount / (floor(epoch(subscription_period_ended_at - subscription_period_started_at) / 86400) / 30)"
+
+## date_trunc parts of the metrics.granularities (DuckDB weeks start on Monday, like pandas weekly periods).
+granularity_parts = {'Day': 'day', 'Week': 'week', 'Month': 'month', 'Quarter': 'quarter'}
+
+def _timestamp(value):
+    return pd.Timestamp(value) if not pd.isna(value) else pd.NaT
+
+def date_range(data):
+    bounds = data.query("SELECT min(created_at) AS min_created_at, max(created_at) AS max_created_at FROM filtered")
+    return _timestamp(bounds['min_created_at'][0]), _timestamp(bounds['max_created_at'][0])
+
+def subscription_intervals(data):
+    periods = data.query("""
+        SELECT DISTINCT subscription_id, subscription_period_started_at, subscription_period_ended_at
+        FROM filtered WHERE subscription_id IS NOT NULL
+    """)
+    return build_index(periods['subscription_id'], periods['subscription_period_started_at'], periods['subscription_period_ended_at'])
+
+
+## Orders and revenue
+
+def order_kpis(data):
+    kpis = data.query("""
+        , years AS (SELECT max(year(created_at)) AS current_year, min(created_at) AS min_created_at, max(created_at) AS max_created_at FROM filtered)
+        SELECT
+            any_value(current_year) AS current_year,
+            any_value(min_created_at) AS min_created_at,
+            any_value(max_created_at) AS max_created_at,
+            coalesce(sum(total_amount), 0) AS total_revenue,
+            count(DISTINCT header_id) AS number_of_orders,
+            count(DISTINCT customer_id) AS number_of_customers,
+            count(*) FILTER (WHERE customer_created_at BETWEEN min_created_at AND max_created_at) AS new_customers,
+            coalesce(sum(total_amount) FILTER (WHERE year(created_at) = current_year), 0) AS current_revenue,
+            coalesce(sum(total_amount) FILTER (WHERE year(created_at) = current_year - 1), 0) AS previous_revenue,
+            count(DISTINCT header_id) FILTER (WHERE year(created_at) = current_year) AS current_orders,
+            count(DISTINCT header_id) FILTER (WHERE year(created_at) = current_year - 1) AS previous_orders,
+            count(DISTINCT customer_id) FILTER (WHERE year(created_at) = current_year) AS current_customers,
+            count(DISTINCT customer_id) FILTER (WHERE year(created_at) = current_year - 1) AS previous_customers,
+            count(*) FILTER (WHERE year(customer_created_at) = current_year) AS current_new_customers,
+            count(*) FILTER (WHERE year(customer_created_at) = current_year - 1) AS previous_new_customers
+        FROM filtered CROSS JOIN years
+    """).iloc[0]
+
+    return {
+        'current_year': kpis['current_year'],
+        'min_created_at': _timestamp(kpis['min_created_at']),
+        'max_created_at': _timestamp(kpis['max_created_at']),
+        'total_revenue': kpis['total_revenue'],
+        'number_of_orders': int(kpis['number_of_orders']),
+        'number_of_customers': int(kpis['number_of_customers']),
+        'new_customers': int(kpis['new_customers']),
+        'total_revenue_yoy': percentage_change(kpis['current_revenue'], kpis['previous_revenue']),
+        'number_of_orders_yoy': percentage_change(int(kpis['current_orders']), int(kpis['previous_orders'])),
+        'number_of_customers_yoy': percentage_change(int(kpis['current_customers']), int(kpis['previous_customers'])),
+        'new_customers_yoy': percentage_change(int(kpis['current_new_customers']), int(kpis['previous_new_customers'])),
+    }
+
+def revenue_and_orders_over_time(data, granularity=default_granularity):
+    return data.query(f"""
+        SELECT date_trunc('{granularity_parts[granularity]}', created_at) AS month, coalesce(sum(total_amount), 0) AS total_amount, count(DISTINCT header_id) AS header_id
+        FROM filtered WHERE created_at IS NOT NULL
+        GROUP BY month ORDER BY month
+    """)
+
+def revenue_by_product(data):
+    return data.query("""
+        SELECT product_name, coalesce(sum(total_amount), 0) AS total_amount
+        FROM filtered WHERE product_name IS NOT NULL
+        GROUP BY product_name ORDER BY total_amount DESC, product_name
+    """)
+
+def new_customers_over_time(data, granularity=default_granularity):
+    return data.query(f"""
+        , bounds AS (SELECT min(created_at) AS min_created_at, max(created_at) AS max_created_at FROM filtered)
+        SELECT date_trunc('{granularity_parts[granularity]}', customer_created_at) AS customer_created_month, count(DISTINCT customer_id) AS customer_id
+        FROM filtered CROSS JOIN bounds
+        WHERE customer_created_at BETWEEN min_created_at AND max_created_at
+        GROUP BY customer_created_month ORDER BY customer_created_month
+    """)
+
+def revenue_by_country(data):
+    return data.query("""
+        SELECT customer_country, coalesce(sum(total_amount), 0) AS total_amount
+        FROM filtered WHERE customer_country IS NOT NULL
+        GROUP BY customer_country ORDER BY total_amount DESC, customer_country
+    """)
+
+def customer_table(data):
+    # One row per customer, in order of their first line item in the input, as metrics.customer_table: the facts of
+    # the input and the attributes of the customer's first line item in the whole source (the customer dimension).
+    return data.query("""
+        , facts AS (
+            SELECT customer_id,
+                min(file_row_number) AS first_row,
+                coalesce(sum(total_amount), 0) AS total_amount,
+                count(DISTINCT header_id) AS total_orders,
+                coalesce(sum(refund_amount), 0) AS refund_amount,
+                coalesce(sum(discount_amount), 0) AS discount_amount,
+                max(created_at) AS created_at
+            FROM filtered WHERE customer_id IS NOT NULL GROUP BY customer_id
+        ),
+        customers AS (
+            SELECT customer_id,
+                arg_min_null(customer_name, file_row_number) AS customer_name,
+                arg_min_null(customer_email, file_row_number) AS customer_email,
+                arg_min_null(customer_city, file_row_number) AS customer_city,
+                arg_min_null(customer_country, file_row_number) AS customer_country,
+                arg_min_null(customer_created_at, file_row_number) AS customer_created_at
+            FROM read_parquet(?, file_row_number = true)
+            WHERE customer_id IN (SELECT customer_id FROM facts)
+            GROUP BY customer_id
+        )
+        SELECT
+            customer_id AS "ID",
+            customer_name AS "Name",
+            customer_email AS "Email",
+            customer_city AS "City",
+            customer_country AS "Country",
+            total_amount AS "Total Spend",
+            total_orders,
+            refund_amount AS "Total Refunds",
+            discount_amount AS "Total Discounts",
+            created_at AS "Last Order Date",
+            customer_created_at AS "Created Date"
+        FROM facts JOIN customers USING (customer_id)
+        ORDER BY first_row
+    """, [data.path])
+
+
+## Churn and retention
+
+def retention_rate(data, period_start, period_end):
+    counts = data.query("""
+        SELECT
+            count(DISTINCT customer_id) AS customers_at_start,
+            count(DISTINCT customer_id) FILTER (WHERE subscription_status = 'active' AND created_at <= CAST(? AS TIMESTAMP)) AS customers_retained
+        FROM filtered WHERE customer_created_at <= CAST(? AS TIMESTAMP)
+    """, [period_end, period_start]).iloc[0]
+    customers_at_start = int(counts['customers_at_start'])
+    return (int(counts['customers_retained']) / customers_at_start) * 100 if customers_at_start > 0 else 0
+
+def retention_kpis(data):
+    month = data.query("SELECT max(date_trunc('month', created_at)) AS month FROM filtered")['month'][0]
+    kpis = {}
+    for name, (current, previous) in retention_periods(pd.Timestamp(month)).items():
+        rate = retention_rate(data, *(value.to_pydatetime() for value in current))
+        kpis[f'retention_{name}'] = rate
+        kpis[f'retention_{name}_yoy'] = percentage_change_or_new(rate, retention_rate(data, *(value.to_pydatetime() for value in previous)))
+    return kpis
+
+def _inactive_customer_share(keys, key_columns):
+    return f"""
+        SELECT {keys}, count(DISTINCT customer_id) FILTER (WHERE subscription_status = 'inactive') / count(DISTINCT customer_id) AS share
+        FROM filtered
+        WHERE subscription_id IS NOT NULL AND {' AND '.join(f'{column} IS NOT NULL' for column in key_columns)}
+        GROUP BY ALL ORDER BY ALL
+    """
+
+def churn_rate_by_month(data):
+    churn_rate = data.query(_inactive_customer_share("date_trunc('month', created_at) AS month", ['created_at']))
+    churn_rate.columns = ['Month', 'Overall Churn Rate']
+    return churn_rate
+
+def churn_rate_by_plan(data):
+    churn_rate = data.query(_inactive_customer_share("subscription_plan, date_trunc('month', created_at) AS month", ['subscription_plan', 'created_at']))
+    churn_rate.columns = ['Subscription Plan', 'Month', 'Churn Rate']
+    return churn_rate
+
+@st.cache_resource(show_spinner=False, max_entries=4)
+def _source_ledger(path, token):
+    # Monthly MRR per subscription over the whole source, as in metrics.monthly_subscription_mrr; the movements are
+    # classified in pandas on the (much smaller) subscription-month frame.
+    monthly = run(f"""
+        WITH sales AS (
+            SELECT subscription_id, product_type, subscription_plan, file_row_number, {mrr_sql} AS mrr,
+                year(subscription_period_started_at) * 12 + month(subscription_period_started_at) AS first_month,
+                year(subscription_period_ended_at) * 12 + month(subscription_period_ended_at) - 1 AS last_month
+            FROM read_parquet(?, file_row_number = true)
+            WHERE subscription_id IS NOT NULL AND billing_type IN ('subscription', 'recurring') AND transaction_type = 'sale'
+        ),
+        covered AS (
+            SELECT subscription_id, unnest(range(first_month, greatest(last_month, first_month) + 1)) AS month, mrr
+            FROM sales WHERE isfinite(mrr)
+        ),
+        attributes AS (
+            SELECT subscription_id,
+                arg_min(product_type, file_row_number) FILTER (WHERE product_type IS NOT NULL) AS product_type,
+                arg_min(subscription_plan, file_row_number) FILTER (WHERE subscription_plan IS NOT NULL) AS subscription_plan
+            FROM sales WHERE isfinite(mrr) GROUP BY subscription_id
+        )
+        SELECT subscription_id, month, sum(mrr) AS mrr, any_value(product_type) AS product_type, any_value(subscription_plan) AS subscription_plan
+        FROM covered JOIN attributes USING (subscription_id)
+        GROUP BY subscription_id, month ORDER BY subscription_id, month
+    """, [path])
+    return classify_movements(monthly)
+
+@st.cache_resource(show_spinner=False, max_entries=8)
+def _ledger_view(fingerprint, _data):
+    ledger = _source_ledger(_data.path, _data.token)
+    selected = None
+    if _data.selections:
+        subscriptions = _data.history_query("SELECT DISTINCT subscription_id FROM selected WHERE subscription_id IS NOT NULL")
+        selected = ledger['subscription_id'].isin(subscriptions['subscription_id']).to_numpy()
+    return ledger_window(ledger, reporting_months(_data), selected)
+
+def mrr_ledger(data):
+    # The ledger over the whole source with the subscriptions selected by the filters, as metrics.mrr_ledger
+    return _ledger_view(data.fingerprint, data)
+
+def cohort_churn(data, start_date, end_date):
+    # First customer creation and start date and last status of every subscription (pandas 'first'/'last' skip missing values)
+    params = [start_date, end_date]
+    subscribed = """
+        , subscribed AS (
+            SELECT * FROM filtered
+            WHERE subscription_id IS NOT NULL
+                AND subscription_period_started_at >= CAST(? AS TIMESTAMP) AND subscription_period_started_at <= CAST(? AS TIMESTAMP)
+        )
+    """
+    cohort = data.query(subscribed + """
+        SELECT subscription_id,
+            arg_min(customer_created_at, file_row_number) FILTER (WHERE customer_created_at IS NOT NULL) AS customer_created_at,
+            arg_min(subscription_period_started_at, file_row_number) AS subscription_period_started_at,
+            arg_max(subscription_status, file_row_number) FILTER (WHERE subscription_status IS NOT NULL) AS subscription_status
+        FROM subscribed GROUP BY subscription_id ORDER BY subscription_id
+    """, params)
+    return cohort_matrix(cohort)
+
+
+sql_versions = {
+    'date_range': date_range,
+    'subscription_intervals': subscription_intervals,
+    'order_kpis': order_kpis,
+    'revenue_and_orders_over_time': revenue_and_orders_over_time,
+    'revenue_by_product': revenue_by_product,
+    'new_customers_over_time': new_customers_over_time,
+    'revenue_by_country': revenue_by_country,
+    'customer_table': customer_table,
+    'retention_rate': retention_rate,
+    'retention_kpis': retention_kpis,
+    'churn_rate_by_month': churn_rate_by_month,
+    'churn_rate_by_plan': churn_rate_by_plan,
+    'cohort_churn': cohort_churn,
+}
+
+## Metrics computed only from other metrics run unchanged on a relation.
+for name in ['mrr_kpis', 'new_mrr_by_product_type', 'mrr_movements_by_month', 'active_subscriptions_over_time']:
+    sql_versions[name] = getattr(metrics, name).uncached
@@ -0,0 +1,97 @@
+import os
+import hashlib
+import threading
+import weakref
+from functions import currency, sketches
+
+## Dataset version tokens.
+## A dataset version is a content fingerprint of the source file, the FX rate table, the reporting currency and the
+## distinct count mode (which decides the stored identifier hashes). A file is only re-hashed when its size or
+## modification time changes, so probing the version on every request costs a stat call; touching a file without
+## changing it keeps its version.
+##
+## Frames derived from a loaded dataset carry a version key: the dataset version plus every step that produced them
+## (date range, segments, filter selections, ...). The metric, option catalog and disk caches key on it instead of
+## hashing the frame's content, and a new dataset version gives every derived frame a new key, so all caches
+## invalidate together. Frames without a key (built outside the page flow) fall back to content hashing.
+
+_file_hashes = {}
+_keys = {}
+_lock = threading.Lock()
+
+hash_block_bytes = 1 << 20
+
+
+def file_fingerprint(path):
+    path = os.path.abspath(path)
+    stat = os.stat(path)
+    stamp = (stat.st_mtime_ns, stat.st_size)
+    with _lock:
+        cached = _file_hashes.get(path)
+    if cached is not None and cached[0] == stamp:
+        return cached[1]
+
+    hasher = hashlib.blake2b(digest_size=20)
+    with open(path, 'rb') as f:
+        for block in iter(lambda: f.read(hash_block_bytes), b''):
+            hasher.update(block)
+    digest = hasher.hexdigest()
+    with _lock:
+        _file_hashes[path] = (stamp, digest)
+    return digest
+
+def dataset_version(path):
+    rates_path = currency.fx_rates_path()
+    rates = file_fingerprint(rates_path) if os.path.exists(rates_path) else None
+    parts = (os.path.abspath(path), file_fingerprint(path), currency.reporting_currency(), rates, sketches.distinct_count_mode())
+    return hashlib.sha1(repr(parts).encode()).hexdigest()
+
+def tag(frame, key, step='dataset', dataset=None, lineage=()):
+    # Records the version key of a frame, the step that produced it, the version of the dataset it comes from and
+    # every step from that dataset to the frame, for as long as the frame is alive
+    ident = id(frame)
+    with _lock:
+        _keys[ident] = (weakref.ref(frame, lambda _, ident=ident: _keys.pop(ident, None)), key, step, dataset or key, lineage)
+    return frame
+
+def _entry(frame):
+    with _lock:
+        entry = _keys.get(id(frame))
+    return entry if entry is not None and entry[0]() is frame else None
+
+def key_of(frame):
+    entry = _entry(frame)
+    return entry[1] if entry is not None else None
+
+def dataset_of(frame):
+    # Version of the loaded dataset a frame was derived from
+    entry = _entry(frame)
+    return entry[3] if entry is not None else None
+
+def lineage(frame):
+    # The steps (with their arguments) that derived a frame from its loaded dataset, e.g. (('dates', start, end), ...)
+    entry = _entry(frame)
+    return entry[4] if entry is not None else ()
+
+def dataset_frame(frame):
+    # The loaded dataset a frame was derived from, or None when it is not loaded anymore (or the frame is untagged)
+    dataset = dataset_of(frame)
+    if dataset is None:
+        return None
+    return next((candidate for key, step, candidate in live_frames() if step == 'dataset' and key == dataset), None)
+
+def derive(frame, parent, *step):
+    ## Tags frame, computed from parent by step (hashable, with a stable repr), with a key of its own. Frames of
+    ## untagged parents stay untagged.
+    parent_entry = _entry(parent)
+    if parent_entry is None or frame is parent:
+        return frame
+    key = hashlib.sha1(repr((parent_entry[1], step)).encode()).hexdigest()
+    return tag(frame, key, step[0], parent_entry[3], parent_entry[4] + (step,))
+
+def live_frames():
+    # (key, step, frame) of every tagged frame still alive: the loaded datasets and the frames derived from them that
+    # sessions and caches hold on to
+    with _lock:
+        entries = list(_keys.values())
+    return [(key, step, frame) for ref, key, step, *_ in entries if (frame := ref()) is not None]
@@ -2,12 +2,11 @@
 
 import streamlit as st
 import pandas as pd
-import numpy as np
-import plotly.express as px
-import plotly.graph_objects as go
-from datetime import datetime
 from functions.setup_page import page_creation
-from plotly.subplots import make_subplots
+from functions.filters import granularity_input
+from functions import metrics
+from functions.progressive import page_results
+from functions.exports import download_buttons
 
 ## Apply standard page settings.
 st.set_page_config(
@@ -20,52 +19,28 @@ st.title('Orders and Revenue')
 ## Define data and filters. The resulting data variable includes the data with all filters applied.
 data = page_creation()
 
-## Ensure all date columns are in datetime format
-date_columns = ['created_at', 'customer_created_at', 'payment_at', 'subscription_period_started_at', 'subscription_period_ended_at']
-for col in date_columns:
-    if col in data.columns:
-        data[col] = pd.to_datetime(data[col], errors='coerce')
-
-st.divider()
-
-# Calculate KPIs
-data['month'] = data['created_at'].dt.to_period('M').dt.to_timestamp()
-data['quarter'] = data['created_at'].dt.to_period('Q').dt.to_timestamp()
+data = metrics.prepare(data)
 
-current_year = data['created_at'].dt.year.max()
-previous_year = current_year - 1
-
-total_revenue = data['total_amount'].sum()
-number_of_orders = data['header_id'].nunique()
-number_of_customers = data['customer_id'].nunique()
-min_created_at = data['created_at'].min()
-max_created_at = data['created_at'].max()
-new_customers = data[(data['customer_created_at'] >= min_created_at) & (data['customer_created_at'] <= max_created_at)].shape[0]
-
-# Helper function to calculate percentage change
-def percentage_change(current, previous):
-    return ((current - previous) / previous * 100) if previous != 0 else float('inf')
-
-# Calculate percentage changes for YoY
-total_revenue_yoy = percentage_change(
-    data[data['created_at'].dt.year == current_year]['total_amount'].sum(),
-    data[data['created_at'].dt.year == previous_year]['total_amount'].sum()
-)
-
-number_of_orders_yoy = percentage_change(
-    data[data['created_at'].dt.year == current_year]['header_id'].nunique(),
-    data[data['created_at'].dt.year == previous_year]['header_id'].nunique()
-)
+## Time granularity of the charts over time
+granularity = granularity_input(*metrics.date_range(data))
+period_tickformat = '%b %Y' if granularity in ('Month', 'Quarter') else '%b %d, %Y'
 
-number_of_customers_yoy = percentage_change(
-    data[data['created_at'].dt.year == current_year]['customer_id'].nunique(),
-    data[data['created_at'].dt.year == previous_year]['customer_id'].nunique()
-)
+st.divider()
 
-new_customers_yoy = percentage_change(
-    data[data['customer_created_at'].dt.year == current_year].shape[0],
-    data[data['customer_created_at'].dt.year == previous_year].shape[0]
-)
+# Calculate KPIs and chart data. The computations are independent, so they run concurrently.
+results = page_results('orders_and_revenue', data, granularity=granularity)
+
+kpis = results['kpis']
+total_revenue = kpis['total_revenue']
+number_of_orders = kpis['number_of_orders']
+number_of_customers = kpis['number_of_customers']
+new_customers = kpis['new_customers']
+total_revenue_yoy = kpis['total_revenue_yoy']
+number_of_orders_yoy = kpis['number_of_orders_yoy']
+number_of_customers_yoy = kpis['number_of_customers_yoy']
+new_customers_yoy = kpis['new_customers_yoy']
+min_created_at = kpis['min_created_at']
+max_created_at = kpis['max_created_at']
 
 # KPI Metrics
 with st.container():
@@ -88,19 +63,16 @@ with st.container():
                   delta=f"{new_customers_yoy:.1f}% YoY")
         
 
-# Time series charts
-data['month'] = data['created_at'].dt.to_period('M').dt.to_timestamp()
-
+# The chart libraries are only loaded here, after the KPIs are on screen
+import plotly.express as px
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
-import streamlit as st
 
+# Time series charts
 with st.container():
     # Revenue and Orders chart (full width)
     st.markdown("**Total Revenue and Orders Over Time**")
-    revenue_over_time = data.groupby('month')['total_amount'].sum().reset_index()
-    orders_over_time = data.groupby('month')['header_id'].nunique().reset_index()
-    combined_data = revenue_over_time.merge(orders_over_time, on='month')
+    combined_data = results['revenue_and_orders']
     
     fig = make_subplots(specs=[[{"secondary_y": True}]])
     
@@ -140,7 +112,7 @@ with st.container():
         height=500,  # Increase height for better visibility
     )
     
-    fig.update_xaxes(title_text="Month", tickformat='%b %Y')
+    fig.update_xaxes(title_text=granularity, tickformat=period_tickformat)
     fig.update_yaxes(
         title_text="Revenue", 
         secondary_y=False, 
@@ -182,8 +154,7 @@ with st.container():
     
 with col1:
     st.markdown("**Product By Revenue**")
-    product_revenue = data.groupby('product_name')['total_amount'].sum().reset_index()
-    product_revenue = product_revenue.sort_values(by='total_amount', ascending=False)  # Changed to descending order
+    product_revenue = results['product_revenue']
 
     # Create the figure manually with a blue gradient
     fig = go.Figure()
@@ -225,10 +196,7 @@ with col1:
         st.markdown("**New Customers Over Time**")
         
         # Apply the same date filter as used in other charts
-        filtered_data = data[(data['customer_created_at'] >= min_created_at) & (data['customer_created_at'] <= max_created_at)]
-        
-        filtered_data['customer_created_month'] = filtered_data['customer_created_at'].dt.to_period('M').dt.to_timestamp()
-        new_customers_over_time = filtered_data.groupby('customer_created_month')['customer_id'].nunique().reset_index()
+        new_customers_over_time = results['new_customers']
         
         fig = px.bar(new_customers_over_time, 
                     x='customer_created_month', 
@@ -236,7 +204,7 @@ with col1:
                     color_discrete_sequence=['#1f77b4'])  # Changed to blue
         
         fig.update_yaxes(title_text='New Customers', range=[0, new_customers_over_time['customer_id'].max() * 1.1])
-        fig.update_xaxes(title_text='Month', tickformat='%b %Y')
+        fig.update_xaxes(title_text=granularity, tickformat=period_tickformat)
         fig.update_traces(text=new_customers_over_time['customer_id'], textposition='outside')
         
         # Ensure x-axis range matches the filter
@@ -252,10 +220,7 @@ with col1:
 
 # Location Performance Chart
 # Aggregate revenue by customer_country
-location_performance = data.groupby('customer_country')['total_amount'].sum().reset_index()
-
-# Sort by total_amount in descending order
-location_performance = location_performance.sort_values(by='total_amount', ascending=False)
+location_performance = results['location_performance']
 # Format total_amount for better readability
 location_performance['total_amount_formatted'] = location_performance['total_amount'].apply(lambda x: f"${x:,.0f}")
 # Define a custom color scale that starts with darker shades of green
@@ -310,7 +275,7 @@ with col1:
     # Create a list of unique customer names for the multiselect
     name_filter = st.multiselect(
         "Filter by Customer Name",
-        options=data['customer_name'].unique(),
+        options=results['customer_table']['Name'].unique(),
         default=None
     )
 
@@ -318,51 +283,12 @@ with col2:
     # Create a list of unique customer emails for the multiselect
     email_filter = st.multiselect(
         "Filter by Customer Email",
-        options=data['customer_email'].unique(),
+        options=results['customer_table']['Email'].unique(),
         default=None
     )
 
-# Calculate Total Spend
-total_spend = data.groupby('customer_id')['total_amount'].sum().reset_index()
-
-# Calculate Total Orders
-total_orders = data.groupby('customer_id')['header_id'].nunique().reset_index()
-total_orders.rename(columns={'header_id': 'total_orders'}, inplace=True)
-
-# Calculate Total Refunds
-total_refunds = data.groupby('customer_id')['refund_amount'].sum().reset_index()
-
-# Calculate Total Discounts
-total_discounts = data.groupby('customer_id')['discount_amount'].sum().reset_index()
-
-# Calculate Last Order Date
-last_order_date = data.groupby('customer_id')['created_at'].max().reset_index()
-
-# Calculate Created Date
-created_date = data.groupby('customer_id')['customer_created_at'].min().reset_index()
-
-# Merge all the calculated fields
-filtered_customer_table = data[['customer_id', 'customer_name', 'customer_email', 'customer_city', 'customer_country']].drop_duplicates().reset_index(drop=True)
-filtered_customer_table = filtered_customer_table.merge(total_spend, on='customer_id', how='left')
-filtered_customer_table = filtered_customer_table.merge(total_orders, on='customer_id', how='left')
-filtered_customer_table = filtered_customer_table.merge(total_refunds, on='customer_id', how='left')
-filtered_customer_table = filtered_customer_table.merge(total_discounts, on='customer_id', how='left')
-filtered_customer_table = filtered_customer_table.merge(last_order_date, on='customer_id', how='left')
-filtered_customer_table = filtered_customer_table.merge(created_date, on='customer_id', how='left')
-
-# Rename columns
-filtered_customer_table.rename(columns={
-    'customer_id': 'ID',
-    'customer_name': 'Name',
-    'customer_email': 'Email',
-    'customer_city': 'City',
-    'customer_country': 'Country',
-    'total_amount': 'Total Spend',
-    'refund_amount': 'Total Refunds',
-    'discount_amount': 'Total Discounts',
-    'created_at': 'Last Order Date',
-    'customer_created_at': 'Created Date',
-}, inplace=True)
+# Calculate spend, orders, refunds, discounts, last order and created dates per customer
+filtered_customer_table = results['customer_table']
 
 # Apply filters to the customer table
 if name_filter:
@@ -371,15 +297,21 @@ if email_filter:
     filtered_customer_table = filtered_customer_table[filtered_customer_table['Email'].isin(email_filter)]
 
 
-# Format dollar columns
-filtered_customer_table['Total Spend'] = filtered_customer_table['Total Spend'].apply(lambda x: f"${x:,.2f}")
-filtered_customer_table['Total Refunds'] = filtered_customer_table['Total Refunds'].apply(lambda x: f"${x:,.2f}")
-filtered_customer_table['Total Discounts'] = filtered_customer_table['Total Discounts'].apply(lambda x: f"${x:,.2f}")
+# The export keeps the unformatted values
+customer_table_export = filtered_customer_table
 
-# Format date columns
-filtered_customer_table['Last Order Date'] = pd.to_datetime(filtered_customer_table['Last Order Date']).dt.strftime('%Y-%m-%d')
-filtered_customer_table['Created Date'] = pd.to_datetime(filtered_customer_table['Created Date']).dt.strftime('%Y-%m-%d')
+# Format dollar and date columns
+filtered_customer_table = filtered_customer_table.assign(**{
+    'Total Spend': filtered_customer_table['Total Spend'].apply(lambda x: f"${x:,.2f}"),
+    'Total Refunds': filtered_customer_table['Total Refunds'].apply(lambda x: f"${x:,.2f}"),
+    'Total Discounts': filtered_customer_table['Total Discounts'].apply(lambda x: f"${x:,.2f}"),
+    'Last Order Date': pd.to_datetime(filtered_customer_table['Last Order Date']).dt.strftime('%Y-%m-%d'),
+    'Created Date': pd.to_datetime(filtered_customer_table['Created Date']).dt.strftime('%Y-%m-%d'),
+})
 
 # Display the customer table
 st.dataframe(filtered_customer_table)
 
+# Export the customer table with the name and email filters applied
+download_buttons(customer_table_export, 'customer_table', 'export_customer_table')
+
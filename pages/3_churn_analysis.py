@@ -1,12 +1,9 @@
 import streamlit as st
-import plost
 import pandas as pd
-import numpy as np
-from datetime import datetime
 from functions.setup_page import page_creation
-import plotly.express as px
-import plotly.graph_objects as go
-from plotly.subplots import make_subplots
+from functions import metrics
+from functions.progressive import page_results
+from functions.exports import download_buttons
 
 ## Apply standard page settings.
 st.set_page_config(
@@ -22,26 +19,7 @@ data = page_creation()
 st.divider()
 
 # Data processing
-data['created_at'] = pd.to_datetime(data['created_at'])
-data['customer_created_at'] = pd.to_datetime(data['customer_created_at'])
-data['subscription_period_started_at'] = pd.to_datetime(data['subscription_period_started_at'])
-data['subscription_period_ended_at'] = pd.to_datetime(data['subscription_period_ended_at'])
-
-# Calculate MRR (Monthly Recurring Revenue)
-data['mrr'] = data['total_amount'] / ((data['subscription_period_ended_at'] - data['subscription_period_started_at']).dt.days / 30)
-
-# YoY calculations
-data['month'] = data['created_at'].dt.to_period('M').dt.to_timestamp()
-data['quarter'] = data['created_at'].dt.to_period('Q').dt.to_timestamp()
-
-current_year = data['created_at'].dt.year.max()
-previous_year = current_year - 1
-current_month = data['month'].max()
-
-def percentage_change(current, previous):
-    if previous == 0:
-        return "New" if current > 0 else 0
-    return ((current - previous) / previous) * 100
+data = metrics.prepare(data)
 
 # Helper function to format the YoY change
 def format_yoy_change(change):
@@ -49,50 +27,22 @@ def format_yoy_change(change):
         return "New (prev. year was 0)"
     else:
         return f"{change:.1f}% YoY"
-# MRR calculation
-current_mrr = data[data['subscription_status'] == 'active']['mrr'].sum()
-current_mrr_yoy = percentage_change(
-    data[(data['created_at'].dt.year == current_year) & (data['subscription_status'] == 'active')]['mrr'].sum(),
-    data[(data['created_at'].dt.year == previous_year) & (data['subscription_status'] == 'active')]['mrr'].sum()
-)
 
-# New MRR calculations
-new_mrr = data[(data['created_at'] >= current_month) & (data['billing_type'] == 'recurring')]['mrr'].sum()
-new_mrr_yoy = percentage_change(
-    data[(data['created_at'].dt.year == current_year) & (data['billing_type'] == 'recurring')]['mrr'].sum(),
-    data[(data['created_at'].dt.year == previous_year) & (data['billing_type'] == 'recurring')]['mrr'].sum()
-)
+# The KPI block, churn series, New MRR chart and cohort matrix are independent, so they are computed concurrently
+cohort_range = st.session_state.date_range if 'date_range' in st.session_state else None
+results = page_results('churn_analysis', data, cohort_range=cohort_range)
 
-# Churned MRR calculations
-churned_mrr = data[(data['subscription_status'] == 'inactive') & (data['subscription_period_ended_at'] >= current_month)]['mrr'].sum()
-churned_mrr_yoy = percentage_change(
-    data[(data['subscription_status'] == 'inactive') & (data['subscription_period_ended_at'].dt.year == current_year)]['mrr'].sum(),
-    data[(data['subscription_status'] == 'inactive') & (data['subscription_period_ended_at'].dt.year == previous_year)]['mrr'].sum()
-)
+# MRR, New MRR and Churned MRR
+mrr_kpis = results['mrr_kpis']
+current_mrr, current_mrr_yoy = mrr_kpis['current_mrr'], mrr_kpis['current_mrr_yoy']
+new_mrr, new_mrr_yoy = mrr_kpis['new_mrr'], mrr_kpis['new_mrr_yoy']
+churned_mrr, churned_mrr_yoy = mrr_kpis['churned_mrr'], mrr_kpis['churned_mrr_yoy']
 
 # Retention rate calculations
-def calculate_retention_rate(period_start, period_end):
-    customers_at_start = data[data['customer_created_at'] <= period_start]['customer_id'].nunique()
-    customers_retained = data[(data['customer_created_at'] <= period_start) & (data['subscription_status'] == 'active') & (data['created_at'] <= period_end)]['customer_id'].nunique()
-    return (customers_retained / customers_at_start) * 100 if customers_at_start > 0 else 0
-
-retention_30_day = calculate_retention_rate(current_month - pd.DateOffset(days=30), current_month)
-retention_30_day_yoy = percentage_change(
-    calculate_retention_rate(current_month - pd.DateOffset(days=30), current_month),
-    calculate_retention_rate(current_month - pd.DateOffset(years=1, days=30), current_month - pd.DateOffset(years=1))
-)
-
-retention_90_day = calculate_retention_rate(current_month - pd.DateOffset(days=90), current_month)
-retention_90_day_yoy = percentage_change(
-    calculate_retention_rate(current_month - pd.DateOffset(days=90), current_month),
-    calculate_retention_rate(current_month - pd.DateOffset(years=1, days=90), current_month - pd.DateOffset(years=1))
-)
-
-retention_1_year = calculate_retention_rate(current_month - pd.DateOffset(years=1), current_month)
-retention_1_year_yoy = percentage_change(
-    calculate_retention_rate(current_month - pd.DateOffset(years=1), current_month),
-    calculate_retention_rate(current_month - pd.DateOffset(years=2), current_month - pd.DateOffset(years=1))
-)
+retention_kpis = results['retention_kpis']
+retention_30_day, retention_30_day_yoy = retention_kpis['retention_30_day'], retention_kpis['retention_30_day_yoy']
+retention_90_day, retention_90_day_yoy = retention_kpis['retention_90_day'], retention_kpis['retention_90_day_yoy']
+retention_1_year, retention_1_year_yoy = retention_kpis['retention_1_year'], retention_kpis['retention_1_year_yoy']
 
 # KPI Metrics
 with st.container():
@@ -134,25 +84,15 @@ with st.container():
         st.metric(label="**1 Year Retention Rate**", value=f"{retention_1_year:.2f}%",
                   delta=format_yoy_change(retention_1_year_yoy))
 
+# The chart libraries are only loaded here, after the KPIs are on screen
+import plotly.graph_objects as go
+
 # Combined Churn Rate Chart
 st.markdown("**Churn Rate Over Time**")
 
-# Filter data to include only records with a subscription_id
-subscribed_data = data[data['subscription_id'].notna()]
-
-# Calculate overall churn rate
-churn_rate = subscribed_data.groupby(subscribed_data['created_at'].dt.to_period('M')).apply(
-    lambda x: x[x['subscription_status'] == 'inactive']['customer_id'].nunique() / x['customer_id'].nunique()
-).reset_index()
-churn_rate.columns = ['Month', 'Overall Churn Rate']
-churn_rate['Month'] = churn_rate['Month'].dt.to_timestamp()
-
-# Calculate churn rate by plan
-churn_rate_by_plan = subscribed_data.groupby(['subscription_plan', subscribed_data['created_at'].dt.to_period('M')]).apply(
-    lambda x: x[x['subscription_status'] == 'inactive']['customer_id'].nunique() / x['customer_id'].nunique()
-).reset_index()
-churn_rate_by_plan.columns = ['Subscription Plan', 'Month', 'Churn Rate']
-churn_rate_by_plan['Month'] = churn_rate_by_plan['Month'].dt.to_timestamp()
+# Calculate overall churn rate and churn rate by plan
+churn_rate = results['churn_rate']
+churn_rate_by_plan = results['churn_rate_by_plan']
 
 fig = go.Figure()
 
@@ -201,9 +141,8 @@ st.plotly_chart(fig)
 
 st.markdown("**New MRR by Product and Overall New MRR**")
 
-# Filter for recurring billing type and group by month and product type
-new_mrr_by_type = data[data['billing_type'] == 'recurring'].groupby([data['created_at'].dt.to_period('M'), 'product_type'])['mrr'].sum().reset_index()
-new_mrr_by_type['created_at'] = new_mrr_by_type['created_at'].dt.to_timestamp()
+# New MRR from recurring billing, by month and product type
+new_mrr_by_type = results['new_mrr_by_type']
 
 # Calculate overall new MRR by month
 overall_new_mrr = new_mrr_by_type.groupby('created_at')['mrr'].sum().reset_index()
@@ -254,70 +193,69 @@ fig.update_layout(
 st.plotly_chart(fig, use_container_width=True)
 
 
+## MRR Movements
 
+st.markdown("**MRR Movements**")
 
-## Cohort Analysis Chart
-st.markdown("**Cohort Analysis - Subscription Churn Rate**")
-
-# Filter data to include only records with a subscription_id and within the date range
-start_date, end_date = st.session_state.get('date_range', (data['created_at'].min(), data['created_at'].max()))
-subscribed_data = data[(data['subscription_id'].notna()) & 
-                       (data['subscription_period_started_at'] >= start_date) & 
-                       (data['subscription_period_started_at'] <= end_date)]
-
-# Debug: Print the shape of subscribed_data
-st.write(f"Number of subscribed records: {subscribed_data.shape[0]}")
-
-# Prepare cohort data
-cohort = subscribed_data.groupby('subscription_id').agg({
-    'customer_created_at': 'first',
-    'subscription_period_started_at': 'first',
-    'subscription_status': 'last'
-}).reset_index()
+# Month-over-month MRR change by movement type, from the subscription MRR ledger
+mrr_movements = results['mrr_movements']
+net_mrr_movement = mrr_movements.groupby('month')['mrr'].sum().reset_index()
 
-# Calculate months since customer creation
-cohort['months_since_customer_creation'] = ((cohort['subscription_period_started_at'].dt.to_period('M') - 
-                                             cohort['customer_created_at'].dt.to_period('M'))).apply(lambda x: max(0, x.n))
+movement_colors = {
+    'new': '#306BEA',
+    'expansion': '#85B4FF',
+    'reactivation': '#9EA91F',
+    'contraction': '#DB6645',
+    'churn': '#1E0C09',
+}
 
-# Calculate total subscriptions
-total_subs = cohort.groupby([
-    cohort['subscription_period_started_at'].dt.to_period('M'), 
-    'months_since_customer_creation'
-])['subscription_id'].nunique().unstack(fill_value=0)
+fig = go.Figure()
 
-# Calculate churned subscriptions
-churned_subs = cohort[cohort['subscription_status'] == 'inactive'].groupby([
-    cohort['subscription_period_started_at'].dt.to_period('M'), 
-    'months_since_customer_creation'
-])['subscription_id'].nunique().unstack(fill_value=0)
+for movement, color in movement_colors.items():
+    movement_data = mrr_movements[mrr_movements['movement'] == movement]
+    fig.add_trace(
+        go.Bar(
+            x=movement_data['month'],
+            y=movement_data['mrr'],
+            name=movement.capitalize(),
+            marker_color=color
+        )
+    )
 
-# Ensure both dataframes have the same index and columns
-common_index = total_subs.index.intersection(churned_subs.index)
-common_columns = total_subs.columns.intersection(churned_subs.columns)
+fig.add_trace(
+    go.Scatter(
+        x=net_mrr_movement['month'],
+        y=net_mrr_movement['mrr'],
+        name='Net MRR Change',
+        line=dict(color='black', width=3),
+        mode='lines+markers'
+    )
+)
 
-total_subs = total_subs.loc[common_index, common_columns]
-churned_subs = churned_subs.loc[common_index, common_columns]
+fig.update_layout(
+    barmode='relative',
+    xaxis_title='Month',
+    yaxis_title='MRR Change',
+    legend_title='Movement',
+    hovermode='x unified',
+    yaxis=dict(tickprefix='$', tickformat=',.0f')
+)
 
+st.plotly_chart(fig, use_container_width=True)
 
-# Calculate churn rate
-churn_rate = churned_subs / total_subs
 
-# Replace NaN and inf with 0
-churn_rate = churn_rate.fillna(0).replace([np.inf, -np.inf], 0)
 
-# Sort the columns and index
-churn_rate = churn_rate.sort_index()
-churn_rate = churn_rate.reindex(sorted(churn_rate.columns), axis=1)
 
-# Rename the index for clarity
-churn_rate.index = churn_rate.index.strftime('%Y-%m')
-churn_rate.index.name = 'Subscription Start Month'
+## Cohort Analysis Chart
+st.markdown("**Cohort Analysis - Subscription Churn Rate**")
 
-# Remove any rows that are all zeros
-churn_rate_cleaned = churn_rate.loc[(churn_rate != 0).any(axis=1)]
+# Subscribed records within the date range, grouped into cohorts
+cohort = results['cohort']
 
-# Add "Months Since Customer Creation" as column header
-churn_rate_cleaned.columns.name = "Months Since Customer Creation"
+churn_rate = cohort['churn_rate']
+churn_rate_cleaned = cohort['matrix']
+churned_subs = cohort['churned_subscriptions']
+total_subs = cohort['total_subscriptions']
 
 # Function to format cell content
 def format_cell(val, churned, total):
@@ -363,11 +301,5 @@ styled_churn_matrix = styled_churn_matrix.set_table_styles([
 st.write("Churn Rate Matrix:")
 st.dataframe(styled_churn_matrix, use_container_width=True, height=500)
 
-# # Optionally, provide a CSV download link for the full data
-# csv = churn_rate.to_csv().encode('utf-8')
-# st.download_button(
-#     label="Download Full Churn Rate Matrix as CSV",
-#     data=csv,
-#     file_name="full_churn_rate_matrix.csv",
-#     mime="text/csv",
-# )
\ No newline at end of file
+# Export the full churn rate matrix
+download_buttons(churn_rate.reset_index(), 'churn_rate_matrix', 'export_churn_rate_matrix')
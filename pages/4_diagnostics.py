@@ -0,0 +1,72 @@
+import streamlit as st
+import pandas as pd
+from functions import memory
+
+## Apply standard page settings.
+st.set_page_config(
+    layout="wide",
+    initial_sidebar_state="expanded",
+)
+
+st.title('Diagnostics')
+
+## The page lists every session of the server, so it is only shown when enabled
+if not memory.diagnostics_enabled():
+    st.info("Diagnostics are turned off. Set BILLING_DIAGNOSTICS=1 to show them.")
+    st.stop()
+
+st.caption("Memory held by this server process. Frames share buffers, so the categories overlap; the process RSS is the ground truth.")
+
+report = memory.memory_report()
+
+## Headline numbers
+with st.container():
+    col1, col2, col3, col4, col5 = st.columns(5)
+    with col1:
+        st.metric(label="**Process RSS**", value=memory.format_bytes(report['rss_bytes']))
+    with col2:
+        st.metric(label="**Datasets**", value=memory.format_bytes(sum(dataset['bytes'] for dataset in report['datasets'])))
+    with col3:
+        st.metric(label="**Derived Frames**", value=memory.format_bytes(sum(frame['bytes'] for frame in report['frames'])))
+    with col4:
+        st.metric(label="**Cache Entries**", value=memory.format_bytes(None if report['caches'] is None else sum(cache['bytes'] for cache in report['caches'])))
+    with col5:
+        if report['sessions'] is None:
+            st.metric(label="**Sessions**", value='unavailable')
+        else:
+            st.metric(label="**Sessions**", value=report['sessions']['count'], delta=memory.format_bytes(report['sessions']['bytes']), delta_color='off')
+
+def byte_table(rows, columns):
+    # The rows with their byte columns formatted for display
+    table = pd.DataFrame(rows, columns=columns)
+    for column in [column for column in columns if column.endswith('bytes')]:
+        table[column] = table[column].map(memory.format_bytes)
+    st.dataframe(table, hide_index=True)
+
+st.subheader('Top Consumers')
+byte_table(report['top'], ['kind', 'name', 'bytes'])
+
+col1, col2 = st.columns(2)
+with col1:
+    st.subheader('Datasets')
+    byte_table(report['datasets'], ['path', 'version', 'rows', 'columns', 'bytes'])
+with col2:
+    st.subheader('Derived Frames')
+    byte_table(report['frames'], ['step', 'frames', 'rows', 'bytes', 'largest_bytes'])
+
+st.subheader('Caches')
+if report['caches'] is None:
+    st.info(f"Cache sizes are unavailable with this Streamlit version ({st.__version__}).")
+else:
+    byte_table(report['caches'], ['kind', 'name', 'entries', 'bytes', 'largest_bytes'])
+
+st.subheader('Sessions')
+if report['sessions'] is None:
+    st.info(f"Session sizes are unavailable with this Streamlit version ({st.__version__}).")
+else:
+    byte_table([dict(session, keys=len(session['keys'])) for session in report['sessions']['sessions']], ['session', 'keys', 'script_runs', 'bytes'])
+
+st.caption(f"Measured in {report['seconds']:.2f}s (dataset store: {report['dataset_store']}).")
+if st.button("Write report to log"):
+    memory.log_report(report)
+    st.toast("Memory report logged")
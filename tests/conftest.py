@@ -0,0 +1,46 @@
+import os
+from datetime import timedelta
+import pytest
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+# Tests never read or write the persistent result cache of the repository (tests/test_disk_cache.py uses its own)
+os.environ['BILLING_DISK_CACHE_MB'] = '0'
+
+
+@pytest.fixture(scope='session', autouse=True)
+def repo_root():
+    # The app and the tools read their data and pages relative to the repository root
+    with pytest.MonkeyPatch.context() as patch:
+        patch.chdir(ROOT)
+        yield ROOT
+
+@pytest.fixture(scope='session')
+def dataset(repo_root):
+    # The example dataset as the app loads it: tagged with its version, with its customer dimension registered
+    from functions.query import DATA_PATH, probed_version
+
+    return probed_version(DATA_PATH)['data']
+
+@pytest.fixture(scope='session')
+def date_range(dataset):
+    end = dataset['created_at'].max()
+    return end - timedelta(days=365), end
+
+@pytest.fixture(scope='session')
+def date_filtered(dataset, date_range):
+    from functions.filters import filter_data
+
+    return filter_data(*date_range, dataset)
+
+@pytest.fixture(scope='session')
+def segmented_data(date_filtered):
+    from functions.filters import segmented
+
+    return segmented(date_filtered)
+
+@pytest.fixture(scope='session')
+def prepared(segmented_data):
+    from functions.metrics import prepare
+
+    return prepare(segmented_data)
@@ -0,0 +1,86 @@
+import numpy as np
+import pandas as pd
+import pytest
+from functions import backend, filters, metrics, sql_metrics, versions
+
+
+def assert_same(expected, actual, name=''):
+    # Equal up to dtypes, index labels and floating point error
+    if isinstance(expected, dict):
+        assert set(expected) <= set(actual), name
+        for key, value in expected.items():
+            assert_same(value, actual[key], f'{name}.{key}')
+    elif isinstance(expected, (pd.DataFrame, pd.Series)):
+        assert expected.shape == actual.shape, name
+        if isinstance(expected, pd.DataFrame):
+            assert list(expected.columns.astype(str)) == list(actual.columns.astype(str)), name
+            for column in range(expected.shape[1]):
+                assert_same(expected.iloc[:, column], actual.iloc[:, column], f'{name}[{expected.columns[column]}]')
+        elif pd.api.types.is_numeric_dtype(expected) and pd.api.types.is_numeric_dtype(actual):
+            assert np.allclose(expected.astype(float), actual.astype(float), equal_nan=True), name
+        elif pd.api.types.is_datetime64_any_dtype(expected) or pd.api.types.is_datetime64_any_dtype(actual):
+            assert (pd.to_datetime(expected).reset_index(drop=True) == pd.to_datetime(actual).reset_index(drop=True)).all(), name
+        else:
+            assert expected.astype(str).reset_index(drop=True).equals(actual.astype(str).reset_index(drop=True)), name
+    elif isinstance(expected, (float, np.floating)) and not isinstance(actual, str):
+        assert actual == pytest.approx(expected, nan_ok=True), name
+    else:
+        assert expected == actual, name
+
+selection_sets = [
+    (),
+    (('subscription_plan', ('Premium',)),),
+    (('revenue_segment', ('High Revenue', 'Very High Revenue')), ('customer_tenure_range', ('3-4 years', '5+ years'))),
+    (('payment_method', ('credit_card', 'paypal')), ('subscription_status', ('active',))),
+]
+
+@pytest.fixture(scope='module')
+def source():
+    path = backend.data_source()
+    return path, backend.source_token(path)
+
+def pandas_filtered(date_filtered, selections):
+    # The rows the pandas backend shows for the selections, as filters.setting_filters selects them
+    segmented_data = filters.segmented(date_filtered)
+    mask = filters.selections_mask(filters.option_catalog(date_filtered), selections)
+    return segmented_data if mask is None else versions.derive(segmented_data[mask], segmented_data, 'filters', selections)
+
+def test_source_is_converted_to_parquet(source):
+    path, token = source
+    assert path.endswith('.parquet')
+    assert token == backend.source_token(path)
+
+@pytest.mark.parametrize('selections', selection_sets)
+def test_filtered_rows_match_pandas(selections, source, date_filtered, date_range):
+    relation = backend.filtered(*source, *date_range, selections)
+    rows = relation.to_pandas()
+    expected = pandas_filtered(date_filtered, selections)
+    assert len(rows) > 0
+    assert sorted(rows['line_item_id']) == sorted(expected['line_item_id'])
+
+@pytest.mark.parametrize('selections', selection_sets[:3])
+def test_filter_options_match_the_catalog(selections, source, date_filtered, date_range):
+    catalog = filters.option_catalog(date_filtered)
+    mask = filters.selections_mask(catalog, selections)
+    for _, column_field, _ in filters.filter_columns:
+        expected = filters.catalog_options(catalog, column_field, mask)
+        assert [str(option) for option in backend.filter_options(*source, *date_range, selections, column_field)] == expected, column_field
+
+@pytest.mark.parametrize('selections', selection_sets)
+@pytest.mark.parametrize('page', metrics.report_pages)
+def test_page_metrics_match_pandas(page, selections, source, date_filtered, date_range):
+    prepared = metrics.prepare(pandas_filtered(date_filtered, selections))
+    relation = backend.filtered(*source, *date_range, selections)
+    expected, actual = metrics.page_tasks(page, prepared), metrics.page_tasks(page, relation)
+    for name, (func, *args) in expected.items():
+        _, *relation_args = actual[name]
+        assert_same(func(*args), func(*relation_args), f'{page}.{name}')
+
+def test_tenure_buckets_leave_out_missing_created_dates():
+    buckets = backend.run(f"SELECT {backend.tenure_range_sql} AS bucket FROM (VALUES (3), (61), (NULL)) AS tenured(customer_tenure_months)")
+    assert buckets['bucket'].tolist()[:2] == ['0-6 months', '5+ years']
+    assert pd.isna(buckets['bucket'][2])
+
+def test_customer_table_has_one_row_per_customer(source, date_range):
+    table = sql_metrics.customer_table(backend.filtered(*source, *date_range, ()))
+    assert table['ID'].is_unique
@@ -0,0 +1,44 @@
+import os
+from functions import disk_cache
+from tools import benchmark
+
+
+def result(cold, p50, p95, peak, page='pages/1_orders_and_revenue.py'):
+    return {'page': page, 'dataset': 'sample.csv', 'scenario': 'default', 'cold_seconds': cold,
+            'warm_latency_seconds': {'p50': p50, 'p95': p95}, 'peak_memory_bytes': peak}
+
+def test_latency_summary():
+    summary = benchmark.latency_summary([1.0, 2.0, 3.0, 4.0])
+    assert summary['p50'] == 2.5
+    assert summary['mean'] == 2.5
+    assert summary['max'] == 4.0
+
+def test_compare_flags_each_measure_beyond_the_tolerance():
+    baseline = {'results': [result(10.0, 1.0, 2.0, 100)]}
+    assert benchmark.compare([result(11.0, 1.1, 2.2, 110)], baseline, 0.2) == []
+    regressions = benchmark.compare([result(13.0, 1.0, 2.5, 100)], baseline, 0.2)
+    assert [(r['measure'], round(r['change'], 2)) for r in regressions] == [('cold', 0.3), ('warm_p95', 0.25)]
+
+def test_compare_skips_results_without_a_baseline():
+    baseline = {'results': [result(10.0, 1.0, 2.0, 100, page='billing_overview.py')]}
+    assert benchmark.compare([result(99.0, 9.0, 9.0, 999)], baseline, 0.2) == []
+
+def test_benchmark_page_times_a_cold_run_and_warm_reruns():
+    path = os.path.abspath('data/example__line_item_enhanced.csv')
+    rows, max_date = benchmark.dataset_bounds(path)
+    measured = benchmark.benchmark_page('billing_overview.py', 'default', max_date, repeats=2, timeout=120)
+    assert measured['error'] is None
+    assert measured['cold_seconds'] > 0
+    assert measured['warm_latency_seconds']['max'] > 0
+    assert measured['peak_memory_bytes'] > 0
+
+def test_cold_caches_start_from_an_empty_disk_cache(tmp_path, monkeypatch):
+    monkeypatch.setenv('BILLING_DISK_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(disk_cache, 'max_bytes', 2 ** 20)
+    disk_cache.store('warm', 1)
+    with benchmark.cold_caches():
+        assert disk_cache.cache_dir() != str(tmp_path)
+        assert disk_cache.load('warm') == (False, None)
+        directory = disk_cache.cache_dir()
+    assert disk_cache.cache_dir() == str(tmp_path)
+    assert not os.path.exists(directory)
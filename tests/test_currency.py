@@ -0,0 +1,58 @@
+import numpy as np
+import pandas as pd
+import pytest
+from functions import currency
+
+
+@pytest.fixture
+def rates(tmp_path, monkeypatch):
+    path = tmp_path / 'fx_rates.csv'
+    pd.DataFrame({
+        'date': ['2024-01-01', '2024-02-01', '2024-01-15', '2024-03-01'],
+        'currency': ['EUR', 'EUR', 'GBP', 'gbp'],
+        'usd_per_unit': [1.10, 1.20, 1.25, 1.30],
+    }).to_csv(path, index=False)
+    monkeypatch.setenv('BILLING_FX_RATES_PATH', str(path))
+    monkeypatch.delenv('BILLING_REPORTING_CURRENCY', raising=False)
+
+def line_items(currencies, dates, amounts):
+    return pd.DataFrame({'currency': currencies, 'created_at': pd.to_datetime(dates), 'total_amount': amounts, 'refund_amount': [np.nan] * len(amounts)})
+
+def test_amounts_convert_at_the_rate_of_the_order_date(rates):
+    data = currency.normalize(line_items(
+        ['EUR', 'EUR', 'EUR', 'GBP', 'usd', 'GBP'],
+        ['2023-12-01', '2024-01-31', '2024-02-01', '2024-02-20', '2024-02-20', '2024-03-02'],
+        [100.0, 100.0, 100.0, 100.0, 100.0, 100.0],
+    ))
+    # Before the first EUR rate its first rate applies; a date with only a GBP rate carries the EUR rate forward
+    assert data['total_amount'].tolist() == pytest.approx([110.0, 110.0, 120.0, 125.0, 100.0, 130.0])
+    assert data['fx_rate'].tolist() == pytest.approx([1.10, 1.10, 1.20, 1.25, 1.0, 1.30])
+    assert data['source_currency'].tolist() == ['EUR', 'EUR', 'EUR', 'GBP', 'USD', 'GBP']
+    assert (data['currency'] == 'USD').all()
+    assert data['refund_amount'].isna().all()
+
+def test_conversion_into_another_reporting_currency(rates, monkeypatch):
+    monkeypatch.setenv('BILLING_REPORTING_CURRENCY', 'eur')
+    data = currency.normalize(line_items(['USD', 'GBP', 'EUR'], ['2024-02-15', '2024-02-15', '2024-02-15'], [120.0, 120.0, 50.0]))
+    assert data['total_amount'].tolist() == pytest.approx([100.0, 125.0, 50.0])
+    assert (data['currency'] == 'EUR').all()
+
+def test_data_in_the_reporting_currency_is_left_as_it_is(rates):
+    data = line_items(['USD', None], ['2024-02-15', '2024-02-15'], [10.0, 20.0])
+    assert currency.normalize(data) is data
+    assert 'fx_rate' not in data.columns
+
+def test_unknown_currencies_are_an_error(rates):
+    with pytest.raises(ValueError, match='JPY'):
+        currency.normalize(line_items(['JPY'], ['2024-02-15'], [10.0]))
+
+def test_rate_positions_match_a_backward_search(rates):
+    wide = currency.rate_table(currency.load_fx_rates())
+    dates = pd.to_datetime(['2024-03-05', '2023-01-01', '2024-01-15', '2024-01-14']).to_numpy()
+    expected = np.maximum(np.searchsorted(wide.index.to_numpy(), dates, side='right') - 1, 0)
+    assert currency.rate_positions(dates, wide).tolist() == expected.tolist()
+
+def test_loaded_dataset_is_in_usd(dataset):
+    assert (dataset['currency'] == 'USD').all()
+    assert set(dataset['source_currency']) == {'USD', 'MXN', 'CAD', 'EUR', 'GBP'}
+    assert (dataset.loc[dataset['source_currency'] == 'USD', 'fx_rate'] == 1.0).all()
@@ -0,0 +1,82 @@
+import numpy as np
+import pandas as pd
+from functions import customers, filters
+
+
+def line_items(**columns):
+    frame = pd.DataFrame({
+        'customer_id': ['c2', 'c1', None, 'c2', 'c3'],
+        'customer_name': ['Two', 'One', None, 'Two later', 'Three'],
+        'customer_company': ['Acme', 'Initech', None, 'Acme', 'Acme'],
+        'customer_created_at': ['2020-01-01', '2024-06-01', None, '2020-01-01', '2023-01-01'],
+        'created_at': pd.to_datetime(['2024-03-01', '2024-01-01', '2024-02-01', '2024-05-01', '2024-04-01']),
+        'total_amount': [10.0, 5.0, 7.0, np.nan, 20.0],
+        'refund_amount': [1.0, 0.0, 0.0, 2.0, 0.0],
+        'discount_amount': [0.0, 0.5, 0.0, 0.0, 1.0],
+        'subscription_status': ['inactive', 'active', 'active', 'inactive', None],
+    })
+    return customers.add_codes(frame.assign(**columns))
+
+def test_codes_are_the_rank_of_customer_id():
+    assert customers.customer_codes(pd.Series(['b', 'a', None, 'b'])).tolist() == [1, 0, -1, 1]
+    assert line_items()[customers.code_column].dtype == np.int32
+    # Codes already on a frame are kept
+    assert customers.code_values(line_items()) == {}
+
+def test_per_code_leaves_out_missing_codes():
+    codes = np.array([1, 0, -1, 1], dtype=np.int32)
+    assert customers.per_code(codes, 3).tolist() == [1, 2, 0]
+    assert customers.per_code(codes, 3, [1.0, 2.0, 4.0, np.nan]).tolist() == [2.0, 1.0, 0.0]
+    assert pd.isna(customers.lookup(['a', 'b'], [1, -1])[1])
+
+def test_dimension_has_one_row_per_customer():
+    dimension = customers.build_dimension(line_items())
+    assert dimension['customer_id'].tolist() == ['c1', 'c2', 'c3']
+    # Attributes come from the customer's first line item
+    assert dimension['customer_name'].tolist() == ['One', 'Two', 'Three']
+    assert dimension['company_code'].tolist() == [1, 0, 0]
+    assert dimension['first_order_at'].tolist() == list(pd.to_datetime(['2024-01-01', '2024-03-01', '2024-04-01']))
+    assert dimension['last_order_at'].tolist() == list(pd.to_datetime(['2024-01-01', '2024-05-01', '2024-04-01']))
+    assert dimension['lifetime_revenue'].tolist() == [5.0, 10.0, 20.0]
+    assert dimension['lifetime_refunds'].tolist() == [0.0, 3.0, 0.0]
+    assert dimension['active_subscription'].tolist() == [True, False, False]
+
+def test_dimension_matches_a_groupby_of_the_dataset(dataset):
+    dimension = customers.dimension(dataset)
+    by_customer = dataset.groupby('customer_id')
+    assert dimension['customer_id'].tolist() == sorted(by_customer.groups)
+    assert np.allclose(dimension['lifetime_revenue'], by_customer['total_amount'].sum().to_numpy())
+    assert dimension['active_subscription'].tolist() == by_customer['subscription_status'].agg(lambda s: (s == 'active').any()).tolist()
+
+def test_tenure_buckets():
+    dimension = pd.DataFrame({'customer_created_at': ['2024-01-01', '2023-07-01', '2021-01-01', '2010-01-01', None]})
+    months, labels = customers.tenure(dimension, pd.Timestamp('2024-06-01'))
+    assert months[:4].tolist() == [5, 11, 41, 175]
+    assert labels.tolist() == ['0-6 months', '7-12 months', '3-4 years', '5+ years', None]
+    assert np.isnan(months[4])
+
+def test_customers_without_a_created_date_have_no_tenure(date_filtered):
+    data = date_filtered.copy()
+    missing = data['customer_id'] == data['customer_id'].dropna().iloc[0]
+    data.loc[missing, 'customer_created_at'] = None
+    segmented = filters.add_segments(data, filters.customer_segments(data, pd.Timestamp('2025-01-01')), pd.Timestamp('2025-01-01'))
+    assert segmented.loc[missing, 'customer_tenure_months'].isna().all()
+    assert segmented.loc[missing, 'customer_tenure_range'].isna().all()
+    assert segmented.loc[~missing & data['customer_created_at'].notna(), 'customer_tenure_range'].notna().all()
+
+def test_loaded_versions_share_their_dimension(dataset, date_filtered):
+    assert customers.dimension(date_filtered) is customers.dimension(dataset)
+    assert any(dimension is customers.dimension(dataset) for _, dimension in customers.registered())
+    # Frames outside the page flow get a dimension of their own rows
+    own = customers.dimension(line_items())
+    assert own['customer_id'].tolist() == ['c1', 'c2', 'c3']
+    assert customers.dimension(line_items()) is own
+
+def test_segments_are_per_customer_code(date_filtered):
+    segments = filters.customer_segments(date_filtered, pd.Timestamp('2025-01-01'))
+    dimension = customers.dimension(date_filtered)
+    assert all(len(values) == len(dimension) for values in segments.values())
+    # Customers of one company share its revenue segment
+    by_company = pd.Series(segments['revenue_segment']).groupby(dimension['company_code'].to_numpy()).nunique(dropna=False)
+    assert (by_company <= 1).all()
+    assert set(pd.Series(segments['revenue_segment']).dropna()) <= {'Low Revenue', 'Medium Revenue', 'High Revenue', 'Very High Revenue'}
@@ -0,0 +1,71 @@
+import os
+import pytest
+import streamlit as st
+from functions import disk_cache, metrics
+
+
+@pytest.fixture
+def cache_dir(tmp_path, monkeypatch):
+    monkeypatch.setenv('BILLING_DISK_CACHE_DIR', str(tmp_path))
+    monkeypatch.setattr(disk_cache, 'max_bytes', 2 ** 20)
+    monkeypatch.setattr(disk_cache, '_total_bytes', {})
+    return tmp_path
+
+def entries(directory):
+    return sorted(name for name in os.listdir(directory) if name.endswith('.pkl'))
+
+def test_results_are_computed_once_and_read_back(cache_dir):
+    calls = []
+    compute = lambda: calls.append(1) or {'total': 42}
+    assert disk_cache.cached(('metric', 'input'), compute) == {'total': 42}
+    assert disk_cache.cached(('metric', 'input'), compute) == {'total': 42}
+    assert len(calls) == 1
+    assert len(entries(cache_dir)) == 1
+    assert not [name for name in os.listdir(cache_dir) if name.endswith('.tmp')]
+
+def test_keys_depend_on_the_code_version(cache_dir, monkeypatch):
+    key = disk_cache.entry_key(('metric', 'input'))
+    monkeypatch.setattr(disk_cache, 'code_version', lambda: 'another deploy')
+    assert disk_cache.entry_key(('metric', 'input')) != key
+    assert disk_cache.entry_key((lambda: None,)) is None
+
+def test_unreadable_entries_are_dropped(cache_dir):
+    key = disk_cache.entry_key(('metric', 'input'))
+    with open(disk_cache.entry_path(key), 'wb') as f:
+        f.write(b'not a pickle')
+    assert disk_cache.load(key) == (False, None)
+    assert entries(cache_dir) == []
+
+def test_least_recently_used_entries_are_evicted(cache_dir, monkeypatch):
+    monkeypatch.setattr(disk_cache, 'max_bytes', 250_000)
+    keys = [disk_cache.entry_key(('metric', i)) for i in range(3)]
+    for i, key in enumerate(keys[:2]):
+        disk_cache.store(key, b'x' * 100_000)
+        os.utime(disk_cache.entry_path(key), ns=(i * 10 ** 9, i * 10 ** 9))
+    # A hit makes the oldest entry the most recently used one
+    assert disk_cache.load(keys[0])[0]
+    disk_cache.store(keys[2], b'x' * 100_000)
+    assert entries(cache_dir) == sorted(f'{key}.pkl' for key in [keys[0], keys[2]])
+
+def test_tracked_size_follows_the_entries(cache_dir):
+    key = disk_cache.entry_key(('metric', 'input'))
+    disk_cache.store(key, b'x' * 10_000)
+    disk_cache.store(key, b'x' * 20_000)
+    assert disk_cache._total_bytes[str(cache_dir)] == os.path.getsize(disk_cache.entry_path(key))
+
+def test_a_disabled_tier_computes_every_time(cache_dir, monkeypatch):
+    monkeypatch.setattr(disk_cache, 'max_bytes', 0)
+    calls = []
+    disk_cache.cached(('metric',), lambda: calls.append(1))
+    disk_cache.cached(('metric',), lambda: calls.append(1))
+    assert len(calls) == 2
+    assert entries(cache_dir) == []
+
+def test_metrics_survive_a_restart(cache_dir, prepared, monkeypatch):
+    # A restarted process has empty in-memory caches; its metrics are read from disk instead of being computed
+    st.cache_data.clear()
+    expected = metrics.revenue_by_country(prepared)
+    assert entries(cache_dir)
+    st.cache_data.clear()
+    monkeypatch.setattr(disk_cache, 'store', lambda key, value: pytest.fail('recomputed'))
+    assert metrics.revenue_by_country(prepared).equals(expected)
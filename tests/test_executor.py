@@ -0,0 +1,66 @@
+import threading
+import time
+from types import SimpleNamespace
+from concurrent.futures import ThreadPoolExecutor
+import pytest
+from streamlit.runtime.scriptrunner import get_script_run_ctx
+from functions import executor, metrics
+
+
+def test_workers_for_caps_the_defaults_at_the_cores(monkeypatch):
+    monkeypatch.delenv('BILLING_WORKERS', raising=False)
+    monkeypatch.delenv('BILLING_WORKERS_CHURN_ANALYSIS', raising=False)
+    monkeypatch.setattr(executor.os, 'cpu_count', lambda: 2)
+    assert executor.workers_for('churn_analysis') == 2
+    assert executor.workers_for('unknown') == 1
+
+def test_workers_for_overrides(monkeypatch):
+    monkeypatch.setenv('BILLING_WORKERS', '3')
+    monkeypatch.setenv('BILLING_WORKERS_CHURN_ANALYSIS', '1')
+    assert executor.workers_for('orders_and_revenue') == 3
+    assert executor.workers_for('churn_analysis') == 1
+
+def test_tasks_run_concurrently():
+    # Two tasks that each wait for the other only finish when they run at the same time
+    barrier = threading.Barrier(2, timeout=10)
+
+    def meet(name):
+        barrier.wait()
+        return name, threading.current_thread().name
+
+    results = executor.run_concurrently({'a': (meet, 'a'), 'b': (meet, 'b')}, max_workers=2)
+    assert [results[name][0] for name in 'ab'] == ['a', 'b']
+    assert all(thread.startswith('billing-metrics') for _, thread in results.values())
+
+def test_a_single_worker_runs_in_the_calling_thread():
+    results = executor.run_concurrently({'a': (threading.current_thread,), 'b': (time.monotonic,)}, max_workers=1)
+    assert results['a'] is threading.current_thread()
+
+def test_errors_propagate():
+    def fail():
+        raise ValueError('boom')
+
+    with pytest.raises(ValueError, match='boom'):
+        executor.run_concurrently({'a': (fail,), 'b': (time.monotonic,)}, max_workers=2)
+
+def test_pooled_threads_give_the_script_context_back():
+    ctx = SimpleNamespace(pages_manager=SimpleNamespace(main_script_hash='page'))
+    current = lambda: get_script_run_ctx(suppress_warning=True)
+    with ThreadPoolExecutor(max_workers=1) as pool:
+        assert pool.submit(executor._run_with_context, ctx, current, ()).result() is ctx
+        assert pool.submit(current).result() is None
+        with pytest.raises(ValueError):
+            pool.submit(executor._run_with_context, ctx, int, ('x',)).result()
+        assert pool.submit(current).result() is None
+
+@pytest.mark.parametrize('page', metrics.report_pages)
+def test_concurrent_page_results_equal_sequential_ones(page, prepared):
+    tasks = metrics.page_tasks(page, prepared)
+    sequential = {name: func.uncached(*args) for name, (func, *args) in tasks.items()}
+    concurrent = executor.run_concurrently(tasks, max_workers=4)
+    assert set(concurrent) == set(sequential)
+    for name, result in sequential.items():
+        if hasattr(result, 'equals'):
+            assert result.equals(concurrent[name]), name
+        else:
+            assert str(result) == str(concurrent[name]), name
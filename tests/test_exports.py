@@ -0,0 +1,39 @@
+import io
+import pandas as pd
+import pytest
+from functions import backend, customers, exports, metrics
+
+
+def read_export(data, file_format):
+    with exports.export_file(data, file_format) as sink:
+        content = io.BytesIO(sink.read())
+    return pd.read_csv(content) if file_format == 'csv' else pd.read_parquet(content)
+
+@pytest.fixture(autouse=True)
+def small_chunks(monkeypatch):
+    # Several chunks even for the example dataset
+    monkeypatch.setattr(exports, 'export_chunk_rows', 1_000)
+
+@pytest.mark.parametrize('file_format', ['csv', 'parquet'])
+def test_line_item_export_has_every_row_in_order(file_format, prepared):
+    exported = read_export(prepared, file_format)
+    assert len(exported) == len(prepared) > exports.export_chunk_rows
+    assert exported['line_item_id'].tolist() == prepared['line_item_id'].tolist()
+    assert exported['total_amount'].sum() == pytest.approx(prepared['total_amount'].sum())
+
+def test_internal_columns_are_not_exported(prepared):
+    exported = read_export(prepared, 'parquet')
+    assert customers.code_column not in exported.columns
+    assert not [column for column in exported.columns if column.endswith(('_key', '_hash'))]
+
+def test_churn_matrix_export_has_string_columns(prepared):
+    matrix = metrics.cohort_churn(prepared, *metrics.date_range(prepared))['churn_rate']
+    exported = read_export(matrix.reset_index(), 'parquet')
+    assert exported.columns.tolist() == [str(column) for column in matrix.reset_index().columns]
+    assert exported.iloc[:, 1:].to_numpy() == pytest.approx(matrix.to_numpy())
+
+def test_relation_export_equals_the_frame_export(prepared, date_range):
+    path = backend.data_source()
+    relation = backend.filtered(path, backend.source_token(path), *date_range, ())
+    exported = read_export(relation, 'parquet')
+    assert sorted(exported['line_item_id']) == sorted(prepared['line_item_id'])
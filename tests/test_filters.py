@@ -0,0 +1,47 @@
+import numpy as np
+import pandas as pd
+import pytest
+from functions import filters
+
+
+def test_encode_sorts_values_and_codes_missing_as_minus_one():
+    values, codes = filters.encode(pd.Series(['b', None, 'a', 'b', np.nan]))
+    assert values.tolist() == ['a', 'b']
+    assert codes.tolist() == [1, -1, 0, 1, -1]
+    assert codes.dtype == np.int8
+
+def frame_options(frame, column_field):
+    # The options as the filters showed them before the catalog: string values of the filtered rows
+    return sorted(frame[column_field].dropna().astype(str).unique())
+
+@pytest.mark.parametrize('filter_values', [
+    {},
+    {"Subscription Plan": ['Premium']},
+    {"Customer Segment": ['High Revenue'], "Customer Tenure": ['3-4 years', '5+ years']},
+    {"Payment Method": ['paypal'], "Product Name": [], "Subscription Status": ['inactive']},
+])
+def test_cascading_options_match_the_filtered_rows(filter_values, date_filtered, segmented_data):
+    catalog = filters.option_catalog(date_filtered)
+    mask = filters.selection_mask(catalog, filter_values)
+    frame = segmented_data if mask is None else segmented_data[mask]
+    assert len(frame) == len(filters.apply_filters(segmented_data, filter_values, filters.filter_columns))
+    for _, column_field, _ in filters.filter_columns:
+        assert filters.catalog_options(catalog, column_field, mask) == frame_options(frame, column_field), column_field
+
+def test_catalog_rows_follow_the_date_filtered_rows(date_filtered, segmented_data):
+    catalog = filters.option_catalog(date_filtered)
+    for _, column_field, _ in filters.filter_columns:
+        values, codes = catalog[column_field]
+        assert len(codes) == len(date_filtered)
+        decoded = np.append(values, None)[codes]
+        expected = segmented_data[column_field].astype(object).where(segmented_data[column_field].notna(), None)
+        assert [None if value is None else str(value) for value in expected] == decoded.tolist(), column_field
+
+def test_line_item_columns_are_encoded_once_per_dataset_version(dataset, date_filtered):
+    assert filters.dataset_catalog(dataset) is filters.dataset_catalog(dataset)
+    assert set(filters.dataset_catalog(dataset)) == {column for _, column, _ in filters.filter_columns} - set(filters.customer_filter_columns)
+
+def test_segments_are_values_of_the_date_range(segmented_data):
+    assert set(segmented_data['revenue_segment'].dropna()) <= {'Low Revenue', 'Medium Revenue', 'High Revenue', 'Very High Revenue'}
+    # A customer has one segment and tenure
+    assert (segmented_data.groupby('customer_id')[['revenue_segment', 'customer_tenure_range']].nunique() <= 1).all().all()
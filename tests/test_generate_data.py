@@ -0,0 +1,39 @@
+import pandas as pd
+import pytest
+from functions.query import data_columns, read_source
+from tools.generate_data import generate_dataset, parse_size
+
+
+@pytest.mark.parametrize('value, rows', [('100k', 100_000), ('1M', 1_000_000), ('2.5m', 2_500_000), ('10_000', 10_000)])
+def test_parse_size(value, rows):
+    assert parse_size(value) == rows
+
+@pytest.fixture(scope='module')
+def generated(tmp_path_factory):
+    path = str(tmp_path_factory.mktemp('generated') / 'line_item_enhanced.parquet')
+    return generate_dataset(5_000, seed=7, path=path, chunk_rows=2_000)
+
+def test_row_count_and_columns(generated):
+    data = pd.read_parquet(generated)
+    assert len(data) == 5_000
+    assert set(data_columns) <= set(data.columns)
+
+def test_output_is_determined_by_the_seed(generated, tmp_path):
+    assert pd.read_parquet(generate_dataset(5_000, seed=7, path=str(tmp_path / 'same.parquet'), chunk_rows=2_000)).equals(pd.read_parquet(generated))
+    assert not pd.read_parquet(generate_dataset(5_000, seed=8, path=str(tmp_path / 'other.parquet'), chunk_rows=2_000)).equals(pd.read_parquet(generated))
+
+def test_line_items_are_consistent(generated):
+    data = pd.read_parquet(generated)
+    # Every line item of a header shares its date, customer and status
+    assert (data.groupby('header_id')[['created_at', 'customer_id', 'header_status']].nunique() == 1).all().all()
+    # Orders never predate their customer, and subscription line items fall within their period
+    assert (data['created_at'] >= data['customer_created_at']).all()
+    subscribed = data[data['subscription_id'].notna()]
+    assert len(subscribed) > 0
+    assert (subscribed['subscription_period_started_at'] <= subscribed['created_at']).all()
+    assert (subscribed['created_at'] < subscribed['subscription_period_ended_at']).all()
+
+def test_generated_dataset_loads_like_the_sample(generated):
+    data = read_source(generated)
+    assert len(data) == 5_000
+    assert data['total_amount'].notna().all()
@@ -0,0 +1,38 @@
+from datetime import date
+import pandas as pd
+import pytest
+from functions import metrics
+
+
+def test_period_start():
+    dates = pd.Series(pd.to_datetime(['2024-05-15 13:00', '2024-05-19 00:00', None, '2024-08-01 09:30']))
+    assert metrics.period_start(dates, 'Day').tolist()[:2] == [pd.Timestamp('2024-05-15'), pd.Timestamp('2024-05-19')]
+    assert metrics.period_start(dates, 'Week')[[0, 1, 3]].tolist() == [pd.Timestamp('2024-05-13'), pd.Timestamp('2024-05-13'), pd.Timestamp('2024-07-29')]
+    assert metrics.period_start(dates, 'Quarter')[[0, 3]].tolist() == [pd.Timestamp('2024-04-01'), pd.Timestamp('2024-07-01')]
+    assert pd.isna(metrics.period_start(dates, 'Month')[2])
+
+@pytest.mark.parametrize('selected, start, end, effective', [
+    ('Day', date(2024, 1, 1), date(2024, 3, 1), 'Day'),
+    ('Day', date(2023, 1, 1), date(2024, 1, 1), 'Week'),
+    ('Week', date(2020, 1, 1), date(2024, 1, 1), 'Month'),
+    ('Month', date(2000, 1, 1), date(2024, 1, 1), 'Quarter'),
+    ('Quarter', date(1900, 1, 1), date(2024, 1, 1), 'Quarter'),
+])
+def test_effective_granularity_caps_the_chart_points(selected, start, end, effective):
+    assert metrics.effective_granularity(selected, start, end) == effective
+
+@pytest.mark.parametrize('granularity', list(metrics.granularities))
+def test_series_add_up_to_the_totals_at_every_granularity(granularity, prepared):
+    over_time = metrics.revenue_and_orders_over_time(prepared, granularity)
+    assert over_time['total_amount'].sum() == pytest.approx(prepared['total_amount'].sum())
+    assert over_time['month'].is_monotonic_increasing and over_time['month'].is_unique
+    starts = metrics.period_start(pd.to_datetime(prepared['created_at']), granularity)
+    assert set(over_time['month']) == set(starts)
+
+def test_coarser_series_roll_up_the_finer_ones(prepared):
+    by_day = metrics.revenue_and_orders_over_time(prepared, 'Day')
+    by_month = metrics.revenue_and_orders_over_time(prepared, 'Month')
+    rolled_up = by_day.groupby(by_day['month'].dt.to_period('M').dt.start_time)['total_amount'].sum()
+    assert rolled_up.to_numpy() == pytest.approx(by_month.set_index('month')['total_amount'].to_numpy())
+    # Orders are distinct per period, so months count each order once
+    assert (by_month['header_id'] <= by_day.groupby(by_day['month'].dt.to_period('M'))['header_id'].sum().to_numpy()).all()
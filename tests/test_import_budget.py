@@ -0,0 +1,24 @@
+import pytest
+from tools import import_budget
+
+
+@pytest.mark.parametrize('page', import_budget.PAGES)
+def test_page_start_up_imports_within_budget(page):
+    report = import_budget.measure_page(page, repeats=3)
+    assert report['start_seconds'] * 1000 <= import_budget.DEFAULT_BUDGET_MS, report['start']
+
+def test_chart_libraries_are_deferred():
+    start, deferred = import_budget.page_imports('pages/1_orders_and_revenue.py')
+    assert not any('plotly' in statement for statement in start)
+    assert any('plotly' in statement for statement in deferred)
+
+def test_parse_importtime_keeps_direct_imports_by_phase():
+    stderr = '\n'.join([
+        f'{import_budget.MARKER} start',
+        'import time: self [us] | cumulative | imported package',
+        'import time:       100 |        300 | pandas',
+        'import time:        50 |        200 |   pandas.core',
+        f'{import_budget.MARKER} deferred',
+        'import time:        10 |         40 | plotly',
+    ])
+    assert import_budget.parse_importtime(stderr) == {'start': {'pandas': 0.0003}, 'deferred': {'plotly': 0.00004}}
@@ -0,0 +1,61 @@
+import numpy as np
+import pandas as pd
+from functions import intervals, metrics, versions
+
+
+def brute_force(keys, starts, ends, dates):
+    # Distinct keys with a period containing each date
+    periods = pd.DataFrame({'key': keys, 'start': starts, 'end': ends}).dropna()
+    return np.array([periods.loc[(periods['start'] <= date) & (date < periods['end']), 'key'].nunique() for date in dates])
+
+def test_coalesce_merges_overlapping_and_touching_periods():
+    starts, ends = intervals.coalesce(
+        ['a', 'a', 'a', 'b', 'b'],
+        pd.to_datetime(['2024-01-01', '2024-01-15', '2024-03-01', '2024-01-01', '2024-02-01']),
+        pd.to_datetime(['2024-02-01', '2024-02-10', '2024-04-01', '2024-02-01', '2024-01-20']),
+    )
+    # b's second period ends before it starts and is dropped
+    assert list(zip(starts, ends)) == [
+        (np.datetime64('2024-01-01'), np.datetime64('2024-02-10')),
+        (np.datetime64('2024-03-01'), np.datetime64('2024-04-01')),
+        (np.datetime64('2024-01-01'), np.datetime64('2024-02-01')),
+    ]
+
+def test_periods_are_half_open():
+    index = intervals.build_index(['a'], pd.to_datetime(['2024-01-01']), pd.to_datetime(['2024-02-01']))
+    counts = intervals.active_counts(index, pd.to_datetime(['2023-12-31 00:00', '2024-01-01 00:00', '2024-01-31 23:59', '2024-02-01 00:00']))
+    assert counts.tolist() == [0, 1, 1, 0]
+
+def test_active_counts_match_a_brute_force_count():
+    rng = np.random.default_rng(0)
+    keys = rng.integers(0, 40, 300)
+    starts = pd.to_datetime('2023-01-01') + pd.to_timedelta(rng.integers(0, 365, 300), unit='D')
+    ends = starts + pd.to_timedelta(rng.integers(-5, 90, 300), unit='D')
+    dates = pd.date_range('2022-12-15', '2024-04-01', freq='7D')
+    index = intervals.build_index(keys, starts, ends)
+    assert intervals.active_counts(index, dates).tolist() == brute_force(keys, starts, ends, dates).tolist()
+
+def test_active_subscriptions_over_time(prepared):
+    result = metrics.active_subscriptions_over_time(prepared)
+    subscribed = prepared[prepared['subscription_id'].notna()]
+    ends = (result['month'] + pd.offsets.MonthEnd(0) + pd.Timedelta(days=1) - pd.Timedelta(1, unit='ns')).tolist()
+    ends[-1] = min(ends[-1], pd.Timestamp(prepared['created_at'].max()))
+    expected = brute_force(subscribed['subscription_id'], subscribed['subscription_period_started_at'], subscribed['subscription_period_ended_at'], ends)
+    assert result['active_subscriptions'].tolist() == expected.tolist()
+
+def test_filtered_inputs_mask_the_dataset_periods(dataset, prepared, monkeypatch):
+    tables = []
+    period_table = intervals.period_table
+    monkeypatch.setattr(intervals, 'period_table', lambda *args: tables.append(len(args[0])) or period_table(*args))
+    metrics._dataset_intervals.clear()
+    selections = [(('payment_method', ('credit_card',)),), (('revenue_segment', ('High Revenue',)),)]
+    for selection in selections:
+        (column_field, (value,)), = selection
+        filtered = versions.derive(prepared[prepared[column_field] == value], prepared, 'filters', selection)
+        assert metrics.lineage_rows(filtered, dataset).sum() == len(filtered)
+        index = metrics.subscription_intervals.uncached(filtered)
+        expected = intervals.build_index(filtered['subscription_id'], filtered['subscription_period_started_at'], filtered['subscription_period_ended_at'])
+        assert all(index[name].tolist() == expected[name].tolist() for name in ['starts', 'ends'])
+    # The dataset's periods were sorted once; the expected indexes sorted the filtered rows
+    assert tables[0] == len(dataset)
+    assert tables.count(len(dataset)) == 1
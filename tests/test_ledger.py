@@ -0,0 +1,72 @@
+import numpy as np
+import pandas as pd
+import pytest
+from functions import filters, metrics, versions
+
+
+def movements(mrr_by_month):
+    monthly = pd.DataFrame(
+        [('sub', month, mrr) for month, mrr in mrr_by_month.items()],
+        columns=['subscription_id', 'month', 'mrr'],
+    ).assign(product_type='plan', subscription_plan='Basic')
+    ledger = metrics.classify_movements(monthly)
+    return dict(zip(ledger['month'], zip(ledger['movement'], ledger['change'])))
+
+def test_classify_movements():
+    assert movements({100: 10.0, 101: 15.0, 102: 5.0, 103: 5.0, 105: 8.0}) == {
+        100: ('new', 10.0),
+        101: ('expansion', 5.0),
+        102: ('contraction', -10.0),
+        103: ('unchanged', 0.0),
+        104: ('churn', -5.0),
+        105: ('reactivation', 8.0),
+        106: ('churn', -8.0),
+    }
+
+def test_monthly_mrr_spreads_a_sale_over_its_period(dataset):
+    sale = metrics.prepare(dataset)
+    sale = sale[sale['subscription_id'].notna() & sale['billing_type'].isin(metrics.subscription_billing_types) & (sale['transaction_type'] == 'sale')].head(1)
+    monthly = metrics.monthly_subscription_mrr(sale)
+    first = sale[metrics.started_month].iloc[0]
+    assert monthly['month'].iloc[0] == first
+    assert (np.diff(monthly['month']) == 1).all()
+    assert monthly['mrr'].nunique() == 1
+
+@pytest.fixture(scope='module')
+def history(dataset):
+    ledger, _, _ = metrics.build_ledger(metrics.prepare(dataset))
+    return ledger
+
+def test_ledger_changes_add_up_to_the_mrr(history):
+    by_month = history.groupby('month').agg(mrr=('mrr', 'sum'), change=('change', 'sum')).reindex(range(history['month'].min(), history['month'].max() + 1), fill_value=0)
+    assert np.allclose(by_month['mrr'].diff().fillna(by_month['mrr'].iloc[0]), by_month['change'])
+
+def test_date_range_reads_the_whole_history(prepared, history):
+    # Subscriptions that churn in the first month of the range churned after a month before it, which the filtered
+    # rows alone do not show
+    ledger = metrics.mrr_ledger(prepared)
+    expected = metrics.ledger_window(history, metrics.reporting_months(prepared))
+    assert ledger.equals(expected)
+    first = ledger['month'].min()
+    assert ((ledger['month'] == first) & (ledger['movement'] == 'churn')).any()
+    in_range = metrics.classify_movements(metrics.monthly_subscription_mrr(prepared))
+    assert not ((in_range['month'] == metrics.reporting_months(prepared)[0]) & (in_range['movement'] == 'churn')).any()
+
+def test_filters_select_subscriptions_by_any_matching_line_item(date_filtered, dataset, history):
+    selections = (('subscription_plan', ('Premium',)),)
+    segmented_data = filters.segmented(date_filtered)
+    mask = filters.selections_mask(filters.option_catalog(date_filtered), selections)
+    filtered = metrics.prepare(versions.derive(segmented_data[mask], segmented_data, 'filters', selections))
+    ledger = metrics.mrr_ledger(filtered)
+    premium = set(dataset.loc[dataset['subscription_plan'] == 'Premium', 'subscription_id'])
+    assert set(ledger['subscription_id']) <= premium
+    expected = metrics.ledger_window(history, metrics.reporting_months(filtered), history['subscription_id'].isin(premium).to_numpy())
+    assert ledger.equals(expected)
+
+def test_mrr_kpis_read_the_ledger(prepared):
+    kpis = metrics.mrr_kpis(prepared)
+    ledger = metrics.mrr_ledger(prepared)
+    last = ledger['month'].max()
+    assert last == pd.Timestamp(prepared['created_at'].max()).to_period('M').to_timestamp()
+    assert kpis['current_mrr'] == pytest.approx(ledger.loc[ledger['month'] == last, 'mrr'].sum())
+    assert kpis['churned_mrr'] == pytest.approx(-ledger.loc[(ledger['month'] == last) & (ledger['movement'] == 'churn'), 'change'].sum())
@@ -0,0 +1,33 @@
+import asyncio
+import os
+import pytest
+from tools import loadtest
+
+
+def level(p95, errors=()):
+    return {'latency_seconds': {'p95': p95}, 'errors': list(errors)}
+
+def test_page_name():
+    assert loadtest.page_name('pages/3_churn_analysis.py') == 'churn_analysis'
+
+def test_within_slo():
+    assert loadtest.within_slo(level(1.5), 2000)
+    assert not loadtest.within_slo(level(2.5), 2000)
+    assert not loadtest.within_slo(level(0.5, ['session 0 open: boom']), 2000)
+    assert not loadtest.within_slo({'latency_seconds': None, 'errors': []}, 2000)
+
+@pytest.fixture(scope='module')
+def server():
+    server, url = loadtest.start_server(os.path.abspath('data/example__line_item_enhanced.csv'), loadtest.free_port())
+    yield server, url
+    server.terminate()
+    server.wait()
+
+def test_concurrent_sessions_interact_without_errors(server):
+    process, url = server
+    result = asyncio.run(loadtest.run_level(url, process.pid, sessions=2, duration=15, think_seconds=0, seed=1, rss_interval=0.5))
+    assert result['errors'] == []
+    assert result['open_latency_seconds'] is not None
+    assert result['reruns'] > 0 and result['throughput_per_second'] > 0
+    assert result['peak_rss_bytes'] > 0
+    assert result['latency_seconds']['p50'] <= result['latency_seconds']['p95']
@@ -0,0 +1,70 @@
+import os
+import json
+import logging
+import numpy as np
+import pandas as pd
+import pytest
+from streamlit.runtime.caching import cache_data_api, cache_resource_api
+from streamlit.testing.v1 import AppTest
+from functions import memory, metrics, query
+
+
+def test_frame_bytes_match_pandas_for_small_frames():
+    frame = pd.DataFrame({'id': [f'customer-{i}' for i in range(100)], 'amount': np.arange(100.0)})
+    assert memory.measure_frame(frame) == frame.memory_usage(deep=True).sum()
+
+def test_large_object_columns_are_estimated_from_a_sample():
+    column = pd.Series([f'customer-{i:08d}' for i in range(50_000)])
+    exact = column.memory_usage(index=False, deep=True)
+    assert memory.column_bytes(column) == pytest.approx(exact, rel=0.05)
+
+def test_object_bytes():
+    assert memory.object_bytes(np.zeros(1000)) == 8000
+    assert memory.object_bytes({'a': np.zeros(10), 'b': [np.zeros(10)]}) > 160
+
+def test_report_covers_the_datasets_frames_and_caches(prepared):
+    # Earlier tests (tools.benchmark cold runs) may have cleared the loaded datasets
+    query.probed_version(query.DATA_PATH)
+    metrics.revenue_by_product(prepared)
+    report = memory.memory_report()
+    json.dumps(report)
+    assert report['rss_bytes'] > 0
+    assert any(dataset['path'].endswith('example__line_item_enhanced.csv') and dataset['bytes'] > 0 for dataset in report['datasets'])
+    assert {'dates', 'segments', 'prepared'} <= {frame['step'] for frame in report['frames']}
+    assert any(cache['kind'] == 'cache_data' and cache['entries'] > 0 for cache in report['caches'])
+    assert report['sessions'] == {'count': 0, 'bytes': 0, 'sessions': []}
+    assert [consumer['bytes'] for consumer in report['top']] == sorted((consumer['bytes'] for consumer in report['top']), reverse=True)
+
+def test_changed_streamlit_internals_are_reported_unavailable(monkeypatch, caplog):
+    monkeypatch.setattr(cache_data_api, '_data_caches', object())
+    with caplog.at_level(logging.WARNING, logger=memory.logger.name):
+        report = memory.memory_report()
+    assert report['caches'] is None
+    assert 'unavailable' in caplog.text
+    memory.log_report(report)
+    monkeypatch.setattr(cache_resource_api, '_resource_caches', None)
+    assert memory.cache_usage() is None
+
+def diagnostics_page():
+    return AppTest.from_file(os.path.abspath('pages/4_diagnostics.py'), default_timeout=120)
+
+def test_diagnostics_page_is_off_by_default(monkeypatch):
+    monkeypatch.delenv('BILLING_DIAGNOSTICS', raising=False)
+    at = diagnostics_page().run()
+    assert not at.exception
+    assert not at.metric and not at.dataframe
+    assert 'BILLING_DIAGNOSTICS' in at.info[0].value
+
+def test_diagnostics_page_renders_unavailable_sections(monkeypatch):
+    monkeypatch.setenv('BILLING_DIAGNOSTICS', '1')
+    monkeypatch.setattr(memory, 'cache_usage', lambda: None)
+    monkeypatch.setattr(memory, 'session_usage', lambda: None)
+    at = diagnostics_page().run()
+    assert not at.exception
+    assert [metric.value for metric in at.metric][-2:] == ['unavailable', 'unavailable']
+
+def test_format_bytes():
+    assert memory.format_bytes(512) == '512 B'
+    assert memory.format_bytes(1536) == '1.5 KiB'
+    assert memory.format_bytes(3 * 2 ** 30) == '3.00 GiB'
+    assert memory.format_bytes(None) == 'unavailable'
@@ -0,0 +1,42 @@
+import pandas as pd
+import pytest
+from functions import metrics
+
+
+def test_order_kpis_match_the_line_items(prepared):
+    kpis = metrics.order_kpis(prepared)
+    year = prepared['created_at'].dt.year
+    current = prepared[year == kpis['current_year']]
+    previous = prepared[year == kpis['current_year'] - 1]
+    assert kpis['total_revenue'] == pytest.approx(prepared['total_amount'].sum())
+    assert kpis['number_of_orders'] == prepared['header_id'].nunique()
+    assert kpis['number_of_customers'] == prepared['customer_id'].nunique()
+    assert kpis['number_of_orders_yoy'] == pytest.approx((current['header_id'].nunique() / previous['header_id'].nunique() - 1) * 100)
+
+def test_memoized_results_equal_the_uncached_metric(prepared):
+    assert metrics.revenue_by_product(prepared).equals(metrics.revenue_by_product.uncached(prepared))
+    # A hit returns an equal result
+    assert metrics.revenue_by_product(prepared).equals(metrics.revenue_by_product(prepared))
+
+def test_customer_table_has_one_row_per_customer(prepared):
+    table = metrics.customer_table(prepared)
+    assert table['ID'].is_unique
+    assert set(table['ID']) == set(prepared['customer_id'].dropna())
+    spend = prepared.groupby('customer_id')['total_amount'].sum()
+    assert table.set_index('ID')['Total Spend'].sort_index().to_numpy() == pytest.approx(spend.sort_index().to_numpy())
+
+def test_fingerprint_follows_the_content_of_untagged_frames(prepared):
+    frame = pd.DataFrame(prepared[['header_id', 'total_amount']].to_numpy(), columns=['header_id', 'total_amount'])
+    assert metrics.fingerprint(frame) == metrics.fingerprint(frame.copy())
+    changed = frame.copy()
+    changed.loc[0, 'total_amount'] = -1
+    assert metrics.fingerprint(changed) != metrics.fingerprint(frame)
+
+@pytest.mark.parametrize('page', metrics.report_pages)
+def test_page_tasks_produce_the_page_totals(page, prepared):
+    tasks = metrics.page_tasks(page, prepared)
+    assert set(metrics.page_totals[page]) <= set(tasks)
+    for task, names in metrics.page_totals[page].items():
+        func, *args = tasks[task]
+        result = func(*args)
+        assert all(name in result for name in names)
@@ -0,0 +1,37 @@
+import numpy as np
+import pandas as pd
+from functions import periods
+
+
+dates = pd.Series(pd.to_datetime(['2024-01-31 23:59', '2024-02-01 00:00', None, '1969-12-15 00:00', '2023-11-05 00:00']))
+
+def test_month_keys_match_periods():
+    keys = periods.month_keys(dates)
+    expected = [period.year * 12 + period.month for period in dates.dt.to_period('M').dropna()]
+    assert keys[dates.notna().to_numpy()].tolist() == expected
+    assert keys[2] == periods.missing_key
+    assert keys.dtype == np.int32
+
+def test_quarter_keys_are_the_first_month_of_the_quarter():
+    quarters = periods.quarter_keys(periods.month_keys(dates))
+    assert periods.labels(quarters[[0, 1, 4]]) == ['2024-01', '2024-01', '2023-10']
+    assert quarters[2] == periods.missing_key
+
+def test_keys_round_trip_to_timestamps_and_labels():
+    keys = periods.month_keys(dates)
+    assert periods.timestamps(keys)[[0, 3]].tolist() == [pd.Timestamp('2024-01-01'), pd.Timestamp('1969-12-01')]
+    assert pd.isna(periods.timestamps(keys)[2])
+    assert periods.labels(keys[[0, 1, 3]]) == ['2024-01', '2024-02', '1969-12']
+    assert periods.years(keys[[0, 4]]).tolist() == [2024, 2023]
+
+def test_missing_dates_fall_below_every_range():
+    keys = periods.month_keys(dates)
+    assert ((keys >= periods.month_keys(pd.Series(pd.to_datetime(['1900-01-01'])))[0]) == dates.notna()).all()
+
+def test_loaded_dataset_carries_the_keys(dataset):
+    for column in periods.date_columns:
+        month = periods.month_keys(dataset[column])
+        assert np.array_equal(dataset[periods.key_column(column)].to_numpy(), month), column
+        assert np.array_equal(dataset[periods.key_column(column, 'Quarter')].to_numpy(), periods.quarter_keys(month)), column
+    # Frames derived from the dataset reuse them
+    assert periods.key_values(dataset) == {}
@@ -0,0 +1,112 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+import pandas as pd
+import pytest
+from streamlit.testing.v1 import AppTest
+from functions import metrics, periods, progressive
+from functions.executor import run_concurrently
+
+
+@pytest.fixture
+def progressive_mode(monkeypatch):
+    # The example dataset is rendered from a sample of about 1,000 rows
+    monkeypatch.setenv('BILLING_RENDER_MODE', 'progressive')
+    monkeypatch.setattr(progressive, 'progressive_min_rows', 1_000)
+    monkeypatch.setattr(progressive, 'sample_rows', 1_000)
+    monkeypatch.setattr(progressive, '_jobs', OrderedDict())
+
+def strata(data):
+    return set(zip(data[periods.key_column('created_at')], data['subscription_plan'].fillna('')))
+
+def test_sample_keeps_whole_customers_and_every_stratum(prepared):
+    sampled = progressive.stratified_sample(prepared, 1_000)
+    assert 0 < len(sampled) < len(prepared) / 2
+    assert prepared['customer_id'].isin(set(sampled['customer_id'])).sum() == len(sampled)
+    assert strata(sampled) == strata(prepared)
+    assert progressive.stratified_sample(prepared, 1_000).index.equals(sampled.index)
+
+def test_sums_and_counts_are_scaled(monkeypatch):
+    monkeypatch.setitem(metrics.page_totals, 'page', {'kpis': ['total_revenue', 'number_of_orders', 'number_of_customers'],
+                                                       'monthly': ['total_amount']})
+    results = {
+        'kpis': {'total_revenue': 10.0, 'number_of_orders': 7, 'number_of_customers': 3, 'total_revenue_yoy': 'New'},
+        'monthly': pd.DataFrame({'total_amount': [1, 2], 'average': [0.5, 1.5]}),
+    }
+    scaled = progressive.scale_results('page', results, {None: 2.5, 'header_id': 4.0})
+    assert scaled['kpis'] == {'total_revenue': 25.0, 'number_of_orders': 28, 'number_of_customers': 8, 'total_revenue_yoy': 'New'}
+    assert scaled['monthly']['total_amount'].tolist() == [2, 5]
+    assert pd.api.types.is_integer_dtype(scaled['monthly']['total_amount'])
+    assert scaled['monthly']['average'].tolist() == [0.5, 1.5]
+    assert results['kpis']['total_revenue'] == 10.0
+
+def test_scaled_sample_estimates_the_totals(progressive_mode, prepared):
+    sampled, factors = progressive.sample(prepared)
+    assert factors[None] == prepared['customer_code'].nunique() / sampled['customer_code'].nunique()
+    estimate = progressive.scale_results('orders_and_revenue', run_concurrently(metrics.page_tasks('orders_and_revenue', sampled)), factors)['kpis']
+    exact = metrics.order_kpis(prepared)
+    assert estimate['number_of_customers'] == pytest.approx(exact['number_of_customers'], rel=0.01)
+    for name in ['number_of_orders', 'total_revenue']:
+        assert estimate[name] == pytest.approx(exact[name], rel=0.5), name
+
+def test_sample_reads_the_ledger_of_its_subscriptions(progressive_mode, prepared):
+    sampled, _ = progressive.sample(prepared)
+    ledger = metrics.mrr_ledger(sampled)
+    subscriptions = set(prepared.loc[prepared['customer_id'].isin(set(sampled['customer_id'])), 'subscription_id'].dropna())
+    assert 0 < ledger['subscription_id'].nunique() < metrics.mrr_ledger(prepared)['subscription_id'].nunique()
+    assert set(ledger['subscription_id']) <= subscriptions
+
+def test_small_inputs_are_computed_exactly(prepared, monkeypatch):
+    monkeypatch.setenv('BILLING_RENDER_MODE', 'progressive')
+    assert not progressive.progressive(prepared)
+    monkeypatch.setenv('BILLING_RENDER_MODE', 'fastest')
+    with pytest.raises(ValueError):
+        progressive.render_mode()
+
+def badges(at):
+    return [markdown.value for markdown in at.markdown if 'badge[' in markdown.value]
+
+def orders_page():
+    return AppTest.from_file(os.path.abspath('pages/1_orders_and_revenue.py'), default_timeout=300)
+
+def test_page_is_refined_to_the_exact_results(progressive_mode, monkeypatch):
+    # The exact job waits for the approximate page to be checked, as with warm caches it can finish within the first run
+    gate = threading.Event()
+    pool = ThreadPoolExecutor(max_workers=1)
+
+    class Gated:
+        def submit(self, fn, *args):
+            return pool.submit(lambda: gate.wait(60) and fn(*args))
+
+    monkeypatch.setattr(progressive, '_exact_pool', lambda: Gated())
+    at = orders_page().run()
+    assert not at.exception
+    assert [badge.endswith('Approximate]') for badge in badges(at)] == [True]
+    assert 'Estimated from a sample' in at.caption[0].value
+    gate.set()
+    for job in progressive._jobs.values():
+        job.result(timeout=120)
+    at.run()
+    pool.shutdown()
+    assert not at.exception
+    assert not badges(at)
+    monkeypatch.setenv('BILLING_RENDER_MODE', 'exact')
+    assert [metric.value for metric in at.metric] == [metric.value for metric in orders_page().run().metric]
+
+def test_a_failed_exact_job_is_shown_and_not_resubmitted(progressive_mode, monkeypatch):
+    submitted = []
+
+    class Failing:
+        def submit(self, *args):
+            future = Future()
+            future.set_exception(RuntimeError('boom'))
+            submitted.append(future)
+            return future
+
+    monkeypatch.setattr(progressive, '_exact_pool', lambda: Failing())
+    at = orders_page().run()
+    assert 'boom' in at.error[0].value
+    at.run()
+    assert 'boom' in at.error[0].value
+    assert len(submitted) == 1
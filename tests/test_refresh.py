@@ -0,0 +1,62 @@
+import os
+import shutil
+import time
+import pytest
+from functions import query
+
+
+@pytest.fixture
+def source(tmp_path, monkeypatch):
+    # A private copy of the example dataset, refreshed without waiting
+    path = str(tmp_path / 'example__line_item_enhanced.csv')
+    shutil.copy(query.DATA_PATH, path)
+    monkeypatch.setattr(query, 'refresh_seconds', 0)
+    yield path
+    with query._datasets_lock:
+        query._datasets.pop(path, None)
+
+def append_row(path):
+    with open(path) as f:
+        header, first = f.readline(), f.readline()
+    with open(path, 'a') as f:
+        f.write(first)
+
+def wait_for_refresh(path, timeout=60):
+    state = query._dataset_state(path)
+    deadline = time.monotonic() + timeout
+    while state['refreshing'] and time.monotonic() < deadline:
+        time.sleep(0.05)
+    assert not state['refreshing']
+
+def test_a_changed_source_is_served_stale_then_swapped(source):
+    first = query.load_current(source)
+    append_row(source)
+    # The current version is served at once, the new one is loaded in the background
+    assert query.load_current(source) is first
+    wait_for_refresh(source)
+    refreshed = query.load_current(source)
+    assert len(refreshed) == len(first) + 1
+
+def test_an_unchanged_source_keeps_its_frame(source):
+    first = query.load_current(source)
+    os.utime(source)
+    query.load_current(source)
+    wait_for_refresh(source)
+    assert query.load_current(source) is first
+
+def test_a_failed_refresh_keeps_serving_the_current_version(source, monkeypatch):
+    first = query.load_current(source)
+    append_row(source)
+
+    def fail(path):
+        raise OSError('source unavailable')
+
+    monkeypatch.setattr(query, 'read_source', fail)
+    assert query.load_current(source) is first
+    wait_for_refresh(source)
+    assert query.load_current(source) is first
+
+def test_refresh_mode_is_validated(monkeypatch):
+    monkeypatch.setenv('BILLING_REFRESH_MODE', 'never')
+    with pytest.raises(ValueError):
+        query.refresh_mode()
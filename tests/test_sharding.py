@@ -0,0 +1,56 @@
+import numpy as np
+import pandas as pd
+import pytest
+from functions import metrics, sharding
+
+
+@pytest.fixture(scope='module')
+def sharded():
+    # Two worker processes and no row threshold, so the example dataset is sharded
+    with pytest.MonkeyPatch.context() as patch:
+        patch.setenv('BILLING_SHARD_WORKERS', '2')
+        patch.setattr(sharding, 'shard_row_threshold', 0)
+        yield
+        sharding._shutdown()
+        sharding._workers.clear()
+
+def test_partition_keeps_customers_together_and_rows_in_order(dataset):
+    codes, positions, orders = sharding.partition(dataset, 3)
+    assert sorted(np.concatenate(orders).tolist()) == list(range(len(dataset)))
+    for shard, order in enumerate(orders):
+        assert (codes[order] == shard).all()
+        assert (np.diff(order) > 0).all()
+        assert (positions[order] == np.arange(len(order))).all()
+    assert (pd.Series(codes).groupby(dataset['customer_id'].to_numpy()).nunique() == 1).all()
+
+def test_small_inputs_are_aggregated_in_process(prepared, monkeypatch):
+    monkeypatch.setattr(sharding, 'map_customer_shards', None)
+    assert sharding.by_customer(metrics.customer_facts, prepared, metrics.customer_fact_columns).equals(metrics.customer_facts(prepared))
+
+def test_sharded_customer_facts_equal_in_process(sharded, prepared):
+    result = sharding.by_customer(metrics.customer_facts, prepared, metrics.customer_fact_columns)
+    assert sharding._shard_sets
+    assert result.sort_index().equals(metrics.customer_facts(prepared).sort_index())
+
+def test_sharded_cohort_equals_in_process(sharded, prepared, date_range):
+    start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+    subscribed = prepared[prepared['subscription_id'].notna() & prepared['subscription_period_started_at'].between(start, end)]
+    result = sharding.by_customer(metrics.subscription_cohort, subscribed, metrics.cohort_columns, prepared)
+    assert result.sort_index().equals(metrics.subscription_cohort(subscribed).sort_index())
+
+def test_sharded_pages_equal_in_process(sharded, prepared, date_range):
+    start, end = pd.Timestamp(date_range[0]), pd.Timestamp(date_range[1])
+    table = metrics.customer_table.uncached(prepared)
+    cohort = metrics.cohort_churn.uncached(prepared, start, end)
+    sharding.shard_row_threshold, threshold = 10 ** 12, sharding.shard_row_threshold
+    try:
+        assert table.equals(metrics.customer_table.uncached(prepared))
+        expected = metrics.cohort_churn.uncached(prepared, start, end)
+    finally:
+        sharding.shard_row_threshold = threshold
+    assert all(cohort[name].equals(expected[name]) for name in expected)
+
+def test_shards_are_written_once_per_dataset_version(sharded, dataset):
+    shards = sharding.shard_set(dataset, metrics.customer_fact_columns)
+    assert sharding.shard_set(dataset, metrics.customer_fact_columns) is shards
+    assert sum(size for _, size in shards['segments']) > 0
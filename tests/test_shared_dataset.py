@@ -0,0 +1,80 @@
+import os
+import shutil
+import subprocess
+import sys
+import pandas as pd
+import pytest
+from functions import metrics, query, shared_dataset, versions
+
+
+@pytest.fixture
+def store(tmp_path, monkeypatch):
+    monkeypatch.setenv('BILLING_DATASET_STORE', 'arrow')
+    monkeypatch.setenv('BILLING_SHARED_DATASET_DIR', str(tmp_path / 'datasets'))
+    source = str(tmp_path / 'example__line_item_enhanced.csv')
+    shutil.copy(query.DATA_PATH, source)
+    return source
+
+def arrow_files(source):
+    return sorted(name for name in os.listdir(shared_dataset.shared_dataset_dir()) if name.endswith('.arrow'))
+
+def test_a_version_is_written_once_and_mapped_after(store):
+    reads = []
+    read = lambda path: reads.append(path) or query.read_source(path)
+    version = versions.dataset_version(store)
+    first = shared_dataset.load(store, version, read)
+    second = shared_dataset.load(store, version, read)
+    assert reads == [store]
+    assert arrow_files(store) == [os.path.basename(shared_dataset.arrow_path(store, version))]
+    assert first['line_item_id'].equals(second['line_item_id'])
+
+def test_mapped_frame_has_the_values_of_the_source(store):
+    mapped = query.read_version(store, versions.dataset_version(store))
+    source = query.read_source(store)
+    assert list(mapped.columns) == list(source.columns)
+    for column in source.columns:
+        assert mapped[column].astype(object).where(mapped[column].notna(), None).tolist() == source[column].astype(object).where(source[column].notna(), None).tolist(), column
+    assert isinstance(mapped['customer_id'].dtype, pd.StringDtype)
+
+def test_metrics_are_the_same_over_the_mapped_frame(store):
+    mapped = metrics.prepare(query.read_version(store, versions.dataset_version(store)))
+    source = metrics.prepare(query.read_source(store))
+    for metric in [metrics.order_kpis, metrics.subscription_kpis, metrics.revenue_by_product]:
+        assert str(metric.uncached(mapped)) == str(metric.uncached(source))
+
+def test_a_new_version_replaces_the_old_file(store):
+    old = versions.dataset_version(store)
+    shared_dataset.load(store, old, query.read_source)
+    with open(store, 'a') as f:
+        f.write('\n')
+    new = versions.dataset_version(store)
+    shared_dataset.load(store, new, query.read_source)
+    assert arrow_files(store) == [os.path.basename(shared_dataset.arrow_path(store, new))]
+
+def test_other_processes_map_the_written_file(store):
+    version = versions.dataset_version(store)
+    rows = len(shared_dataset.load(store, version, query.read_source))
+    script = (
+        "import sys\n"
+        "from functions import shared_dataset\n"
+        "def read(path): raise AssertionError('read the source again')\n"
+        f"print(len(shared_dataset.load({store!r}, {version!r}, read)))\n"
+    )
+    result = subprocess.run([sys.executable, '-c', script], capture_output=True, text=True, env=dict(os.environ), check=True)
+    assert int(result.stdout) == rows
+
+def test_sources_with_similar_names_keep_their_own_files(store, tmp_path):
+    # Two sources with the same file name, and one whose name starts with the other's
+    others = [str(tmp_path / 'eu' / 'example__line_item_enhanced.csv'), str(tmp_path / 'example__line_item_enhanced-eu.csv')]
+    os.makedirs(tmp_path / 'eu')
+    for other in others:
+        shutil.copy(store, other)
+        with open(other, 'a') as f:
+            f.write('\n')
+    loaded = [(path, versions.dataset_version(path)) for path in [store] + others]
+    for path, version in loaded:
+        shared_dataset.load(path, version, query.read_source)
+    assert len({shared_dataset.arrow_path(path, version) for path, version in loaded}) == 3
+    assert arrow_files(store) == sorted(os.path.basename(shared_dataset.arrow_path(path, version)) for path, version in loaded)
+    for path, version in loaded:
+        shared_dataset.load(path, version, lambda path: pytest.fail('read the source again'))
@@ -0,0 +1,103 @@
+import numpy as np
+import pandas as pd
+import pytest
+from functions import metrics, sketches, versions
+
+
+def hashes(values):
+    return sketches.hash_values(pd.Series(values))
+
+def count(values):
+    return sketches.estimate(sketches.sketch(hashes(values))[0])
+
+def within_bound(estimate, exact):
+    return abs(estimate - exact) <= 3 * sketches.relative_error * exact
+
+@pytest.mark.parametrize('values', [1_000, 200_000, 1_000_000])
+def test_counts_are_within_the_error_bound(values):
+    values = np.random.default_rng(values).permutation(values).astype(str)
+    assert within_bound(count(np.repeat(values, 2)), len(values))
+
+@pytest.mark.parametrize('values', [1, 10, 100])
+def test_small_counts_are_exact(values):
+    assert count(np.arange(values).astype(str)) == values
+
+def test_missing_values_are_not_counted():
+    assert count(['a', None, 'b', np.nan, 'a']) == 2
+
+def test_group_sketches_merge_into_the_sketch_of_the_union():
+    values = np.arange(100_000).astype(str)
+    groups = np.arange(len(values)) % 7
+    by_group = sketches.sketch(hashes(values), groups, 7)
+    assert np.array_equal(sketches.merge(by_group), sketches.sketch(hashes(values))[0])
+    assert np.array_equal(by_group[3], sketches.sketch(hashes(values[groups == 3]))[0])
+    estimates = sketches.estimate(by_group)
+    assert all(within_bound(estimate, (groups == group).sum()) for group, estimate in enumerate(estimates))
+
+@pytest.fixture
+def approximate(monkeypatch):
+    monkeypatch.setenv('BILLING_DISTINCT_COUNTS', 'approximate')
+    monkeypatch.setattr(sketches, 'approximate_min_rows', 0)
+
+def test_sparse_sketches_merge_into_dense_ones():
+    values = np.arange(50_000).astype(str)
+    cells = np.arange(len(values)) % 10
+    dense = sketches.sketch(hashes(values), cells, 10)
+    sparse = sketches.sparse_sketch(hashes(values), cells)
+    assert np.array_equal(sketches.densify(sparse, np.arange(10), 10), dense)
+    merged = sketches.densify(sparse, [0, 0, 1, 1, -1, 1, 0, 0, 0, 0], 2)
+    assert np.array_equal(merged[1], sketches.merge(dense[[2, 3, 5]]))
+
+def assert_close(estimated, exact):
+    assert estimated.index.equals(exact.index)
+    assert all(within_bound(estimate, expected) or abs(estimate - expected) <= 1 for estimate, expected in zip(estimated, exact.to_numpy()))
+
+@pytest.fixture
+def sketched_rows(monkeypatch):
+    # Rows sketched from the input rather than read from the stored sketches
+    sketched = []
+    sketch = sketches.sketch
+    monkeypatch.setattr(sketches, 'sketch', lambda hashes, *args: sketched.append(len(hashes)) or sketch(hashes, *args))
+    return sketched
+
+def test_approximate_distinct_counts_match_exact_ones(approximate, prepared, sketched_rows):
+    months = metrics.period_keys(prepared, 'created_at', 'Month')
+    estimated = metrics.distinct_counts(prepared, 'customer_id', months, (prepared, 'line_items', 'Month', ()))
+    assert_close(estimated, prepared.groupby(months)['customer_id'].nunique())
+    # Only the months at the ends of the date range are sketched from rows
+    first, last = metrics.complete_months(prepared['created_at'].min(), prepared['created_at'].max())
+    assert sketched_rows == [(~months.between(first, last)).sum()] and sketched_rows[0] < len(prepared) / 4
+
+def test_a_selection_merges_the_stored_sketches_of_its_values(approximate, prepared, sketched_rows):
+    selected = versions.derive(prepared[prepared['payment_method'].isin(['bank_transfer', 'credit_card'])], prepared, 'filters', (('payment_method', ('bank_transfer', 'credit_card')),))
+    subscribed = selected[selected['subscription_id'].notna()]
+    keys = ['subscription_plan', metrics.created_month]
+    estimated = metrics.distinct_counts(subscribed, 'customer_id', keys, (selected, 'subscribed', 'Month', ['subscription_plan']))
+    assert_close(estimated, subscribed.groupby(keys)['customer_id'].nunique())
+    quarters = metrics.period_keys(selected, 'created_at', 'Quarter')
+    estimated = metrics.distinct_counts(selected, 'header_id', quarters, (selected, 'line_items', 'Quarter', ()))
+    assert_close(estimated, selected.groupby(quarters)['header_id'].nunique())
+    assert max(sketched_rows) < len(selected) / 4
+
+def test_other_selections_are_counted_exactly(approximate, prepared, sketched_rows):
+    mask = (prepared['payment_method'] == 'paypal') & (prepared['subscription_plan'] == 'Basic')
+    selections = (('subscription_plan', ('Basic',)), ('payment_method', ('paypal',)))
+    for selected in [versions.derive(prepared[mask], prepared, 'filters', selections), prepared[mask]]:
+        months = metrics.period_keys(selected, 'created_at', 'Month')
+        counts = metrics.distinct_counts(selected, 'customer_id', months, (selected, 'line_items', 'Month', ()))
+        assert counts.equals(selected.groupby(months)['customer_id'].nunique())
+    days = metrics.period_keys(prepared, 'created_at', 'Day')
+    assert metrics.distinct_counts(prepared, 'header_id', days, (prepared, 'line_items', 'Day', ())).equals(prepared.groupby(days)['header_id'].nunique())
+    assert sketched_rows == []
+
+def test_approximate_order_kpis(approximate, prepared):
+    kpis = metrics.order_kpis(prepared)
+    assert within_bound(kpis['number_of_orders'], prepared['header_id'].nunique())
+    assert within_bound(kpis['number_of_customers'], prepared['customer_id'].nunique())
+
+def test_small_inputs_are_counted_exactly(monkeypatch, prepared):
+    monkeypatch.setenv('BILLING_DISTINCT_COUNTS', 'approximate')
+    assert not sketches.approximate(prepared)
+    monkeypatch.setenv('BILLING_DISTINCT_COUNTS', 'sometimes')
+    with pytest.raises(ValueError):
+        sketches.distinct_count_mode()
@@ -0,0 +1,43 @@
+import shutil
+import pandas as pd
+import pytest
+from functions import customers, query
+
+
+def test_sources_are_named_by_file_or_explicitly(monkeypatch):
+    monkeypatch.delenv('BILLING_DATA_SOURCES', raising=False)
+    assert query.data_sources() is None
+    monkeypatch.setenv('BILLING_DATA_SOURCES', 'data/stripe__line_item_enhanced.csv, , apple = exports/a.parquet')
+    assert query.data_sources() == [('stripe', 'data/stripe__line_item_enhanced.csv'), ('apple', 'exports/a.parquet')]
+    monkeypatch.setenv('BILLING_DATA_SOURCES', 'a/stripe__line_item_enhanced.csv,b/stripe__line_item_enhanced.csv')
+    with pytest.raises(ValueError):
+        query.data_sources()
+
+@pytest.fixture
+def sources(tmp_path, monkeypatch):
+    monkeypatch.setenv('BILLING_REFRESH_MODE', 'version')
+    paths = []
+    for name in ['stripe', 'recurly']:
+        paths.append((name, str(tmp_path / f'{name}__line_item_enhanced.csv')))
+        shutil.copy(query.DATA_PATH, paths[-1][1])
+    return paths
+
+def test_union_has_a_source_column_and_codes_over_all_sources(sources, dataset):
+    union = query.current_union(sources)['data']
+    assert len(union) == 2 * len(dataset)
+    assert isinstance(union[query.source_column].dtype, pd.CategoricalDtype)
+    assert union[query.source_column].value_counts().to_dict() == {'stripe': len(dataset), 'recurly': len(dataset)}
+    # A customer in both sources has one code
+    assert union.groupby('customer_id')[customers.code_column].nunique().max() == 1
+    assert union[customers.code_column].tolist() == customers.customer_codes(union['customer_id']).tolist()
+    assert customers.dimension(union)['customer_id'].tolist() == sorted(dataset['customer_id'].dropna().unique())
+
+def test_union_is_rebuilt_only_when_a_source_changes(sources):
+    first = query.current_union(sources)
+    assert query.current_union(sources) is first
+    with open(sources[1][1], 'a') as f:
+        f.write('\n')
+    second = query.current_union(sources)
+    assert second['version'] != first['version']
+    assert second['sources']['stripe'] == first['sources']['stripe']
+    assert second['sources']['recurly'] != first['sources']['recurly']
@@ -0,0 +1,66 @@
+import gc
+import os
+import shutil
+import pandas as pd
+import pytest
+from functions import filters, metrics, query, versions
+
+
+@pytest.fixture
+def source(tmp_path):
+    path = str(tmp_path / 'example__line_item_enhanced.csv')
+    shutil.copy(query.DATA_PATH, path)
+    return path
+
+def test_touching_a_file_keeps_its_version(source):
+    version = versions.dataset_version(source)
+    os.utime(source, ns=(1, 1))
+    assert versions.dataset_version(source) == version
+
+def test_changing_a_file_changes_its_version(source):
+    version = versions.dataset_version(source)
+    with open(source, 'a') as f:
+        f.write('\n')
+    assert versions.dataset_version(source) != version
+
+def test_version_covers_the_reporting_currency_and_count_mode(source, monkeypatch):
+    version = versions.dataset_version(source)
+    monkeypatch.setenv('BILLING_REPORTING_CURRENCY', 'EUR')
+    assert versions.dataset_version(source) != version
+    monkeypatch.delenv('BILLING_REPORTING_CURRENCY')
+    monkeypatch.setenv('BILLING_DISTINCT_COUNTS', 'approximate')
+    assert versions.dataset_version(source) != version
+
+def test_derived_keys_follow_the_steps():
+    dataset = versions.tag(pd.DataFrame({'a': [1, 2, 3]}), 'v1')
+    first = versions.derive(dataset[dataset['a'] > 1], dataset, 'filters', (('a', (2, 3)),))
+    same = versions.derive(dataset[dataset['a'] > 1], dataset, 'filters', (('a', (2, 3)),))
+    other = versions.derive(dataset[dataset['a'] > 2], dataset, 'filters', (('a', (3,)),))
+    assert versions.key_of(first) == versions.key_of(same) != versions.key_of(other)
+    assert versions.dataset_of(other) == 'v1'
+    assert versions.lineage(versions.derive(first.copy(), first, 'prepared')) == (('filters', (('a', (2, 3)),)), ('prepared',))
+    # A new dataset version gives every derived frame a new key
+    reloaded = versions.tag(dataset.copy(), 'v2')
+    assert versions.key_of(versions.derive(reloaded[reloaded['a'] > 1], reloaded, 'filters', (('a', (2, 3)),))) != versions.key_of(first)
+
+def test_untagged_frames_stay_untagged_and_fall_back_to_content_hashes():
+    frame = pd.DataFrame({'a': [1, 2, 3]})
+    derived = versions.derive(frame[frame['a'] > 1], frame, 'filters', ())
+    assert versions.key_of(derived) is None
+    assert metrics.fingerprint(derived) == metrics.fingerprint(frame[frame['a'] > 1])
+
+def test_keys_are_forgotten_with_their_frames():
+    frame = versions.tag(pd.DataFrame({'a': [1]}), 'short-lived')
+    assert any(key == 'short-lived' for key, _, _ in versions.live_frames())
+    del frame
+    gc.collect()
+    assert not any(key == 'short-lived' for key, _, _ in versions.live_frames())
+
+def test_page_frames_are_keyed_on_the_dataset_version(dataset, date_filtered, prepared):
+    version = versions.key_of(dataset)
+    assert version == versions.dataset_version(query.DATA_PATH)
+    assert versions.dataset_of(prepared) == version
+    assert [step[0] for step in versions.lineage(prepared)] == ['dates', 'segments', 'prepared']
+    assert metrics.fingerprint(prepared) == versions.key_of(prepared)
+    # The same date range of the same version has the same key
+    assert versions.key_of(filters.filter_data(*versions.lineage(date_filtered)[0][1:], dataset)) == versions.key_of(date_filtered)
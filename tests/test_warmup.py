@@ -0,0 +1,39 @@
+from datetime import date
+import pytest
+from functions import disk_cache, filters, metrics
+from functions.query import query_results
+from tools import warmup
+
+
+@pytest.fixture(scope='module')
+def report():
+    return warmup.warm_up()
+
+@pytest.fixture(scope='module')
+def default_view(report):
+    # The metrics input of a page opened with the initial date range and no filters
+    data = query_results()
+    start, end = warmup.default_dates(data['created_at'].min(), data['created_at'].max())
+    return metrics.prepare(filters.segmented(filters.filter_data(start, end, data)))
+
+def test_default_dates_follow_the_date_input():
+    assert warmup.default_dates(date(2024, 1, 1), date(2024, 6, 1)) == (date(2024, 1, 1), date(2024, 6, 1))
+    assert warmup.default_dates(date(2020, 1, 1), date(2024, 6, 1)) == (date(2023, 6, 2), date(2024, 6, 1))
+
+def test_report_times_every_page_task(report, default_view):
+    steps = dict(report)
+    assert {'load dataset', 'date filter', 'derived columns', 'filter options'} <= set(steps)
+    for page in metrics.report_pages:
+        assert {f'{page}: {name}' for name in metrics.page_tasks(page, default_view)} <= set(steps)
+    assert all(seconds >= 0 for seconds in steps.values())
+
+def test_pages_after_warm_up_are_cache_hits(default_view, monkeypatch):
+    # The default view of every page, at every granularity, is computed by the warm-up: nothing is computed again
+    def computed(key, compute):
+        raise AssertionError(f'{key[1]} was not warmed up')
+
+    monkeypatch.setattr(disk_cache, 'cached', computed)
+    for page in metrics.report_pages:
+        for granularity in metrics.granularities if page in metrics.granularity_pages else [metrics.default_granularity]:
+            for func, *args in metrics.page_tasks(page, default_view, granularity=granularity).values():
+                func(*args)
@@ -0,0 +1,241 @@
+# benchmark
+#
+# Headless benchmark of the app pages with Streamlit's AppTest. Every page is driven across a set of datasets
+# and filter scenarios: a cold run from empty in-memory and disk caches, then warm reruns. The cold run time, warm
+# rerun latency percentiles and peak memory are written to JSON and can be compared against a stored baseline.
+#
+#   python -m tools.benchmark --rows 100k 1M --output benchmarks/latest.json --baseline benchmarks/baseline.json
+
+import argparse
+import json
+import os
+import platform
+import sys
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+import numpy as np
+import pandas as pd
+import streamlit as st
+from streamlit.testing.v1 import AppTest
+from functions.query import DATA_PATH, clear_datasets, load_data
+from tools.generate_data import default_output_path, generate_dataset, parse_size
+
+PAGES = [
+    'billing_overview.py',
+    'pages/1_orders_and_revenue.py',
+    'pages/2_subscriptions_report.py',
+    'pages/3_churn_analysis.py',
+]
+REPORT_PAGES = PAGES[1:]
+SCENARIOS = ['default', 'narrow_date_range', 'all_filters']
+FILTER_LABELS = [
+    "Subscription Plan",
+    "Customer Segment",
+    "Purchase Location",
+    "Payment Method",
+    "Billing Source",
+    "Customer Tenure",
+    "Product Name",
+    "Subscription Status",
+]
+PERCENTILES = [50, 90, 95, 99]
+NARROW_RANGE_DAYS = 30
+DEFAULT_TOLERANCE = 0.20
+
+
+def resolve_datasets(rows, seed, datasets):
+    # Generated datasets are reused when a file for the same size and seed already exists.
+    paths = list(datasets)
+    for size in rows:
+        path = default_output_path(parse_size(size), seed, 'parquet')
+        if not os.path.exists(path):
+            print(f"Generating {path}...")
+            generate_dataset(parse_size(size), seed=seed, file_format='parquet', path=path)
+        paths.append(path)
+    return paths or [DATA_PATH]
+
+def dataset_bounds(path):
+    data = load_data(path)
+    return len(data), data['created_at'].max()
+
+def new_app(page, timeout):
+    return AppTest.from_file(os.path.abspath(page), default_timeout=timeout)
+
+def apply_scenario(at, scenario, max_date):
+    if scenario == 'narrow_date_range':
+        at.session_state['start_date'] = max_date - timedelta(days=NARROW_RANGE_DAYS)
+        at.session_state['end_date'] = max_date
+    at.run()
+    if scenario == 'all_filters':
+        # Select the first available option of each filter in turn, so the cascading option lists never
+        # produce an empty selection.
+        for label in FILTER_LABELS:
+            widget = next((w for w in at.multiselect if w.label == label), None)
+            if widget is not None and widget.options:
+                widget.set_value([widget.options[0]]).run()
+    return at
+
+def latency_summary(samples):
+    samples = np.asarray(samples)
+    summary = {f"p{p}": float(np.percentile(samples, p)) for p in PERCENTILES}
+    summary['mean'] = float(samples.mean())
+    summary['max'] = float(samples.max())
+    return summary
+
+@contextmanager
+def cold_caches():
+    # Clears the in-memory caches and points the disk cache (functions/disk_cache.py) at an empty directory, so the
+    # first run computes everything
+    st.cache_data.clear()
+    st.cache_resource.clear()
+    clear_datasets()
+    previous = os.environ.get('BILLING_DISK_CACHE_DIR')
+    with tempfile.TemporaryDirectory(prefix='billing-benchmark-') as directory:
+        os.environ['BILLING_DISK_CACHE_DIR'] = directory
+        try:
+            yield
+        finally:
+            if previous is None:
+                os.environ.pop('BILLING_DISK_CACHE_DIR', None)
+            else:
+                os.environ['BILLING_DISK_CACHE_DIR'] = previous
+
+def benchmark_page(page, scenario, max_date, repeats, timeout):
+    ## The cold run starts from empty caches; the timed reruns after it are warm (their aggregates are cache hits).
+    with cold_caches():
+        start = time.perf_counter()
+        at = new_app(page, timeout)
+        at = apply_scenario(at, scenario, max_date)
+        cold_seconds = time.perf_counter() - start
+        if at.exception:
+            return {'cold_seconds': cold_seconds, 'error': at.exception[0].message}
+
+        samples = []
+        for _ in range(repeats):
+            start = time.perf_counter()
+            at.run()
+            samples.append(time.perf_counter() - start)
+
+        # Memory is measured on a separate rerun so tracing overhead does not distort the latencies.
+        tracemalloc.start()
+        at.run()
+        _, peak_memory = tracemalloc.get_traced_memory()
+        tracemalloc.stop()
+
+    return {
+        'cold_seconds': cold_seconds,
+        'warm_latency_seconds': latency_summary(samples),
+        'peak_memory_bytes': peak_memory,
+        'error': at.exception[0].message if at.exception else None,
+    }
+
+def run_benchmarks(paths, pages, scenarios, repeats, timeout):
+    results = []
+    for path in paths:
+        previous_path = os.environ.get('BILLING_DATA_PATH')
+        os.environ['BILLING_DATA_PATH'] = path
+        try:
+            rows, max_date = dataset_bounds(path)
+            for page in pages:
+                for scenario in scenarios:
+                    if scenario != 'default' and page not in REPORT_PAGES:
+                        continue
+                    result = benchmark_page(page, scenario, max_date, repeats, timeout)
+                    result.update({'page': page, 'dataset': os.path.basename(path), 'rows': rows, 'scenario': scenario})
+                    results.append(result)
+                    print(format_result(result))
+        finally:
+            if previous_path is None:
+                os.environ.pop('BILLING_DATA_PATH', None)
+            else:
+                os.environ['BILLING_DATA_PATH'] = previous_path
+    return results
+
+def format_result(result):
+    name = f"{result['page']:<32} {result['dataset']:<40} {result['scenario']:<18}"
+    if result.get('error') or 'warm_latency_seconds' not in result:
+        return f"{name} ERROR: {result.get('error')}"
+    latency = result['warm_latency_seconds']
+    return (f"{name} cold {result['cold_seconds']:7.2f}s  warm p50 {latency['p50'] * 1000:8.1f}ms  p95 {latency['p95'] * 1000:8.1f}ms  "
+            f"peak {result['peak_memory_bytes'] / 2**20:8.1f}MiB")
+
+def result_key(result):
+    return result['page'], result['dataset'], result['scenario']
+
+def compare(results, baseline, tolerance):
+    # A result regresses when its cold run time, warm p50/p95 latency or peak memory exceeds the baseline by more than
+    # the tolerance.
+    baseline_by_key = {result_key(r): r for r in baseline['results']}
+    regressions = []
+    for result in results:
+        previous = baseline_by_key.get(result_key(result))
+        if previous is None or 'warm_latency_seconds' not in result or 'warm_latency_seconds' not in previous:
+            continue
+        measures = [
+            ('cold', result['cold_seconds'], previous['cold_seconds']),
+            ('warm_p50', result['warm_latency_seconds']['p50'], previous['warm_latency_seconds']['p50']),
+            ('warm_p95', result['warm_latency_seconds']['p95'], previous['warm_latency_seconds']['p95']),
+            ('peak_memory', result['peak_memory_bytes'], previous['peak_memory_bytes']),
+        ]
+        for measure, current, reference in measures:
+            if reference and current > reference * (1 + tolerance):
+                regressions.append({
+                    'page': result['page'],
+                    'dataset': result['dataset'],
+                    'scenario': result['scenario'],
+                    'measure': measure,
+                    'baseline': reference,
+                    'current': current,
+                    'change': current / reference - 1,
+                })
+    return regressions
+
+def environment():
+    return {
+        'created_at': datetime.now().isoformat(timespec='seconds'),
+        'host': platform.node(),
+        'cpu_count': os.cpu_count(),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'streamlit': st.__version__,
+    }
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the billing app pages headlessly.")
+    parser.add_argument('--rows', nargs='*', default=[], help="Generated dataset sizes to benchmark, e.g. 100k 1M")
+    parser.add_argument('--dataset', nargs='*', default=[], help="Existing dataset files to benchmark")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--pages', nargs='*', default=PAGES)
+    parser.add_argument('--scenarios', nargs='*', default=SCENARIOS, choices=SCENARIOS)
+    parser.add_argument('--repeats', type=int, default=10, help="Timed warm reruns per page and scenario")
+    parser.add_argument('--timeout', type=float, default=600, help="AppTest timeout per run, in seconds")
+    parser.add_argument('--output', default='benchmarks/latest.json')
+    parser.add_argument('--baseline', default=None, help="Baseline results to compare against")
+    parser.add_argument('--tolerance', type=float, default=DEFAULT_TOLERANCE)
+    args = parser.parse_args()
+
+    paths = resolve_datasets(args.rows, args.seed, args.dataset)
+    results = run_benchmarks(paths, args.pages, args.scenarios, args.repeats, args.timeout)
+    report = {'environment': environment(), 'repeats': args.repeats, 'results': results}
+
+    if args.baseline:
+        with open(args.baseline) as f:
+            baseline = json.load(f)
+        report['regressions'] = compare(results, baseline, args.tolerance)
+        for regression in report['regressions']:
+            print(f"REGRESSION {regression['page']} {regression['dataset']} {regression['scenario']} "
+                  f"{regression['measure']}: {regression['baseline']:.4g} -> {regression['current']:.4g} ({regression['change']:+.0%})")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} results to {args.output}")
+
+    failed = any(r.get('error') for r in results) or bool(report.get('regressions'))
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
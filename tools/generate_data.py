@@ -0,0 +1,280 @@
+# generate_data
+#
+# Builds synthetic *__line_item_enhanced datasets of any size from the distributions in the sample export,
+# so the report pages can be exercised at realistic scale. Output is fully determined by the seed.
+#
+#   python -m tools.generate_data --rows 1M --format parquet --seed 42
+
+import argparse
+import os
+import numpy as np
+import pandas as pd
+
+SAMPLE_PATH = 'data/example__line_item_enhanced.csv'
+OUTPUT_DIR = 'data/generated'
+DATE_COLUMNS = ['created_at', 'customer_created_at', 'payment_at', 'subscription_period_started_at', 'subscription_period_ended_at']
+SUBSCRIPTION_BILLING_TYPES = ['subscription', 'recurring']
+SIZE_SUFFIXES = {'k': 1_000, 'm': 1_000_000, 'b': 1_000_000_000}
+SECONDS_PER_DAY = 86400
+
+HEX_DIGITS = np.frombuffer(b'0123456789abcdef', dtype=np.uint8)
+UUID_POSITIONS = np.r_[0:8, 9:13, 14:18, 19:23, 24:36]
+
+
+def parse_size(value):
+    value = str(value).strip().lower().replace('_', '')
+    if value and value[-1] in SIZE_SUFFIXES:
+        return int(float(value[:-1]) * SIZE_SUFFIXES[value[-1]])
+    return int(value)
+
+def frequencies(series):
+    counts = series.value_counts(normalize=True)
+    return counts.index.to_numpy(), counts.to_numpy()
+
+def joint_frequencies(data, columns):
+    counts = data.groupby(columns).size()
+    return counts.index.to_frame(index=False), (counts / counts.sum()).to_numpy()
+
+def empirical(values):
+    values = pd.Series(values, dtype='float64').dropna()
+    return np.sort(values.to_numpy())
+
+def to_seconds(series):
+    return series.dropna().astype('datetime64[s]').astype('int64')
+
+def learn_profile(sample):
+    # Collect everything the generator needs from the sample: categorical frequencies, empirical numeric
+    # distributions and the relationships between headers, customers, locations and subscriptions.
+    for col in DATE_COLUMNS:
+        sample[col] = pd.to_datetime(sample[col])
+
+    subscriptions = sample[sample['subscription_id'].notna()]
+    refunds = sample[sample['refund_amount'].notna() & (sample['total_amount'] != 0)]
+    payments = sample[sample['payment_at'].notna()]
+
+    return {
+        'columns': list(sample.columns),
+        'lines_per_header': frequencies(sample.groupby('header_id').size()),
+        'header_status': frequencies(sample['header_status']),
+        'transaction_type': frequencies(sample['transaction_type']),
+        'billing_type': frequencies(sample['billing_type']),
+        'products': joint_frequencies(sample, ['product_id', 'product_name', 'product_type']),
+        'quantity': frequencies(sample['quantity']),
+        'unit_amount': empirical(sample['unit_amount']),
+        'discount_amount': empirical(sample['discount_amount']),
+        'tax_amount': empirical(sample['tax_amount']),
+        'fee_amount': empirical(sample['fee_amount']),
+        'refund_ratio': empirical(refunds['refund_amount'] / refunds['total_amount']),
+        'payment_method': frequencies(payments['payment_method']),
+        'payment_lag_seconds': empirical(to_seconds(payments['payment_at']) - to_seconds(payments['created_at'])),
+        'subscription_plan': frequencies(subscriptions['subscription_plan']),
+        'subscription_status': frequencies(subscriptions['subscription_status']),
+        'period_seconds': empirical(to_seconds(subscriptions['subscription_period_ended_at']) - to_seconds(subscriptions['subscription_period_started_at'])),
+        'customer_level': frequencies(sample['customer_level']),
+        'locations': joint_frequencies(sample, ['customer_city', 'customer_country', 'currency']),
+        'customer_names': sample['customer_name'].dropna().unique(),
+        'customer_emails': sample['customer_email'].dropna().unique(),
+        'customer_companies': sample['customer_company'].dropna().unique(),
+        'created_at_range': (to_seconds(sample['created_at']).min(), to_seconds(sample['created_at']).max()),
+        'customer_created_at_range': (to_seconds(sample['customer_created_at']).min(), to_seconds(sample['customer_created_at']).max()),
+    }
+
+def draw(rng, distribution, size):
+    values, probabilities = distribution
+    return values[rng.choice(len(values), size=size, p=probabilities)]
+
+def draw_empirical(rng, sorted_values, size):
+    # Inverse-CDF sampling, interpolating between the observed order statistics.
+    positions = rng.random(size) * (len(sorted_values) - 1)
+    return np.interp(positions, np.arange(len(sorted_values)), sorted_values)
+
+def uuid_strings(rng, size):
+    nibbles = rng.integers(0, 16, size=(size, 32), dtype=np.uint8)
+    nibbles[:, 12] = 4
+    nibbles[:, 16] = 8 + (nibbles[:, 16] & 3)
+    chars = np.full((size, 36), ord('-'), dtype=np.uint8)
+    chars[:, UUID_POSITIONS] = HEX_DIGITS[nibbles]
+    return chars.view('S36').ravel().astype(str).astype(object)
+
+def to_timestamps(seconds, mask=None):
+    stamps = np.asarray(seconds, dtype='int64').astype('datetime64[s]')
+    if mask is not None:
+        stamps[~mask] = np.datetime64('NaT')
+    return stamps
+
+def generate_customers(rng, profile, n_customers, max_subscriptions_per_customer):
+    locations, location_probabilities = profile['locations']
+    location_index = rng.choice(len(locations), size=n_customers, p=location_probabilities)
+    created_lo, created_hi = profile['customer_created_at_range']
+
+    customers = pd.DataFrame({
+        'customer_id': uuid_strings(rng, n_customers),
+        'customer_level': draw(rng, profile['customer_level'], n_customers),
+        'customer_name': rng.choice(profile['customer_names'], n_customers),
+        'customer_email': rng.choice(profile['customer_emails'], n_customers),
+        'customer_company': rng.choice(profile['customer_companies'], n_customers),
+        'customer_city': locations['customer_city'].to_numpy()[location_index],
+        'customer_country': locations['customer_country'].to_numpy()[location_index],
+        'currency': locations['currency'].to_numpy()[location_index],
+        'customer_created_at': rng.integers(created_lo, created_hi + 1, n_customers),
+        'subscription_count': rng.integers(1, max_subscriptions_per_customer + 1, n_customers),
+    })
+    customers['subscription_offset'] = customers['subscription_count'].cumsum() - customers['subscription_count']
+    return customers
+
+def generate_subscriptions(rng, profile, customers):
+    # Each customer owns one or more subscriptions; a subscription renews on a fixed period length
+    # starting some time after the customer was created.
+    owner = np.repeat(np.arange(len(customers)), customers['subscription_count'].to_numpy())
+    n_subscriptions = len(owner)
+    customer_created = customers['customer_created_at'].to_numpy()[owner]
+    _, created_hi = profile['created_at_range']
+
+    return pd.DataFrame({
+        'subscription_id': uuid_strings(rng, n_subscriptions),
+        'subscription_plan': draw(rng, profile['subscription_plan'], n_subscriptions),
+        'subscription_status': draw(rng, profile['subscription_status'], n_subscriptions),
+        'anchor': customer_created + (rng.random(n_subscriptions) * np.maximum(created_hi - customer_created, 0)).astype('int64'),
+        'period_seconds': np.maximum(draw_empirical(rng, profile['period_seconds'], n_subscriptions), SECONDS_PER_DAY).astype('int64'),
+    })
+
+def generate_chunk(rng, profile, customers, subscriptions, n_headers, first_header_number):
+    lines = draw(rng, profile['lines_per_header'], n_headers).astype('int64')
+    n_rows = int(lines.sum())
+    header_row = np.repeat(np.arange(n_headers), lines)
+    header_start = np.cumsum(lines) - lines
+    position = np.arange(n_rows) - header_start[header_row]
+
+    # Header-level attributes are shared by every line item of the header.
+    created_lo, created_hi = profile['created_at_range']
+    header_customer = rng.integers(0, len(customers), n_headers)
+    customer_created = customers['customer_created_at'].to_numpy()[header_customer]
+    earliest = np.maximum(created_lo, customer_created)
+    header_created = earliest + (rng.random(n_headers) * np.maximum(created_hi - earliest, 0)).astype('int64')
+    header_status = draw(rng, profile['header_status'], n_headers)
+    paid = header_status == 'completed'
+    payment_at = header_created + draw_empirical(rng, profile['payment_lag_seconds'], n_headers).astype('int64')
+
+    chunk = customers.iloc[header_customer[header_row]].drop(columns=['subscription_count', 'subscription_offset']).reset_index(drop=True)
+    chunk['header_id'] = uuid_strings(rng, n_headers)[header_row]
+    chunk['line_item_id'] = uuid_strings(rng, n_rows)
+    chunk['record_type'] = np.where(position == 0, 'header', 'line_item')
+    chunk['line_item_index'] = np.where(position == 0, first_header_number + header_row, position)
+    created_at = header_created[header_row]
+    chunk['created_at'] = to_timestamps(created_at)
+    chunk['customer_created_at'] = to_timestamps(chunk['customer_created_at'])
+    chunk['header_status'] = header_status[header_row]
+
+    row_paid = paid[header_row]
+    chunk['payment_id'] = np.where(row_paid, uuid_strings(rng, n_headers)[header_row], None)
+    chunk['payment_method_id'] = np.where(row_paid, uuid_strings(rng, n_headers)[header_row], None)
+    chunk['payment_method'] = np.where(row_paid, draw(rng, profile['payment_method'], n_headers)[header_row], None)
+    chunk['payment_at'] = to_timestamps(payment_at[header_row], row_paid)
+
+    # Line-item level attributes.
+    products, product_probabilities = profile['products']
+    product_index = rng.choice(len(products), size=n_rows, p=product_probabilities)
+    for col in products.columns:
+        chunk[col] = products[col].to_numpy()[product_index]
+    chunk['transaction_type'] = draw(rng, profile['transaction_type'], n_rows)
+    chunk['billing_type'] = draw(rng, profile['billing_type'], n_rows)
+    chunk['quantity'] = draw(rng, profile['quantity'], n_rows)
+    chunk['unit_amount'] = draw_empirical(rng, profile['unit_amount'], n_rows).round(2)
+    chunk['discount_amount'] = draw_empirical(rng, profile['discount_amount'], n_rows).round(2)
+    chunk['tax_amount'] = draw_empirical(rng, profile['tax_amount'], n_rows).round(2)
+    chunk['total_amount'] = (chunk['quantity'] * chunk['unit_amount'] - chunk['discount_amount'] + chunk['tax_amount']).round(2)
+    chunk['fee_amount'] = draw_empirical(rng, profile['fee_amount'], n_rows).round(2)
+    refunded = (chunk['transaction_type'] == 'refund').to_numpy()
+    refund_amount = (draw_empirical(rng, profile['refund_ratio'], n_rows) * chunk['total_amount']).round(2)
+    chunk['refund_amount'] = refund_amount.where(refunded)
+
+    # Subscription line items point at one of the customer's subscriptions and carry the period
+    # that contains the order date.
+    subscribed = chunk['billing_type'].isin(SUBSCRIPTION_BILLING_TYPES).to_numpy()
+    row_customer = header_customer[header_row]
+    pick = (rng.random(n_rows) * customers['subscription_count'].to_numpy()[row_customer]).astype('int64')
+    subscription_index = customers['subscription_offset'].to_numpy()[row_customer] + pick
+    anchor = subscriptions['anchor'].to_numpy()[subscription_index]
+    period = subscriptions['period_seconds'].to_numpy()[subscription_index]
+    period_number = (created_at - anchor) // period
+    period_start = anchor + period_number * period
+    chunk['subscription_id'] = np.where(subscribed, subscriptions['subscription_id'].to_numpy()[subscription_index], None)
+    chunk['subscription_plan'] = np.where(subscribed, subscriptions['subscription_plan'].to_numpy()[subscription_index], None)
+    chunk['subscription_status'] = np.where(subscribed, subscriptions['subscription_status'].to_numpy()[subscription_index], None)
+    chunk['subscription_period_started_at'] = to_timestamps(period_start, subscribed)
+    chunk['subscription_period_ended_at'] = to_timestamps(period_start + period, subscribed)
+
+    return chunk[profile['columns']]
+
+def generate_chunks(profile, rows, seed=42, chunk_rows=250_000, rows_per_customer=20, max_subscriptions_per_customer=3):
+    # Customers and subscriptions come from a single seeded stream; every chunk of line items gets its own
+    # stream derived from (seed, chunk number), so output only depends on the seed and chunk size.
+    rng = np.random.default_rng(seed)
+    customers = generate_customers(rng, profile, max(1, rows // rows_per_customer), max_subscriptions_per_customer)
+    subscriptions = generate_subscriptions(rng, profile, customers)
+
+    lines, probabilities = profile['lines_per_header']
+    headers_per_chunk = max(1, int(chunk_rows / float(np.dot(lines, probabilities))))
+    written = 0
+    header_number = 1
+    chunk_number = 0
+    while written < rows:
+        chunk_rng = np.random.default_rng([seed, chunk_number])
+        chunk = generate_chunk(chunk_rng, profile, customers, subscriptions, headers_per_chunk, header_number)
+        chunk = chunk.iloc[:rows - written]
+        written += len(chunk)
+        header_number += headers_per_chunk
+        chunk_number += 1
+        yield chunk
+
+def write_dataset(chunks, path, file_format):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if file_format == 'csv':
+        for i, chunk in enumerate(chunks):
+            chunk.to_csv(path, mode='w' if i == 0 else 'a', header=i == 0, index=False, date_format='%Y-%m-%d %H:%M:%S')
+    elif file_format == 'parquet':
+        import pyarrow as pa
+        import pyarrow.parquet as pq
+
+        writer = None
+        try:
+            for chunk in chunks:
+                table = pa.Table.from_pandas(chunk, preserve_index=False, schema=writer.schema if writer else None)
+                if writer is None:
+                    writer = pq.ParquetWriter(path, table.schema)
+                writer.write_table(table)
+        finally:
+            if writer is not None:
+                writer.close()
+    else:
+        raise ValueError(f"Unsupported format: {file_format}")
+
+def default_output_path(rows, seed, file_format):
+    return os.path.join(OUTPUT_DIR, f"line_item_enhanced_{rows}_seed{seed}.{file_format}")
+
+def generate_dataset(rows, seed=42, file_format='parquet', path=None, sample_path=SAMPLE_PATH, chunk_rows=250_000):
+    profile = learn_profile(pd.read_csv(sample_path))
+    path = path or default_output_path(rows, seed, file_format)
+    write_dataset(generate_chunks(profile, rows, seed=seed, chunk_rows=chunk_rows), path, file_format)
+    return path
+
+def main():
+    parser = argparse.ArgumentParser(description="Generate a synthetic line_item_enhanced dataset.")
+    parser.add_argument('--rows', nargs='+', default=['100k'], help="Row counts to generate, e.g. 100k 1M 10M")
+    parser.add_argument('--format', nargs='+', default=['parquet'], choices=['csv', 'parquet'], dest='formats')
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--chunk-rows', type=int, default=250_000)
+    parser.add_argument('--sample', default=SAMPLE_PATH)
+    parser.add_argument('--output', default=None, help="Output path (only valid for a single size and format)")
+    args = parser.parse_args()
+
+    jobs = [(parse_size(rows), file_format) for rows in args.rows for file_format in args.formats]
+    if args.output and len(jobs) > 1:
+        parser.error("--output can only be used with a single size and format")
+
+    for rows, file_format in jobs:
+        path = generate_dataset(rows, seed=args.seed, file_format=file_format, path=args.output, sample_path=args.sample, chunk_rows=args.chunk_rows)
+        print(f"Wrote {rows:,} rows to {path}")
+
+if __name__ == '__main__':
+    main()
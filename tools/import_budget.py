@@ -0,0 +1,114 @@
+# import_budget
+#
+# Cold-start import time of the app pages, with a per-module breakdown and a budget check. Each page's module-level
+# imports are run in a fresh interpreter under `python -X importtime`, after Streamlit itself (which the server has
+# already loaded). Imports at the top of a page count towards its start-up time; imports further down (e.g. the
+# chart libraries, loaded once the KPIs are rendered) are reported as deferred.
+#
+#   python -m tools.import_budget --budget-ms 800 --repeats 5
+
+import argparse
+import ast
+import json
+import os
+import statistics
+import subprocess
+import sys
+
+PAGES = [
+    'billing_overview.py',
+    'pages/1_orders_and_revenue.py',
+    'pages/2_subscriptions_report.py',
+    'pages/3_churn_analysis.py',
+    'pages/4_diagnostics.py',
+]
+DEFAULT_BUDGET_MS = 800
+MARKER = 'import-budget-phase'
+
+
+def page_imports(path):
+    ## Splits the module-level import statements of a page into those before its first other statement (start-up)
+    ## and those after it (deferred).
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    start, deferred = [], []
+    started = False
+    for node in tree.body:
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            (deferred if started else start).append(ast.unparse(node))
+        elif not (isinstance(node, ast.Expr) and isinstance(node.value, ast.Constant)):
+            started = True
+    return start, deferred
+
+def measure_script(start, deferred):
+    lines = ['import sys', 'import streamlit']
+    for phase, statements in [('start', start), ('deferred', deferred)]:
+        lines.append(f'sys.stderr.write("{MARKER} {phase}\\n")')
+        lines.extend(statements)
+    return '\n'.join(lines)
+
+def parse_importtime(stderr):
+    # Returns {phase: {module: cumulative seconds}} for the modules each phase imported directly; modules they
+    # pulled in are part of those totals.
+    phases, phase = {}, None
+    for line in stderr.splitlines():
+        if line.startswith(MARKER):
+            phase = phases.setdefault(line.split()[1], {})
+        elif phase is not None and line.startswith('import time:') and not line.startswith('import time: self'):
+            _, cumulative, name = line[len('import time:'):].split('|')
+            if not name[1:].startswith(' '):
+                phase[name.strip()] = int(cumulative) / 1e6
+    return phases
+
+def measure_page(path, repeats):
+    start, deferred = page_imports(path)
+    script = measure_script(start, deferred)
+    runs = []
+    for _ in range(repeats):
+        result = subprocess.run([sys.executable, '-X', 'importtime', '-c', script], capture_output=True, text=True, cwd=os.getcwd())
+        if result.returncode != 0:
+            raise RuntimeError(f"Importing the modules of {path} failed:\n{result.stderr[-2000:]}")
+        runs.append(parse_importtime(result.stderr))
+
+    # Median over the runs per module; the first run also pays for writing bytecode caches
+    report = {'page': path}
+    for phase in ['start', 'deferred']:
+        modules = sorted({module for run in runs for module in run.get(phase, {})})
+        breakdown = {module: statistics.median(run.get(phase, {}).get(module, 0) for run in runs) for module in modules}
+        report[phase] = dict(sorted(breakdown.items(), key=lambda item: -item[1]))
+        report[f'{phase}_seconds'] = statistics.median(sum(run.get(phase, {}).values()) for run in runs)
+    return report
+
+def print_report(report, top):
+    print(f"{report['page']}: start {report['start_seconds'] * 1000:.0f} ms, deferred {report['deferred_seconds'] * 1000:.0f} ms")
+    for phase in ['start', 'deferred']:
+        for module, seconds in list(report[phase].items())[:top]:
+            print(f"  {phase:<8} {module:<40} {seconds * 1000:8.1f} ms")
+
+def main():
+    parser = argparse.ArgumentParser(description="Measure the cold-start import time of the app pages against a budget.")
+    parser.add_argument('--pages', nargs='*', default=PAGES)
+    parser.add_argument('--repeats', type=int, default=5, help="Fresh interpreters per page; the median is reported")
+    parser.add_argument('--budget-ms', type=float, default=DEFAULT_BUDGET_MS, help="Maximum start-up import time of a page")
+    parser.add_argument('--top', type=int, default=10, help="Modules listed per phase")
+    parser.add_argument('--output', default=None, help="Also write the results as JSON")
+    args = parser.parse_args()
+
+    reports = [measure_page(page, args.repeats) for page in args.pages]
+    over_budget = []
+    for report in reports:
+        print_report(report, args.top)
+        if report['start_seconds'] * 1000 > args.budget_ms:
+            over_budget.append(report['page'])
+
+    if args.output:
+        os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+        with open(args.output, 'w') as f:
+            json.dump({'budget_ms': args.budget_ms, 'results': reports}, f, indent=2)
+
+    for page in over_budget:
+        print(f"OVER BUDGET {page}: start-up imports exceed {args.budget_ms:.0f} ms")
+    sys.exit(1 if over_budget else 0)
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,284 @@
+# loadtest
+#
+# Concurrent-session load test of the app. A local Streamlit server is started on the dataset (or --url points at a
+# running one), and the simulated analysts connect to it over the same websocket protocol as the browser, so they share
+# the server's caches and dataset like real sessions do. Each session opens the app and then repeats a scripted
+# sequence of interactions (switch to one of the three report pages, change the date range, toggle a filter
+# multiselect) with an optional think time in between, until the run duration is over. For each concurrency level the
+# rerun latency percentiles (request sent to script finished), throughput (reruns per second), errors and the server's
+# RSS sampled over the run are printed and written as JSON.
+#
+#   python -m tools.loadtest --sessions 1 2 4 8 --duration 60 --rows 1M --slo-p95-ms 2000
+
+import argparse
+import asyncio
+import json
+import os
+import random
+import socket
+import subprocess
+import sys
+import time
+import urllib.request
+from datetime import date, timedelta
+import websockets
+from streamlit.proto.BackMsg_pb2 import BackMsg
+from streamlit.proto.ForwardMsg_pb2 import ForwardMsg
+from streamlit.proto.WidgetStates_pb2 import WidgetState
+from tools.benchmark import PAGES, REPORT_PAGES, environment, latency_summary, resolve_datasets
+
+DATE_LABEL = "(Required) Select your date range"
+RANGE_DAYS = [30, 90, 365, 730]
+ACTIONS = ['switch_page', 'date_range', 'toggle_filter']
+WIDGET_TYPES = ['multiselect', 'date_input']
+SERVER_START_TIMEOUT = 60
+
+
+## Server
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('localhost', 0))
+        return s.getsockname()[1]
+
+def start_server(path, port):
+    ## Runs the app on the dataset at path in a headless Streamlit server and waits until it is healthy.
+    command = [
+        sys.executable, '-m', 'streamlit', 'run', os.path.abspath(PAGES[0]),
+        '--server.headless', 'true', '--server.port', str(port), '--browser.gatherUsageStats', 'false',
+    ]
+    server = subprocess.Popen(command, env=dict(os.environ, BILLING_DATA_PATH=path), stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+    url = f'http://localhost:{port}'
+    deadline = time.monotonic() + SERVER_START_TIMEOUT
+    while time.monotonic() < deadline:
+        if server.poll() is not None:
+            raise RuntimeError(f"The Streamlit server exited with code {server.returncode}")
+        try:
+            with urllib.request.urlopen(f'{url}/_stcore/health', timeout=1):
+                return server, url
+        except OSError:
+            time.sleep(0.2)
+    server.terminate()
+    raise RuntimeError(f"The Streamlit server did not start within {SERVER_START_TIMEOUT}s")
+
+def process_tree(pid):
+    pids = [pid]
+    try:
+        with open(f'/proc/{pid}/task/{pid}/children') as f:
+            for child in f.read().split():
+                pids.extend(process_tree(int(child)))
+    except OSError:
+        pass
+    return pids
+
+def rss_bytes(pid):
+    # Resident set size of the server and its child processes (Linux /proc)
+    total = 0
+    for process in process_tree(pid):
+        try:
+            with open(f'/proc/{process}/status') as f:
+                total += next(int(line.split()[1]) * 1024 for line in f if line.startswith('VmRSS:'))
+        except (OSError, StopIteration):
+            pass
+    return total
+
+async def sample_rss(pid, interval, started, samples):
+    while True:
+        samples.append((round(time.perf_counter() - started, 3), rss_bytes(pid)))
+        await asyncio.sleep(interval)
+
+
+## Sessions
+
+def page_name(page):
+    # 'pages/1_orders_and_revenue.py' is served as 'orders_and_revenue'
+    return os.path.splitext(os.path.basename(page))[0].split('_', 1)[1]
+
+class Session:
+    ## One browser tab: knows the pages of the app, the widgets of the current page and the values given to them, and
+    ## sends the values with every rerun like the frontend does.
+
+    def __init__(self, websocket):
+        self.websocket = websocket
+        self.pages = {}
+        self.page_hash = ''
+        self.widgets = {}
+        self.values = {}
+
+    async def rerun(self):
+        ## Returns the seconds until the script finished and the messages of the exceptions it showed.
+        message = BackMsg()
+        message.rerun_script.query_string = ''
+        message.rerun_script.page_script_hash = self.page_hash
+        message.rerun_script.widget_states.widgets.extend(state for id, state in self.values.items() if id in self.widgets)
+        started = time.perf_counter()
+        await self.websocket.send(message.SerializeToString())
+
+        widgets, exceptions = {}, []
+        while True:
+            forward = ForwardMsg()
+            forward.ParseFromString(await self.websocket.recv())
+            kind = forward.WhichOneof('type')
+            if kind == 'navigation':
+                self.pages = {page.url_pathname: page.page_script_hash for page in forward.navigation.app_pages}
+            elif kind == 'delta' and forward.delta.WhichOneof('type') == 'new_element':
+                element = forward.delta.new_element
+                element_type = element.WhichOneof('type')
+                if element_type in WIDGET_TYPES:
+                    widget = getattr(element, element_type)
+                    widgets[widget.id] = (element_type, widget)
+                elif element_type == 'exception':
+                    exceptions.append(element.exception.message)
+            elif kind == 'script_finished':
+                self.widgets = widgets
+                return time.perf_counter() - started, exceptions
+
+    def widgets_of(self, element_type):
+        return [widget for kind, widget in self.widgets.values() if kind == element_type]
+
+    def set_value(self, widget, values):
+        state = WidgetState(id=widget.id)
+        state.string_array_value.data[:] = values
+        self.values[widget.id] = state
+
+    def switch_page(self, rng):
+        # The app carries the date range and filter selections over in its session state, not in the widget values
+        self.page_hash = self.pages[page_name(rng.choice(REPORT_PAGES))]
+        self.values = {}
+
+    def set_date_range(self, rng):
+        for widget in self.widgets_of('date_input'):
+            if widget.label == DATE_LABEL:
+                min_date, max_date = date.fromisoformat(widget.min), date.fromisoformat(widget.max)
+                start = max(min_date, max_date - timedelta(days=rng.choice(RANGE_DAYS)))
+                self.set_value(widget, [start.isoformat(), max_date.isoformat()])
+
+    def toggle_filter(self, rng):
+        # Clears a filter that has a selection, or selects one option of a filter that has none
+        filters = [widget for widget in self.widgets_of('multiselect') if widget.options]
+        if filters:
+            widget = rng.choice(filters)
+            selected = widget.id in self.values and self.values[widget.id].string_array_value.data
+            self.set_value(widget, [] if selected else [rng.choice(widget.options)])
+
+    def interact(self, action, rng):
+        {'switch_page': self.switch_page, 'date_range': self.set_date_range, 'toggle_filter': self.toggle_filter}[action](rng)
+
+async def run_session(url, index, seed, deadline, think_seconds, samples, errors):
+    ## One analyst: opens the app, then interacts until the deadline. Every rerun is appended to samples as
+    ## (seconds, action).
+    rng = random.Random(seed * 1000 + index)
+    stream = url.replace('http', 'ws', 1).rstrip('/') + '/_stcore/stream'
+    action = 'open'
+    try:
+        async with websockets.connect(stream, subprotocols=['streamlit'], max_size=None) as websocket:
+            session = Session(websocket)
+            while True:
+                seconds, exceptions = await session.rerun()
+                samples.append((seconds, action))
+                errors.extend(f"session {index} {action}: {message}" for message in exceptions)
+                if time.perf_counter() + think_seconds >= deadline:
+                    return
+                await asyncio.sleep(think_seconds)
+                # The landing page has no filters, so every session first switches to a report page
+                action = 'switch_page' if action == 'open' else rng.choice(ACTIONS)
+                session.interact(action, rng)
+    except Exception as error:
+        errors.append(f"session {index} {action}: {error!r}")
+
+async def run_level(url, pid, sessions, duration, think_seconds, seed, rss_interval):
+    samples, errors, rss = [], [], []
+    started = time.perf_counter()
+    sampler = asyncio.create_task(sample_rss(pid, rss_interval, started, rss)) if pid else None
+    await asyncio.gather(*[run_session(url, i, seed, started + duration, think_seconds, samples, errors) for i in range(sessions)])
+    elapsed = time.perf_counter() - started
+    if sampler:
+        sampler.cancel()
+
+    # Opening the app (the first run of a session) is reported apart from the interactive reruns
+    reruns = [seconds for seconds, action in samples if action != 'open']
+    opens = [seconds for seconds, action in samples if action == 'open']
+    return {
+        'sessions': sessions,
+        'elapsed_seconds': elapsed,
+        'reruns': len(reruns),
+        'throughput_per_second': len(reruns) / elapsed,
+        'latency_seconds': latency_summary(reruns) if reruns else None,
+        'open_latency_seconds': latency_summary(opens) if opens else None,
+        'errors': errors,
+        'rss_bytes': rss,
+        'peak_rss_bytes': max((bytes for _, bytes in rss), default=None),
+    }
+
+
+## Report
+
+def format_level(result):
+    name = f"{result['sessions']:>3} sessions"
+    latency = result['latency_seconds']
+    if latency is None:
+        return f"{name}  no reruns completed ({len(result['errors'])} errors)"
+    rss = f"{result['peak_rss_bytes'] / 2**20:8.1f}MiB" if result['peak_rss_bytes'] else '     n/a'
+    return (f"{name}  p50 {latency['p50'] * 1000:8.1f}ms  p95 {latency['p95'] * 1000:8.1f}ms  p99 {latency['p99'] * 1000:8.1f}ms"
+            f"  {result['throughput_per_second']:6.2f} reruns/s  peak RSS {rss}  errors {len(result['errors'])}")
+
+def within_slo(result, slo_p95_ms):
+    return result['latency_seconds'] is not None and not result['errors'] and result['latency_seconds']['p95'] * 1000 <= slo_p95_ms
+
+def main():
+    parser = argparse.ArgumentParser(description="Load test the billing app with concurrent simulated sessions.")
+    parser.add_argument('--sessions', nargs='*', type=int, default=[1, 2, 4, 8], help="Concurrency levels, run one after the other")
+    parser.add_argument('--duration', type=float, default=60, help="Seconds per concurrency level")
+    parser.add_argument('--think-seconds', type=float, default=0, help="Pause between the interactions of a session")
+    parser.add_argument('--rows', nargs='*', default=[], help="Generated dataset size to load test, e.g. 1M")
+    parser.add_argument('--dataset', nargs='*', default=[], help="Existing dataset file to load test")
+    parser.add_argument('--seed', type=int, default=42)
+    parser.add_argument('--url', default=None, help="Load test a running server (e.g. http://localhost:8501) instead of starting one")
+    parser.add_argument('--pid', type=int, default=None, help="Process id of the --url server, to sample its RSS")
+    parser.add_argument('--rss-interval', type=float, default=1.0, help="Seconds between RSS samples")
+    parser.add_argument('--slo-p95-ms', type=float, default=None, help="p95 rerun latency objective; exits non-zero if the first level misses it")
+    parser.add_argument('--output', default='benchmarks/loadtest.json')
+    args = parser.parse_args()
+
+    server, dataset = None, None
+    if args.url:
+        url, pid = args.url, args.pid
+    else:
+        dataset = resolve_datasets(args.rows, args.seed, args.dataset)[0]
+        server, url = start_server(dataset, free_port())
+        pid = server.pid
+    print(f"Load testing {dataset or url} for {args.duration:.0f}s per level...")
+
+    results = []
+    try:
+        for sessions in args.sessions:
+            result = asyncio.run(run_level(url, pid, sessions, args.duration, args.think_seconds, args.seed, args.rss_interval))
+            results.append(result)
+            print(format_level(result))
+    finally:
+        if server is not None:
+            server.terminate()
+            server.wait()
+
+    report = {'environment': environment(), 'url': args.url, 'dataset': dataset and os.path.basename(dataset),
+              'duration_seconds': args.duration, 'think_seconds': args.think_seconds, 'results': results}
+    if args.slo_p95_ms is not None:
+        # The highest concurrency level for which this and every lower level meet the objective
+        passing = 0
+        for result in sorted(results, key=lambda r: r['sessions']):
+            if not within_slo(result, args.slo_p95_ms):
+                break
+            passing = result['sessions']
+        report['slo'] = {'p95_ms': args.slo_p95_ms, 'max_sessions': passing}
+        print(f"Highest concurrency within the p95 objective of {args.slo_p95_ms:.0f}ms: {passing} sessions")
+
+    os.makedirs(os.path.dirname(args.output) or '.', exist_ok=True)
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=2)
+    print(f"Wrote {len(results)} concurrency levels to {args.output}")
+
+    failed = args.slo_p95_ms is not None and report['slo']['max_sessions'] < min(args.sessions)
+    sys.exit(1 if failed else 0)
+
+if __name__ == '__main__':
+    main()
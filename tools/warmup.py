@@ -0,0 +1,95 @@
+# warmup
+#
+# Precomputes the expensive state behind the report pages so the first visitor after a deploy or restart does not pay
+# for it: the dataset load, the derived segment and tenure columns and the filter option catalog (or the columnar copy
+# and filter options of the DuckDB backend), the subscription interval index and MRR ledger, and every aggregate of the
+# three report pages for the default view (last 365 days, no filters) at every chart granularity. Prints how long each
+# step took.
+#
+#   python -m tools.warmup                        # pre-deploy: fills the caches that outlive the process (columnar copy, disk cache)
+#   python -m tools.warmup --serve -- --server.port 8501
+#
+# With --serve the Streamlit server is started in the same process once the warm-up is done, so the in-memory
+# st.cache_data entries it computed are served to the first sessions.
+
+import argparse
+import os
+import sys
+import time
+import warnings
+from datetime import timedelta
+from functions import backend, metrics
+from functions.filters import filter_columns, filter_data, option_catalog, segmented
+from functions.query import data_path, data_sources, query_results
+
+APP_SCRIPT = 'billing_overview.py'
+
+
+def default_dates(min_created_at, max_created_at):
+    # The initial value of the date range input in functions.filters.date_range_input
+    return max(min_created_at, max_created_at - timedelta(days=365)), max_created_at
+
+def timed(report, step, func, *args):
+    started = time.perf_counter()
+    result = func(*args)
+    report.append((step, time.perf_counter() - started))
+    return result
+
+def warm_pandas(report):
+    data = timed(report, 'load dataset', query_results)
+    start, end = default_dates(data['created_at'].min(), data['created_at'].max())
+    data = timed(report, 'date filter', filter_data, start, end, data)
+    segmented_data = timed(report, 'derived columns', segmented, data)
+    timed(report, 'filter options', option_catalog, data)
+    return timed(report, 'prepare metrics input', metrics.prepare, segmented_data)
+
+def warm_duckdb(report):
+    path = timed(report, 'columnar source', backend.data_source)
+    token = backend.source_token(path)
+    start, end = default_dates(*timed(report, 'date bounds', backend.date_bounds, path, token))
+    for _, column, _ in filter_columns:
+        timed(report, f'filter options: {column}', backend.filter_options, path, token, start, end, (), column)
+    return backend.filtered(path, token, start, end, ())
+
+def warm_up():
+    ## Returns a list of (step, seconds). Runs outside a Streamlit session, so Streamlit's "no runtime" warnings are muted.
+    report = []
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore')
+        data = warm_duckdb(report) if backend.compute_backend() == 'duckdb' else warm_pandas(report)
+        timed(report, 'fingerprint', metrics.fingerprint, data)
+        for page in metrics.report_pages:
+            for name, (func, *args) in metrics.page_tasks(page, data).items():
+                timed(report, f'{page}: {name}', func, *args)
+            # The other chart granularities; metrics that do not depend on it are cached already
+            for granularity in metrics.granularities if page in metrics.granularity_pages else []:
+                if granularity != metrics.default_granularity:
+                    tasks = metrics.page_tasks(page, data, granularity=granularity).values()
+                    timed(report, f'{page}: {granularity.lower()} series', lambda: [func(*args) for func, *args in tasks])
+    return report
+
+def print_report(report):
+    width = max(len(step) for step, _ in report)
+    for step, seconds in report:
+        print(f"{step:<{width}}  {seconds:8.3f}s")
+    print(f"{'total':<{width}}  {sum(seconds for _, seconds in report):8.3f}s")
+
+def main():
+    parser = argparse.ArgumentParser(description="Warm the billing app caches and report the time of each step.")
+    parser.add_argument('--serve', action='store_true', help="Start the Streamlit server in this process after warming up")
+    parser.add_argument('streamlit_args', nargs=argparse.REMAINDER, help="Extra arguments for streamlit run (after --)")
+    args = parser.parse_args()
+
+    sources = data_sources()
+    data = ', '.join(f'{name}={path}' for name, path in sources) if sources else data_path()
+    print(f"Warming up {data} with the {backend.compute_backend()} backend...")
+    print_report(warm_up())
+
+    if args.serve:
+        from streamlit.web import cli
+
+        streamlit_args = [arg for arg in args.streamlit_args if arg != '--']
+        sys.exit(cli.main(args=['run', os.path.join(os.getcwd(), APP_SCRIPT), *streamlit_args]))
+
+if __name__ == '__main__':
+    main()